@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# bench_import.py: Import-time regression benchmark
+#
+# Times a cold ``import topspin_to_python`` in fresh interpreters and fails
+# if it takes longer than a budget or pulls in plotting/fitting libraries,
+# which the core read/FT path must not need.
+#
+#   python benchmarks/bench_import.py [--repeat 5] [--max-time 0.5]
+
+
+## IMPORTS ####################################################################
+from __future__ import print_function
+import argparse
+import subprocess
+import sys
+
+#modules the core package must not import
+HEAVY_MODULES = ['matplotlib','scipy']
+
+_PROBE = """
+import sys,time
+t = time.time()
+import {module}
+t = time.time()-t
+print(t)
+print(','.join(sorted(set(m.split('.')[0] for m in sys.modules) & set({heavy!r}))))
+"""
+
+
+## METHODS ####################################################################
+def time_import(module='topspin_to_python',repeat=5,python=sys.executable):
+    """
+    Time importing a module in fresh interpreters.
+
+    :param module: Module to import
+    :type module: str
+    :param repeat: Number of interpreters to time, the fastest is reported
+    :type repeat: int
+    :param python: Interpreter to run
+    :type python: str
+    :return: fastest import time in seconds, heavy modules imported along with it
+    :rtype: float,list
+    :raises subprocess.CalledProcessError: if the import fails, with its
+            traceback as output
+    """
+    probe = _PROBE.format(module=module,heavy=HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.Popen([python,'-c',probe],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = proc.communicate()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode,python,output=err)
+        out = out.decode('utf-8').splitlines()
+        times.append(float(out[0]))
+        heavy = [m for m in out[1].split(',') if m]
+    return min(times),heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import-time regression benchmark')
+    parser.add_argument('--module',default='topspin_to_python')
+    parser.add_argument('--repeat',type=int,default=5)
+    parser.add_argument('--max-time',type=float,default=0.5,
+                        help='import time budget in seconds')
+    args = parser.parse_args(argv)
+
+    try:
+        import_time,heavy = time_import(args.module,args.repeat)
+    except subprocess.CalledProcessError as e:
+        print('import {0}: FAIL'.format(args.module))
+        print(e.output.decode('utf-8',errors='replace').rstrip())
+        return 1
+    print('import {0}: {1:.1f} ms'.format(args.module,import_time*1E3))
+    failed = False
+    if heavy:
+        print('FAIL: imported {0}'.format(', '.join(heavy)))
+        failed = True
+    if import_time > args.max_time:
+        print('FAIL: over the {0:.1f} ms budget'.format(args.max_time*1E3))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# run.py: Stage benchmarks over synthetic experiments
+#
+# Generates synthetic experiment folders of each requested size, times every
+# processing stage, reports throughput and peak memory and saves the results
+# as JSON so runs can be compared over time.
+#
+#   python -m benchmarks.run --sizes 16384,262144 --rows 1,64 --compare old.json
+
+
+## IMPORTS ####################################################################
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc, peak memory is then not measured
+    tracemalloc = None
+
+import numpy as np
+
+from topspin_to_python.acqu_pars import read_acqu_pars
+from topspin_to_python.experiment_reader import read_experiment
+from topspin_to_python.fid import read_fid, read_ser
+from benchmarks.synthetic import write_experiment
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'results')
+
+
+## METHODS ####################################################################
+def measure(fn,repeat=3):
+    """
+    Best wall time of fn over repeat calls and the peak memory traced while
+    running it once, where tracemalloc is available.
+
+    :param fn: Function of no arguments
+    :type fn: callable
+    :param repeat: Number of timed calls
+    :type repeat: int
+    :return: best time in seconds, peak traced memory in bytes (None without
+            tracemalloc), fn's result
+    :rtype: float,int,object
+    """
+    if tracemalloc is None:
+        result,peak = fn(),None
+    else:
+        tracemalloc.start()
+        try:
+            result = fn()
+            _,peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    best = float('inf')
+    for _ in range(repeat):
+        t = timeit.default_timer()
+        fn()
+        best = min(best,timeit.default_timer()-t)
+    return best,peak,result
+
+
+def stage_functions(exp_fp,td,n_rows,bytorda,dtypa,sw_h):
+    """
+    (stage name,function) pairs to benchmark on one experiment, each stage
+    starting from the result of the previous ones.
+    """
+    raw_fp = os.path.join(exp_fp,'fid' if n_rows is None else 'ser')
+    times = np.arange(td//2)/float(sw_h)
+    if n_rows is None:
+        decode = lambda: read_fid(raw_fp,times=times,bytorda=bytorda,dtypa=dtypa)
+    else:
+        decode = lambda: read_ser(raw_fp,td,times=times,bytorda=bytorda,dtypa=dtypa)
+    fid = decode()
+    ft = fid.ft()
+    # FT.fit_lorentzian fits a single spectrum, so a ser is fitted row by row
+    row_fts = [ft] if n_rows is None else [row.ft() for row in fid]
+    region = (-0.25*sw_h,-0.15*sw_h)
+    return [
+        ('parse',lambda: read_acqu_pars(os.path.join(exp_fp,'acqus'))),
+        ('decode',decode),
+        ('fft',lambda: fid.ft()),
+        ('phase',lambda: ft.apk(left=region[0],right=region[1])),
+        ('integrate',lambda: ft.integrate(*region)),
+        ('fit_lorentzian',lambda: [row_ft.fit_lorentzian(*region,width_guess=20.) for row_ft in row_fts]),
+        ('fit',lambda: ft.fit_lorentzians(*region,width_guess=20.)),
+        ('read_experiment',lambda: read_experiment(exp_fp+os.sep)),
+    ]
+
+
+def run(sizes,rows,dtypas=(0,),bytordas=(1,),sw_h=10000.,repeat=3,work_dir=None):
+    """
+    Benchmark every stage over synthetic experiments of each configuration.
+
+    :param sizes: TD values to generate
+    :type sizes: list
+    :param rows: Number of ser rows, None for a 1D fid
+    :type rows: list
+    :param dtypas: Raw data types to generate (0 int32, 2 float64)
+    :type dtypas: list
+    :param bytordas: Raw byte orders to generate (0 little, 1 big endian)
+    :type bytordas: list
+    :param sw_h: Spectral width in Hz
+    :type sw_h: float
+    :param repeat: Number of timed calls per stage
+    :type repeat: int
+    :param work_dir: Directory to generate experiments in, a temporary directory by default
+    :type work_dir: str
+    :return: one record per configuration and stage
+    :rtype: list
+    """
+    own_dir = work_dir is None
+    if own_dir:
+        work_dir = tempfile.mkdtemp(prefix='topspin_bench_')
+    records = []
+    try:
+        for td in sizes:
+            for n_rows in rows:
+                for dtypa in dtypas:
+                    for bytorda in bytordas:
+                        exp_fp = os.path.join(work_dir,'{0}_{1}_{2}_{3}'.format(td,n_rows,dtypa,bytorda))
+                        write_experiment(exp_fp,td=td,sw_h=sw_h,n_rows=n_rows,
+                                         bytorda=bytorda,dtypa=dtypa)
+                        raw_fp = os.path.join(exp_fp,'fid' if n_rows is None else 'ser')
+                        raw_bytes = os.path.getsize(raw_fp)
+                        for stage,fn in stage_functions(exp_fp,td,n_rows,bytorda,dtypa,sw_h):
+                            seconds,peak,_ = measure(fn,repeat)
+                            records.append({'stage':stage,'td':td,'rows':n_rows or 1,
+                                             'dtypa':dtypa,'bytorda':bytorda,
+                                             'seconds':seconds,'peak_bytes':peak,
+                                             'mb_per_s':raw_bytes/seconds/1E6,
+                                             'spectra_per_s':(n_rows or 1)/seconds})
+                        shutil.rmtree(exp_fp)
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir,ignore_errors=True)
+    return records
+
+
+def _record_key(record):
+    return (record['stage'],record['td'],record['rows'],record['dtypa'],record['bytorda'])
+
+
+def report(records,baseline=None):
+    """
+    Print a results table, with the speedup over baseline records if given.
+    """
+    previous = {}
+    if baseline is not None:
+        previous = dict((_record_key(r),r) for r in baseline)
+    header = '{0:<16}{1:>9}{2:>6}{3:>4}{4:>4}{5:>12}{6:>11}{7:>12}{8:>10}'.format(
+        'stage','td','rows','dt','bo','ms','MB/s','peak MB','speedup')
+    print(header)
+    print('-'*len(header))
+    for r in records:
+        old = previous.get(_record_key(r))
+        speedup = '{0:.2f}x'.format(old['seconds']/r['seconds']) if old else ''
+        peak = 'n/a' if r['peak_bytes'] is None else '{0:.2f}'.format(r['peak_bytes']/1E6)
+        print('{0:<16}{1:>9}{2:>6}{3:>4}{4:>4}{5:>12.3f}{6:>11.1f}{7:>12}{8:>10}'.format(
+            r['stage'],r['td'],r['rows'],r['dtypa'],r['bytorda'],r['seconds']*1E3,
+            r['mb_per_s'],peak,speedup))
+
+
+def save(records,fp=None):
+    """
+    Save records with details of the machine and library versions.
+
+    :param fp: JSON file, by default a timestamped file in :any:`RESULTS_DIR`
+    :type fp: str
+    :return: file the results were saved to
+    :rtype: str
+    """
+    if fp is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        fp = os.path.join(RESULTS_DIR,time.strftime('%Y%m%d-%H%M%S')+'.json')
+    results = {'time':time.time(),'python':platform.python_version(),
+               'numpy':np.__version__,'machine':platform.platform(),
+               'records':records}
+    with open(fp,'w') as f:
+        json.dump(results,f,indent=1)
+    return fp
+
+
+def _rows_list(text):
+    return [None if v == '1' else int(v) for v in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stage benchmarks over synthetic experiments')
+    parser.add_argument('--sizes',default='16384,262144',
+                        help='comma separated TD values')
+    parser.add_argument('--rows',default='1,32',
+                        help='comma separated ser row counts, 1 for a 1D fid')
+    parser.add_argument('--dtypa',default='0',help='comma separated DTYPA values')
+    parser.add_argument('--bytorda',default='1',help='comma separated BYTORDA values')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--work-dir',default=None,
+                        help='local directory to generate experiments in')
+    parser.add_argument('--output',default=None,help='JSON file to save results to')
+    parser.add_argument('--compare',default=None,help='JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    records = run([int(v) for v in args.sizes.split(',')],_rows_list(args.rows),
+                  [int(v) for v in args.dtypa.split(',')],
+                  [int(v) for v in args.bytorda.split(',')],
+                  repeat=args.repeat,work_dir=args.work_dir)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['records']
+    report(records,baseline)
+    print('saved to {0}'.format(save(records,args.output)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
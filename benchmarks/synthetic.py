@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# synthetic.py: Generator of synthetic TopSpin experiment folders
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'synthetic_fid','write_acqus','write_raw','write_experiment'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+
+#TopSpin pads every row of a ser file to a multiple of this many bytes
+BLOCK_SIZE = 1024
+
+
+## METHODS ####################################################################
+def synthetic_fid(td,sw_h,peaks=((1.,0.,50.,1000.),),noise=0.01,n_rows=None,seed=0):
+    """
+    Sum of decaying complex exponentials, whose spectra are lorentzian lines, plus
+    complex gaussian noise.
+
+    :param td: Number of raw (real+imaginary) points per fid
+    :type td: int
+    :param sw_h: Spectral width in Hz
+    :type sw_h: float
+    :param peaks: (Amplitude,phase,width,location) of each line, as fit by
+                :any:`data_analysis_fns.fit_lorentzians`
+    :type peaks: list
+    :param noise: Standard deviation of the noise relative to the largest amplitude
+    :type noise: float
+    :param n_rows: Number of fids to stack, None for a single fid. Rows
+                have increasing phase so that each needs phasing
+    :type n_rows: int
+    :param seed: Random seed of the noise
+    :type seed: int
+    :return: complex fid(s) with shape (td/2,) or (n_rows,td/2)
+    :rtype: :class:`numpy.ndarray`
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(td//2)/float(sw_h)
+    fid = np.zeros(td//2,dtype=np.complex128)
+    for A,phase,w,x0 in peaks:
+        fid += A*np.exp(1j*phase)*np.exp((2j*np.pi*x0-np.pi*w)*t)
+    if n_rows is not None:
+        fid = fid*np.exp(1j*np.linspace(0,np.pi,n_rows))[:,np.newaxis]
+    scale = noise*max(A for A,_,_,_ in peaks)
+    fid = fid+scale*(rng.standard_normal(fid.shape)+1j*rng.standard_normal(fid.shape))
+    return fid
+
+
+def write_acqus(fp,pars):
+    """
+    Write a TopSpin JCAMP-DX parameter file.
+
+    :param fp: File path
+    :type fp: str
+    :param pars: {name:value}. Strings are written in <>, sequences as (0..N) arrays
+    :type pars: dict
+    """
+    lines = ['##TITLE= Parameter file, synthetic','##JCAMPDX= 5.0',
+             '##DATATYPE= Parameter Values','##ORIGIN= topspin_to_python benchmarks']
+    for name in sorted(pars):
+        value = pars[name]
+        if isinstance(value,str):
+            lines.append('##${0}= <{1}>'.format(name,value))
+        elif np.ndim(value) > 0:
+            lines.append('##${0}= (0..{1})'.format(name,len(value)-1))
+            lines.append(' '.join(str(v) for v in value))
+        else:
+            lines.append('##${0}= {1}'.format(name,value))
+    lines.append('##END=')
+    with open(fp,'w') as f:
+        f.write('\n'.join(lines)+'\n')
+
+
+def write_raw(fp,fid,bytorda=1,dtypa=0,block_size=BLOCK_SIZE,append=False):
+    """
+    Write fid(s) as TopSpin interleaved raw data. Stacked fids are written
+    as a ser file, each row padded to a multiple of block_size bytes.
+
+    :param fp: File path
+    :type fp: str
+    :param fid: complex fid(s) with shape (n,) or (n_rows,n)
+    :type fid: :class:`numpy.ndarray`
+    :param bytorda: Byte order (0 little endian, 1 big endian)
+    :type bytorda: int
+    :param dtypa: Data type (0 int32, 2 float64)
+    :type dtypa: int
+    :param block_size: Row padding in bytes for stacked fids
+    :type block_size: int
+    :param append: Whether to append the rows to the file, as a running
+                acquisition does
+    :type append: bool
+    """
+    raw_dtype = np.dtype({0:'<',1:'>'}[bytorda]+{0:'i4',2:'f8'}[dtypa])
+    rows = np.atleast_2d(fid)
+    td = 2*rows.shape[-1]
+    row_size = td
+    if fid.ndim > 1 and block_size:
+        row_size = -(-td*raw_dtype.itemsize//block_size)*block_size//raw_dtype.itemsize
+    raw = np.zeros((rows.shape[0],row_size),dtype=raw_dtype)
+    interleaved = rows.view(np.float64) if rows.dtype == np.complex128 else \
+        rows.astype(np.complex128).view(np.float64)
+    if dtypa == 0:
+        interleaved = np.round(interleaved)
+    raw[:,:td] = interleaved
+    with open(fp,'ab' if append else 'wb') as f:
+        f.write(raw.tobytes())
+
+
+def write_experiment(exp_fp,td=65536,sw_h=10000.,sfo1=400.13,n_rows=None,bytorda=1,dtypa=0,
+    peaks=None,noise=0.01,seed=0):
+    """
+    Write a synthetic TopSpin experiment folder with acqu/acqus and a fid (or
+    ser when n_rows is given).
+
+    :param exp_fp: Experiment folder, created if needed
+    :type exp_fp: str
+    :param td: Number of raw (real+imaginary) points per fid
+    :type td: int
+    :param sw_h: Spectral width in Hz
+    :type sw_h: float
+    :param sfo1: Observe frequency in MHz
+    :type sfo1: float
+    :param n_rows: Number of ser rows, None for a 1D fid
+    :type n_rows: int
+    :param bytorda: Byte order (0 little endian, 1 big endian)
+    :type bytorda: int
+    :param dtypa: Data type (0 int32, 2 float64)
+    :type dtypa: int
+    :param peaks: (Amplitude,phase,width,location) of each line. By default
+                three lines filling a good part of the int32 range
+    :type peaks: list
+    :param noise: Noise standard deviation relative to the largest amplitude
+    :type noise: float
+    :param seed: Random seed of the noise
+    :type seed: int
+    :return: experiment folder
+    :rtype: str
+    """
+    if peaks is None:
+        peaks = [(1E8,0.3,20.,-0.2*sw_h),(5E7,0.3,40.,0.05*sw_h),(2E7,0.3,10.,0.3*sw_h)]
+    if not os.path.isdir(exp_fp):
+        os.makedirs(exp_fp)
+    fid = synthetic_fid(td,sw_h,peaks,noise,n_rows,seed)
+
+    recchan = [0]*16
+    recchan[1] = 1
+    pars = {'TD':td,'SW_h':sw_h,'SW':sw_h/sfo1,'BYTORDA':bytorda,'DTYPA':dtypa,
+            'RECCHAN':recchan,'PULPROG':'zg','DIGMOD':1,'DSPFVS':20,'DECIM':1,
+            'GRPDLY':0,'AQ_mod':3,'NS':1,'DS':0,'TE':298.}
+    for i in range(1,9):
+        pars['SFO{0}'.format(i)] = sfo1 if i == 1 else 0.
+        pars['BF{0}'.format(i)] = sfo1 if i == 1 else 0.
+        pars['NUC{0}'.format(i)] = '1H' if i == 1 else 'off'
+        pars['O{0}'.format(i)] = 0.
+    for name in ('acqu','acqus'):
+        write_acqus(os.path.join(exp_fp,name),pars)
+    if n_rows is None:
+        write_raw(os.path.join(exp_fp,'fid'),fid,bytorda,dtypa)
+    else:
+        for name in ('acqu2','acqu2s'):
+            write_acqus(os.path.join(exp_fp,name),{'TD':n_rows})
+        write_raw(os.path.join(exp_fp,'ser'),fid,bytorda,dtypa)
+    return exp_fp
@@ -32,8 +32,6 @@ if os.path.exists(VERSION_TARGET):
 
 write_version()
 
-from distutils.core import setup
-
 setup(
     name='topspin_to_python',
     version=VERSION,
@@ -45,6 +43,11 @@ setup(
     packages=[
         'topspin_to_python'
     ],
+    entry_points={
+        'console_scripts':[
+            'topspin-convert = topspin_to_python.convert:main'
+        ]
+    },
     install_requires=[
         'numpy',
         'scipy',
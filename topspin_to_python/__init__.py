@@ -8,9 +8,18 @@
 ## IMPORTS ####################################################################
 
 from topspin_to_python.acqu_pars import *
+from topspin_to_python.cache import *
+from topspin_to_python.catalog import *
+from topspin_to_python.columnar import *
 from topspin_to_python.data_analysis_fns import * 
 from topspin_to_python.experiment_reader import *
-from topspin_to_python.fid import * 
+from topspin_to_python.fid import *
+from topspin_to_python.packing import *
+from topspin_to_python.pdata import *
+from topspin_to_python.peaks import *
+from topspin_to_python.processing import * 
+from topspin_to_python.reductions import *
+from topspin_to_python.watcher import *
 
 
 
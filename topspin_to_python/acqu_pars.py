@@ -8,69 +8,125 @@
 __all__ = [
 	'read_acqu_pars',
 	'prune_acqu_pars',
-	'format_acqu_pars'
+	'format_acqu_pars',
+	'AcquSchema'
 ]
 
 ## IMPORTS ####################################################################
 import numpy as np
-from jcamp import JCAMP_reader
 import re 
+import numbers
 import prune_lists
-import copy 
-def read_acqu_pars(fp):
+import instrumentation
+
+_ARRAY_RE = re.compile(r'^\((\d+)\.\.(\d+)\)(.*)$')
+_STRING_RE = re.compile(r'<([^>]*)>')
+
+@instrumentation.timed('parse_acqu')
+def read_acqu_pars(fp,keys=None):
 	"""
-	Read acquisition parameters from JCAMP-DX file 
-	:param fp: File or string of fid
+	Read acquisition parameters from a TopSpin JCAMP-DX file (acqu, acqus, ...).
+	Parameter names are lower cased with any leading $ removed. Numbers 
+	are returned as int/float, ``(0..N)`` arrays as numpy arrays (or lists 
+	of strings) and ``<...>`` strings without their brackets.
+
+	:param fp: File or string of the parameter file
 	:type fp: file,str
+	:param keys: Parameters to read, e.g. ``['td','sw_h','sfo1']``. Parsing 
+				stops as soon as all of them have been found. By default 
+				all parameters are read.
+	:type keys: list
 
-	:returns: FID as complexnumpy array
+	:returns: acquisition parameters dictionary
 	:rtype: dict  
 	"""
-	
-	acqu_dict = JCAMP_reader(fp)
-	#many parameters have $ prepending
-	#we need to remove them 
-	acqu_dict = { re.sub('^\$','',k):v for k,v in acqu_dict.items()}
+	remaining = None
+	if keys is not None:
+		remaining = set(k.lstrip('$').lower() for k in keys)
 
+	own_file = not hasattr(fp,'read')
+	f = open(fp) if own_file else fp
+	acqu_dict = {}
+	key,lines = None,[]
+	try:
+		for line in f:
+			if line.startswith('##'):
+				if key is not None:
+					acqu_dict[key] = _parse_jcamp_value(lines)
+					key = None
+				if remaining is not None and not remaining:
+					break
+				name,_,value = line[2:].partition('=')
+				name = name.strip().lstrip('$').lower()
+				if remaining is None or name in remaining:
+					key,lines = name,[value]
+					if remaining is not None:
+						remaining.discard(name)
+			elif key is not None and not line.startswith('$$'):
+				lines.append(line)
+		if key is not None:
+			acqu_dict[key] = _parse_jcamp_value(lines)
+	finally:
+		if own_file:
+			f.close()
 
 	return acqu_dict
 
+
+def _parse_jcamp_value(lines):
+	"""
+	Convert the text of a JCAMP-DX parameter (first line after the = and any
+	continuation lines) to a python/numpy value.
+	"""
+	# drop trailing $$ comments, e.g. ##NPOINTS= 9	$$ modification sequence number
+	first = lines[0].split('$$')[0].strip()
+	array = _ARRAY_RE.match(first)
+	if array:
+		text = ' '.join([array.group(3)]+[l.strip() for l in lines[1:]])
+		if '<' in text:
+			return _STRING_RE.findall(text)
+		values = text.split()
+		try:
+			return np.array(values,dtype=int)
+		except ValueError:
+			return np.array(values,dtype=float)
+	text = ' '.join([first]+[l.strip() for l in lines[1:]]).strip()
+	if text.startswith('<') and text.endswith('>'):
+		return text[1:-1]
+	return _parse_number(text)
+
+
+def _parse_number(text):
+	"""
+	Parse text as an int or float, falling back to the text itself.
+	"""
+	try:
+		return int(text)
+	except ValueError:
+		pass
+	try:
+		return float(text)
+	except ValueError:
+		return text
+
 	 
 def format_acqu_pars(acqu_dict,reform_pars=prune_lists.DEFAULT_REFORMAT_PARS):
 	"""
-	Remove what I see as the unneeded acqusition parameters.
-	If I did wrong with defaults, please submit a PR explaining what you need
-	normally.
+	Group numbered acquisition parameter families together, see :class:`AcquSchema`.
 
 	:param acqu_dict: acquisition parameters dictionary
 	:type acqu_dict: dict
-	:param reform_pars: list of key-strings headers to group together in dicts. 
-						Ie. sf01,sfo2,... to sfo:{1:...,2:...,...}
+	:param reform_pars: list of key-strings headers to group together. 
+						Ie. sf01,sfo2,... to sfo:array([nan,sfo1,sfo2,...])
 	:type reform_pars: list
-	:returns: pruned acquistion parameter dictionary
+	:returns: formatted acquistion parameter dictionary
 	:rtype: dict
 	"""		
-	copied_acqu_dict = copy.deepcopy(acqu_dict)
-	for k,v in acqu_dict.iteritems():
-		reform = [ i for i,rp in enumerate(reform_pars) if k.startswith(rp)]
-		if len(reform) > 0:
-			rep_k = reform_pars[reform[0]]
-			rep_dict = copied_acqu_dict.get(rep_k,{})
-			if type(rep_dict) not in (dict,None):
-				rep_dict = {} 
-			new_key =  k[len(rep_k):]
-			if new_key.isdigit():
-				new_key = int(new_key)
-			if type(rep_dict) is str:
-				import pdb
-				pdb.set_trace()
-			rep_dict[new_key] = v
-
-			copied_acqu_dict[rep_k] = rep_dict 
-			copied_acqu_dict.pop(k)
-			
-
-	return copied_acqu_dict
+	if reform_pars is prune_lists.DEFAULT_REFORMAT_PARS:
+		schema = DEFAULT_SCHEMA
+	else:
+		schema = AcquSchema((),reform_pars)
+	return schema.apply(acqu_dict,prune=False)
 
 
 def prune_acqu_pars(acqu_dict,prune_pars=prune_lists.DEFAULT_PRUNE_PARS):
@@ -87,8 +143,118 @@ def prune_acqu_pars(acqu_dict,prune_pars=prune_lists.DEFAULT_PRUNE_PARS):
 	:returns: pruned acquistion parameter dictionary
 	:rtype: dict
 	"""
-	copied_acqu_dict = copy.deepcopy(acqu_dict)
-	for par in prune_pars:
-		copied_acqu_dict.pop(par, None)
+	prune_pars = set(prune_pars)
+	return {k:v for k,v in acqu_dict.items() if k not in prune_pars}
+
+
+class AcquSchema(object):
+	"""
+	Precompiled prune/format schema for acquisition parameters. Build it once
+	and apply it to many parameter dictionaries; pruning and grouping are 
+	done in a single pass without copying any values.
+
+	Parameters named by a family header followed by a number (sfo1,sfo2,...) 
+	are grouped into a dense numpy array indexed by that number, with nan
+	(or '' for strings) where a number is missing, so sfo1 is ``['sfo'][1]``.
+	A parameter named exactly like its family header is stored at index 0 
+	when that is free. Families whose values are not all numbers or all 
+	strings are grouped into a dict keyed by number instead.
+
+	:param prune_pars: list of key-strings to remove
+	:type prune_pars: list
+	:param reform_pars: list of key-strings headers to group together, earlier
+						headers taking precedence
+	:type reform_pars: list
+	"""
+
+	def __init__(self,prune_pars=prune_lists.DEFAULT_PRUNE_PARS,
+		reform_pars=prune_lists.DEFAULT_REFORMAT_PARS):
+		self._prune_pars = frozenset(prune_pars)
+		self._trie = {}
+		for rank,rp in enumerate(reform_pars):
+			node = self._trie
+			for ch in rp:
+				node = node.setdefault(ch,{})
+			node.setdefault(None,rank)
+
+	def family(self,key):
+		"""
+		Family header and index of a parameter name, or None if it is not grouped.
+
+		:param key: parameter name
+		:type key: str
+		:returns: family header, index (int, or '' for the header itself)
+		:rtype: tuple
+		"""
+		node,best = self._trie,None
+		for i in range(len(key)+1):
+			rank = node.get(None)
+			suffix = key[i:]
+			if rank is not None and (suffix == '' or suffix.isdigit()) and \
+				(best is None or rank < best[0]):
+				best = (rank,key[:i],int(suffix) if suffix else '')
+			if i == len(key):
+				break
+			node = node.get(key[i])
+			if node is None:
+				break
+		if best is None:
+			return None
+		return best[1:]
+
+	def apply(self,acqu_dict,prune=True,format=True):
+		"""
+		Prune and/or format an acquisition parameters dictionary.
+
+		:param acqu_dict: acquisition parameters dictionary
+		:type acqu_dict: dict
+		:param prune: Whether to remove the prune parameters
+		:type prune: bool
+		:param format: Whether to group parameter families
+		:type format: bool
+		:returns: new acquistion parameter dictionary sharing values with acqu_dict
+		:rtype: dict
+		"""
+		result = {}
+		families = {}
+		for k,v in acqu_dict.items():
+			if prune and k in self._prune_pars:
+				continue
+			fam = self.family(k) if format else None
+			if fam is None:
+				result[k] = v
+			else:
+				families.setdefault(fam[0],{})[fam[1]] = v
+
+		for header,members in families.items():
+			if list(members) == ['']:
+				result[header] = members['']
+			else:
+				result[header] = _dense_family(members)
+		return result
+
+
+def _dense_family(members):
+	"""
+	Pack a {number:value} parameter family into a dense numpy array if its 
+	values are all numbers or all strings, else return it as a dict.
+	"""
+	members = dict(members)
+	if '' in members:
+		if 0 in members:
+			return members
+		members[0] = members.pop('')
+	values = list(members.values())
+	if all(isinstance(v,numbers.Real) and not isinstance(v,bool) for v in values):
+		dense = np.full(max(members)+1,np.nan)
+	elif all(isinstance(v,str) for v in values):
+		dense = np.full(max(members)+1,'',dtype=object)
+	else:
+		return members
+	dense[list(members)] = values
+	if dense.dtype == object:
+		dense = dense.astype(str)
+	return dense
+
 
-	return copied_acqu_dict
\ No newline at end of file
+DEFAULT_SCHEMA = AcquSchema()
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# cache.py: Persistent on-disk cache of parsed experiments
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'ExperimentCache'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import shutil
+import hashlib
+import tempfile
+import pickle
+from fid import FID, FIDStack, _uniform_axis
+
+#experiment files whose modification time and size key a cache entry
+SOURCE_FILES = ['acqu','acqus','fid','ser','fid.packed','ser.packed']
+
+
+## CLASSES ####################################################################
+class ExperimentCache(object):
+    """
+    Persistent on-disk cache of experiments read by :any:`experiment_reader.read_experiment`.
+
+    Each entry stores the parsed acquisition parameters and the time axis
+    (start time and dwell) in a small pickle and the decoded fid as a
+    ``.npy`` file, so a hit memory-maps the fid rather than decoding it.
+    Every hit marks the entry as used. Entries are keyed by the experiment path and
+    the read options, and are invalidated when the modification time or size
+    of any of the experiment's acqu/acqus/fid/ser files changes. When the
+    cache grows beyond max_size the least recently used entries are evicted.
+
+    :param cache_dir: Directory to store the cache in, created if needed
+    :type cache_dir: str
+    :param max_size: Maximum total size of the cache in bytes
+    :type max_size: int
+    """
+
+    def __init__(self,cache_dir,max_size=2**30):
+        self._cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def get(self,exp_fp,**options):
+        """
+        Cached experiment, or None if there is no valid entry.
+
+        :param exp_fp: File path to experiment folder
+        :type exp_fp: str
+        :param \**options: Options the experiment was read with
+        :return: experiment dictionary with memory-mapped fid
+        :rtype: dict
+        """
+        entry = self._entry_dir(exp_fp,options)
+        meta_fp = os.path.join(entry,'meta.pkl')
+        try:
+            with open(meta_fp,'rb') as f:
+                meta = pickle.load(f)
+        except (IOError,OSError,EOFError,pickle.UnpicklingError):
+            return None
+        if meta['stamp'] != source_stamp(exp_fp):
+            _remove(entry)
+            return None
+
+        experiment = {'acqu':meta['acqu']}
+        if meta['fid'] is not None:
+            fid_type,sfo,t0,dwell = meta['fid']
+            try:
+                fid = np.load(os.path.join(entry,'fid.npy'),mmap_mode='r')
+            except (IOError,OSError,ValueError):
+                return None
+            fid_type = FIDStack if fid_type == 'FIDStack' else FID
+            experiment['fid'] = fid_type(fid,meta.get('times'),sfo,copy=False,dwell=dwell,t0=t0)
+        #the metadata modification time records the last use, for evict
+        try:
+            os.utime(meta_fp,None)
+        except OSError:
+            pass
+        return experiment
+
+    def put(self,exp_fp,experiment,**options):
+        """
+        Store an experiment, replacing any previous entry, and evict least
+        recently used entries if the cache is over its maximum size.
+
+        :param exp_fp: File path to experiment folder
+        :type exp_fp: str
+        :param experiment: experiment dictionary, see :any:`experiment_reader.read_experiment`
+        :type experiment: dict
+        :param \**options: Options the experiment was read with
+        """
+        entry = self._entry_dir(exp_fp,options)
+        meta = {'stamp':source_stamp(exp_fp),'acqu':experiment['acqu'],'fid':None}
+        tmp = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            fid = experiment.get('fid')
+            if fid is not None:
+                np.save(os.path.join(tmp,'fid.npy'),fid.fid)
+                meta['fid'] = (type(fid).__name__,fid.sfo,fid.t0,fid.dwell)
+                if _uniform_axis(fid.times) is None:
+                    meta['times'] = np.asarray(fid.times)
+            with open(os.path.join(tmp,'meta.pkl'),'wb') as f:
+                pickle.dump(meta,f,pickle.HIGHEST_PROTOCOL)
+            _remove(entry)
+            os.rename(tmp,entry)
+        except:
+            _remove(tmp)
+            raise
+        self.evict()
+
+    def size(self):
+        """
+        Total size of the cache entries in bytes
+        """
+        return sum(size for _,size,_ in self._entries())
+
+    def evict(self,max_size=None):
+        """
+        Remove least recently used entries until the cache is within max_size.
+
+        :param max_size: Size to evict down to in bytes, by default the cache's maximum size
+        :type max_size: int
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = sorted(self._entries())
+        total = sum(size for _,size,_ in entries)
+        for _,size,entry in entries:
+            if total <= max_size:
+                break
+            _remove(entry)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all cache entries
+        """
+        self.evict(0)
+
+    def _entry_dir(self,exp_fp,options):
+        key = repr((os.path.abspath(exp_fp),sorted(options.items())))
+        return os.path.join(self.cache_dir,hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _entries(self):
+        """
+        (last use,size,directory) of every complete cache entry
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir,name)
+            meta_fp = os.path.join(entry,'meta.pkl')
+            try:
+                last_use = os.path.getmtime(meta_fp)
+                size = sum(os.path.getsize(os.path.join(entry,f)) for f in os.listdir(entry))
+            except OSError:
+                continue
+            entries.append((last_use,size,entry))
+        return entries
+
+
+## METHODS ####################################################################
+def source_stamp(exp_fp):
+    """
+    Modification times and sizes of an experiment's source files.
+
+    :param exp_fp: File path to experiment folder
+    :type exp_fp: str
+    :return: {file name:(mtime,size)} for the existing files of :any:`SOURCE_FILES`
+    :rtype: dict
+    """
+    stamp = {}
+    for name in SOURCE_FILES:
+        try:
+            st = os.stat(os.path.join(exp_fp,name))
+        except OSError:
+            continue
+        stamp[name] = (st.st_mtime,st.st_size)
+    return stamp
+
+
+def _remove(path):
+    shutil.rmtree(path,ignore_errors=True)
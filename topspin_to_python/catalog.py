@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# catalog.py: SQLite catalog of experiment metadata for fast queries
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'ExperimentCatalog','DEFAULT_CATALOG_KEYS'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import re
+import json
+import sqlite3
+from acqu_pars import read_acqu_pars
+from cache import source_stamp
+
+#acquisition parameters recorded by default
+DEFAULT_CATALOG_KEYS = (['pulprog','td','ns','ds','sw_h','aq_mod','te','solvent','date',
+                         'bytorda','dtypa','dspfvs','decim','grpdly']+
+                        ['nuc{0}'.format(i) for i in range(1,9)]+
+                        ['sfo{0}'.format(i) for i in range(1,9)])
+
+#query keyword suffixes and the SQL operators they stand for
+_OPERATORS = {'eq':'=','ne':'!=','gt':'>','ge':'>=','lt':'<','le':'<=','like':'LIKE','in':'IN'}
+
+#recorded parameters that are indexed for faster queries
+_INDEXED = ['pulprog','td','nuc1']
+
+_KEY_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+## CLASSES ####################################################################
+class ExperimentCatalog(object):
+    """
+    Catalog of experiments in a local SQLite database: selected acquisition
+    parameters, the sizes of the fid/ser files and modification times of every
+    experiment folder under the scanned roots. Updates re-read only folders
+    whose acqu/acqus/fid/ser files changed, and queries return experiment paths
+    to pass to :any:`experiment_reader.read_experiment` and friends.
+
+    >>> catalog = ExperimentCatalog('experiments.db')
+    >>> catalog.update('/data/nmr')
+    >>> paths = catalog.query(pulprog='zgpg30',nuc1='13C',td__gt=65536)
+
+    :param db_fp: SQLite database file, created if needed
+    :type db_fp: str
+    :param keys: Acquisition parameters to record. Changing the keys of an
+                existing catalog re-reads every folder on the next update.
+    :type keys: list
+    """
+
+    def __init__(self,db_fp,keys=None):
+        keys = [k.lstrip('$').lower() for k in (keys if keys is not None else DEFAULT_CATALOG_KEYS)]
+        for key in keys:
+            if not _KEY_RE.match(key):
+                raise ValueError('Invalid parameter name {0}'.format(key))
+        self._keys = keys
+        self._db_fp = db_fp
+        self._conn = sqlite3.connect(db_fp)
+        self._create()
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    @property
+    def db_fp(self):
+        return self._db_fp
+
+    def update(self,root):
+        """
+        Scan a directory tree and record every experiment folder (a folder with
+        an acqu or acqus file) that is new or changed since the last update.
+        Folders under root that no longer exist are removed.
+
+        :param root: Directory to scan
+        :type root: str
+        :return: Number of folders read and removed
+        :rtype: int,int
+        """
+        root = os.path.abspath(root)
+        known = dict(self._conn.execute(
+            'SELECT path,stamp FROM experiments WHERE path = ? OR (path >= ? AND path < ?)',
+            (root,)+_path_range(root)))
+        seen = set()
+        n_read = 0
+        columns = ['path','stamp','fid_size','ser_size','mtime']+self._keys
+        insert = 'INSERT OR REPLACE INTO experiments ({0}) VALUES ({1})'.format(
+            ','.join('"{0}"'.format(c) for c in columns),','.join('?'*len(columns)))
+        with self._conn:
+            for exp_fp,dirs,files in os.walk(root):
+                if 'pdata' in dirs:
+                    dirs.remove('pdata')
+                acqu_fp = _acqu_file(exp_fp,files)
+                if acqu_fp is None:
+                    continue
+                seen.add(exp_fp)
+                stamp = source_stamp(exp_fp)
+                stamp_text = json.dumps(stamp,sort_keys=True)
+                if known.get(exp_fp) == stamp_text:
+                    continue
+                try:
+                    pars = read_acqu_pars(acqu_fp,keys=self._keys)
+                except (IOError,OSError,ValueError):
+                    continue
+                sizes = dict((name,stamp[name][1]) for name in ('fid','ser') if name in stamp)
+                mtime = max(mtime for mtime,_ in stamp.values())
+                row = [exp_fp,stamp_text,sizes.get('fid'),sizes.get('ser'),mtime]
+                row += [_sql_value(pars.get(k)) for k in self._keys]
+                self._conn.execute(insert,row)
+                n_read += 1
+            removed = [(p,) for p in known if p not in seen]
+            self._conn.executemany('DELETE FROM experiments WHERE path = ?',removed)
+        return n_read,len(removed)
+
+    def query(self,where=None,params=(),order_by='path',**filters):
+        """
+        Paths of the experiments matching every filter. Filters are
+        ``name=value`` for equality or ``name__op=value`` with op one of
+        eq, ne, gt, ge, lt, le, like and in (a sequence of values). Names are
+        the recorded parameters and path, fid_size, ser_size and mtime.
+
+        :param where: Additional SQL condition, e.g. ``'td*ns > ?'``
+        :type where: str
+        :param params: Parameters of the where condition
+        :type params: tuple
+        :param order_by: Column to order the paths by
+        :type order_by: str
+        :return: Experiment folder paths
+        :rtype: list
+        """
+        conditions,values = [],[]
+        for name,value in sorted(filters.items()):
+            column,_,op = name.partition('__')
+            self._check_column(column)
+            if op not in _OPERATORS and op != '':
+                raise ValueError('Unknown query operator {0}'.format(op))
+            if op == 'in':
+                value = list(value)
+                conditions.append('"{0}" IN ({1})'.format(column,','.join('?'*len(value))))
+                values.extend(_sql_value(v) for v in value)
+            elif value is None and op in ('','eq','ne'):
+                conditions.append('"{0}" IS {1}NULL'.format(column,'NOT ' if op == 'ne' else ''))
+            else:
+                conditions.append('"{0}" {1} ?'.format(column,_OPERATORS[op or 'eq']))
+                values.append(_sql_value(value))
+        if where is not None:
+            conditions.append('({0})'.format(where))
+            values.extend(params)
+        self._check_column(order_by)
+        sql = 'SELECT path FROM experiments'
+        if conditions:
+            sql += ' WHERE '+' AND '.join(conditions)
+        sql += ' ORDER BY "{0}"'.format(order_by)
+        return [path for path, in self._conn.execute(sql,values)]
+
+    def get(self,path):
+        """
+        Recorded values of one experiment folder, None if it is not in the catalog.
+
+        :param path: Experiment folder
+        :type path: str
+        :rtype: dict
+        """
+        cursor = self._conn.execute('SELECT * FROM experiments WHERE path = ?',
+                                    (os.path.abspath(path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description],row))
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM experiments').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+    def _check_column(self,column):
+        if column not in self._keys and column not in ('path','fid_size','ser_size','mtime'):
+            raise ValueError('{0} is not recorded in the catalog'.format(column))
+
+    def _create(self):
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS experiments (path TEXT PRIMARY KEY, '
+                               'stamp TEXT, fid_size INTEGER, ser_size INTEGER, mtime REAL)')
+            existing = set(row[1] for row in self._conn.execute('PRAGMA table_info(experiments)'))
+            for key in self._keys:
+                if key not in existing:
+                    self._conn.execute('ALTER TABLE experiments ADD COLUMN "{0}"'.format(key))
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'keys'").fetchone()
+            keys = json.dumps(sorted(self._keys))
+            if row is None or row[0] != keys:
+                # recorded values may be missing for the new keys
+                self._conn.execute('UPDATE experiments SET stamp = NULL')
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('keys',?)",(keys,))
+            for column in _INDEXED:
+                if column in self._keys:
+                    self._conn.execute('CREATE INDEX IF NOT EXISTS "idx_{0}" ON experiments ("{0}")'.format(column))
+
+
+## METHODS ####################################################################
+def _acqu_file(exp_fp,files):
+    """
+    Parameter file of an experiment folder, acqus (the acquisition as run)
+    rather than acqu (its setup) when both exist
+    """
+    for name in ('acqus','acqu'):
+        if name in files:
+            return os.path.join(exp_fp,name)
+    return None
+
+
+def _path_range(path):
+    """
+    (lowest,upper bound) of the paths below path in case-sensitive string
+    order, unlike LIKE which ignores the case of ASCII letters
+    """
+    return path+os.sep,path+chr(ord(os.sep)+1)
+
+
+def _sql_value(value):
+    """
+    Parameter value as a type SQLite stores, None for arrays
+    """
+    if isinstance(value,np.generic):
+        return value.item()
+    if isinstance(value,(np.ndarray,list,tuple,dict)):
+        return None
+    return value
@@ -0,0 +1,483 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# columnar.py: Columnar export of many experiments for pandas/Arrow style analysis
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'ColumnarWriter','ColumnarReader','export_experiments'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import json
+import numbers
+from fid import FID, FT
+from processing import Pipeline
+from experiment_reader import iter_experiments
+
+SCHEMA_FILE = 'schema.json'
+DATA_FILE = 'data.bin'
+FORMAT_VERSION = 1
+
+#columns added by the writer itself, besides the acquisition parameters
+_OWN_COLUMNS = ['path','row','sfo','dwell','f0','df']
+
+
+## CLASSES ####################################################################
+class ColumnarWriter(object):
+    """
+    Append-only writer of experiments to a columnar dataset directory.
+
+    Every scalar acquisition parameter becomes a typed column (int64, float64,
+    bool or utf-8 string) stored as one raw little-endian file, and the fid or
+    processed spectrum of every experiment becomes a row of a single fixed-width
+    2D block. Rows of a ser file are written as separate rows, numbered by the
+    'row' column. Rows are buffered and written chunk_size at a time, and the
+    schema (with the row count) is rewritten after each chunk, so a dataset is
+    always readable up to its last complete chunk and can be appended to later.
+
+    The columns are fixed by the first chunk written unless given. Appending a
+    later experiment missing an int or bool column, with a value that does not
+    fit its column's type or with a different number of points raises
+    ValueError, and none of its rows are buffered; missing float values are
+    stored as NaN.
+
+    :param out_dir: Dataset directory, created if needed. An existing dataset is appended to.
+    :type out_dir: str
+    :param data: 'fid' to store the fids, 'spectrum' to store spectra processed
+                by pipeline, or None to store parameters only
+    :type data: str
+    :param pipeline: Processing of spectra, by default a plain FFT
+    :type pipeline: :class:`processing.Pipeline`
+    :param columns: Acquisition parameters to store, by default all scalar parameters
+                of the first chunk. A dict of {name:dtype} also fixes their types.
+    :type columns: list,dict
+    :param dtype: Complex dtype of the data block
+    :type dtype: :class:`numpy.dtype`
+    :param chunk_size: Number of rows buffered before they are written
+    :type chunk_size: int
+    """
+
+    def __init__(self,out_dir,data='fid',pipeline=None,columns=None,dtype=np.complex64,
+                 chunk_size=256):
+        if data not in ('fid','spectrum',None):
+            raise ValueError('Unknown data {0}'.format(data))
+        self._out_dir = out_dir
+        self.pipeline = pipeline if pipeline is not None else Pipeline()
+        self.chunk_size = chunk_size
+        self._buffer = []
+        if os.path.isfile(os.path.join(out_dir,SCHEMA_FILE)):
+            self._schema = _read_schema(out_dir)
+            _truncate_files(out_dir,self._schema)
+        else:
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            self._schema = {'version':FORMAT_VERSION,'n_rows':0,'columns':None,
+                            'data':None if data is None else {'kind':data,
+                                    'dtype':np.dtype(dtype).newbyteorder('<').str,'width':None}}
+            if isinstance(columns,dict):
+                self._schema['columns'] = _own_schema()
+                self._schema['columns'].update((k,_column_type(np.dtype(v)))
+                                               for k,v in columns.items())
+        self._names = None if columns is None else list(columns)
+
+    @property
+    def out_dir(self):
+        return self._out_dir
+
+    @property
+    def n_rows(self):
+        """
+        Number of rows written, not counting buffered rows
+        """
+        return self._schema['n_rows']
+
+    def append(self,experiment,path=''):
+        """
+        Buffer an experiment, writing a chunk when chunk_size rows are buffered.
+        An already processed spectrum in ``experiment['ft']`` is stored as is,
+        and ``experiment['integrals']`` of each row as integral_<i> columns.
+        An experiment that does not fit the columns or data width raises
+        ValueError, leaving the buffered rows of earlier experiments.
+
+        :param experiment: Experiment dictionary, see :any:`experiment_reader.read_experiment`
+        :type experiment: dict
+        :param path: Experiment folder, stored in the 'path' column
+        :type path: str
+        """
+        acqu = experiment.get('acqu',{})
+        values = dict((k,v) for k,v in acqu.items() if _is_scalar(v))
+        fid = experiment.get('fid')
+        block = None
+        if self._schema['data'] is not None:
+            if fid is None:
+                raise ValueError('Experiment {0} has no fid to export'.format(path))
+            values.update(sfo=fid.sfo,dwell=fid.dwell)
+            if self._schema['data']['kind'] == 'fid':
+                block = fid.fid
+            else:
+                ft = experiment.get('ft')
+                if ft is None:
+                    ft = fid.process(self.pipeline,keep_fid=False)
+                values.update(f0=ft.f0,df=ft.df)
+                block = ft.ft
+        values['path'] = path
+        integrals = experiment.get('integrals')
+        if integrals is not None:
+            integrals = np.atleast_2d(integrals)
+        rows = []
+        for row,row_data in enumerate([None] if block is None else np.atleast_2d(block)):
+            row_values = dict(values)
+            row_values['row'] = row
+            if integrals is not None:
+                row_values.update(('integral_{0}'.format(i),float(v))
+                                  for i,v in enumerate(integrals[row]))
+            self._check_row(row_values,row_data,path)
+            rows.append((row_values,row_data))
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def _check_row(self,row_values,row_data,path):
+        """
+        Raise ValueError if a row does not fit the columns and data width
+        fixed so far, so that it is never buffered
+        """
+        data = self._schema['data']
+        if data is not None:
+            width = data['width']
+            if width is None and self._buffer:
+                width = len(self._buffer[0][1])
+            if width is not None and len(row_data) != width:
+                raise ValueError('Experiment {0} has {1} points, data rows must all have {2}'.format(
+                    path,len(row_data),width))
+        for name,kind in (self._schema['columns'] or {}).items():
+            _check_value(name,kind,row_values.get(name),path)
+
+    def flush(self):
+        """
+        Write the buffered rows and update the schema. If writing fails the
+        buffered rows are dropped and the files are left as they were.
+        """
+        if not self._buffer:
+            return
+        buffer,self._buffer = self._buffer,[]
+        schema = dict(self._schema)
+        if schema['columns'] is None:
+            schema['columns'] = _infer_columns(buffer,self._names)
+        block = None
+        if schema['data'] is not None:
+            rows = [d for _,d in buffer]
+            width = schema['data']['width']
+            if width is None:
+                width = len(rows[0])
+            schema['data'] = dict(schema['data'],width=width)
+            block = np.asarray(rows,dtype=schema['data']['dtype'])
+        values = [v for v,_ in buffer]
+        try:
+            for name,kind in schema['columns'].items():
+                _append_column(self.out_dir,name,kind,[v.get(name) for v in values])
+            if block is not None:
+                with open(os.path.join(self.out_dir,DATA_FILE),'ab') as f:
+                    f.write(block.tobytes())
+        except Exception:
+            # the schema still counts the rows written before this chunk
+            _truncate_files(self.out_dir,schema)
+            raise
+        schema['n_rows'] += len(buffer)
+        _write_schema(self.out_dir,schema)
+        self._schema = schema
+
+    def close(self):
+        """
+        Write any buffered rows
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+
+class ColumnarReader(object):
+    """
+    Reader of a dataset written by :class:`ColumnarWriter`. Numeric columns and
+    the data block are memory-mapped, so opening a dataset parses nothing but
+    its small schema; string columns are decoded on access.
+
+    :param out_dir: Dataset directory
+    :type out_dir: str
+    """
+
+    def __init__(self,out_dir):
+        self._out_dir = out_dir
+        self._schema = _read_schema(out_dir)
+        self._cache = {}
+
+    @property
+    def out_dir(self):
+        return self._out_dir
+
+    @property
+    def columns(self):
+        """
+        Names of the columns
+        """
+        return sorted(self._schema['columns'] or {})
+
+    def __len__(self):
+        return self._schema['n_rows']
+
+    def __getitem__(self,name):
+        return self.column(name)
+
+    def column(self,name):
+        """
+        Values of a column, memory-mapped for numeric columns.
+
+        :param name: Column name
+        :type name: str
+        :rtype: :class:`numpy.ndarray`
+        """
+        if name not in self._cache:
+            kind = (self._schema['columns'] or {}).get(name)
+            if kind is None:
+                raise KeyError(name)
+            self._cache[name] = _read_column(self.out_dir,name,kind,len(self))
+        return self._cache[name]
+
+    @property
+    def data(self):
+        """
+        Memory-mapped fids or spectra, shape (n_rows,width), None without data
+        """
+        data = self._schema['data']
+        if data is None:
+            return None
+        if 'data' not in self._cache:
+            self._cache['data'] = _memmap(os.path.join(self.out_dir,DATA_FILE),data['dtype'],
+                                          (len(self),data['width'] or 0))
+        return self._cache['data']
+
+    def item(self,index):
+        """
+        Data of one row as a :class:`fid.FID`, or a :class:`fid.FT` for
+        exported spectra, holding a view of the memory map.
+
+        :param index: Row number
+        :type index: int
+        :rtype: :class:`fid.FID`,:class:`fid.FT`
+        """
+        if self._schema['data'] is None:
+            raise ValueError('Dataset has no data')
+        sfo = self.column('sfo')[index]
+        if self._schema['data']['kind'] == 'fid':
+            return FID(self.data[index],sfo=sfo,copy=False,dwell=self.column('dwell')[index])
+        return FT(self.data[index],sfo=sfo,f0=self.column('f0')[index],df=self.column('df')[index])
+
+    def to_dataframe(self,columns=None):
+        """
+        Columns as a :class:`pandas.DataFrame`, which needs pandas.
+
+        :param columns: Columns to include, by default all
+        :type columns: list
+        :rtype: :class:`pandas.DataFrame`
+        """
+        import pandas as pd
+        names = self.columns if columns is None else columns
+        return pd.DataFrame(dict((name,self.column(name)) for name in names),columns=names)
+
+
+## METHODS ####################################################################
+def export_experiments(paths,out_dir,data='fid',pipeline=None,columns=None,dtype=np.complex64,
+                       chunk_size=256,prefetch=4,on_error='skip',**read_pars):
+    """
+    Stream experiments into a columnar dataset, reading ahead with
+    :any:`experiment_reader.iter_experiments` while chunks are written.
+
+    :param paths: File paths to experiment folders
+    :type paths: iterable
+    :param out_dir: Dataset directory, see :class:`ColumnarWriter`
+    :type out_dir: str
+    :param data: 'fid', 'spectrum' or None, see :class:`ColumnarWriter`
+    :type data: str
+    :param prefetch: Number of experiments to read ahead
+    :type prefetch: int
+    :param on_error: 'raise' or 'skip' experiments that fail to read
+    :type on_error: str
+    :param \**read_pars: Additional :any:`experiment_reader.read_experiment` parameters
+    :return: Reader of the dataset
+    :rtype: :class:`ColumnarReader`
+    """
+    if data is None:
+        read_pars.setdefault('load_fid',False)
+    with ColumnarWriter(out_dir,data,pipeline,columns,dtype,chunk_size) as writer:
+        for exp_fp,experiment in iter_experiments(paths,prefetch,on_error,**read_pars):
+            writer.append(experiment,exp_fp)
+    return ColumnarReader(out_dir)
+
+
+def _is_scalar(value):
+    return isinstance(value,(numbers.Number,str,bytes,type(u''))) and not isinstance(value,complex)
+
+
+def _own_schema():
+    return {'path':'str','row':'<i8','sfo':'<f8','dwell':'<f8','f0':'<f8','df':'<f8'}
+
+
+def _column_type(dtype):
+    if dtype.kind in 'SUO':
+        return 'str'
+    if dtype.kind == 'b':
+        return '|b1'
+    if dtype.kind in 'iu':
+        return '<i8'
+    return '<f8'
+
+
+def _infer_columns(buffer,names=None):
+    """
+    Column types of the buffered rows: str, bool, int64 if every row has an
+    int value, otherwise float64.
+    """
+    columns = _own_schema()
+    values = [v for v,_ in buffer]
+    if names is None:
+        names = sorted(set(k for v in values for k in v))
+    for name in names:
+        if name in _OWN_COLUMNS:
+            continue
+        present = [v[name] for v in values if name in v]
+        if not present:
+            columns[name] = '<f8'
+        elif all(isinstance(p,bool) for p in present):
+            columns[name] = '|b1' if len(present) == len(values) else '<f8'
+        elif all(isinstance(p,numbers.Integral) for p in present):
+            columns[name] = '<i8' if len(present) == len(values) else '<f8'
+        elif all(isinstance(p,numbers.Number) for p in present):
+            columns[name] = '<f8'
+        else:
+            columns[name] = 'str'
+    return columns
+
+
+def _column_files(out_dir,name,kind):
+    base = os.path.join(out_dir,name+'.col')
+    if kind == 'str':
+        return [base,os.path.join(out_dir,name+'.str')]
+    return [base]
+
+
+def _check_value(name,kind,value,path):
+    """
+    Raise ValueError if a value cannot be stored in a column of kind
+    """
+    if kind == 'str':
+        return
+    if kind == '<f8':
+        try:
+            if value is not None:
+                float(value)
+            return
+        except (TypeError,ValueError):
+            pass
+    elif value is None:
+        raise ValueError('Experiment {0} is missing column {1}, fix its type with columns'.format(
+            path,name))
+    elif np.asarray(value).dtype.kind in ('b' if kind == '|b1' else 'iub'):
+        return
+    raise ValueError('Experiment {0} has a value of column {1} that is not {2}'.format(
+        path,name,np.dtype(kind)))
+
+
+def _append_column(out_dir,name,kind,values):
+    """
+    Append values to a column, checked by :any:`_check_value`. String columns
+    store the utf-8 bytes of every value and the end offset of each value in
+    the bytes.
+    """
+    if kind == 'str':
+        encoded = [(u'' if v is None else u'{0}'.format(v)).encode('utf-8') for v in values]
+        offsets_fp,bytes_fp = _column_files(out_dir,name,kind)
+        start = os.path.getsize(bytes_fp) if os.path.isfile(bytes_fp) else 0
+        ends = start+np.cumsum([len(e) for e in encoded],dtype='<i8')
+        with open(bytes_fp,'ab') as f:
+            f.write(b''.join(encoded))
+        with open(offsets_fp,'ab') as f:
+            f.write(ends.astype('<i8').tobytes())
+        return
+    if kind == '<f8':
+        column = np.array([np.nan if v is None else v for v in values],dtype=kind)
+    else:
+        column = np.array(values).astype(kind)
+    with open(_column_files(out_dir,name,kind)[0],'ab') as f:
+        f.write(column.tobytes())
+
+
+def _read_column(out_dir,name,kind,n_rows):
+    if kind != 'str':
+        return _memmap(_column_files(out_dir,name,kind)[0],kind,(n_rows,))
+    offsets_fp,bytes_fp = _column_files(out_dir,name,kind)
+    ends = _memmap(offsets_fp,'<i8',(n_rows,))
+    data = _memmap(bytes_fp,'u1',(int(ends[-1]) if n_rows else 0,))
+    starts = np.concatenate([[0],ends[:-1]])
+    raw = data.tobytes()
+    return np.array([raw[s:e].decode('utf-8') for s,e in zip(starts,ends)])
+
+
+def _memmap(fp,dtype,shape):
+    if np.prod(shape) == 0:
+        return np.empty(shape,dtype=dtype)
+    return np.memmap(fp,dtype=dtype,mode='r',shape=shape)
+
+
+def _expected_sizes(out_dir,schema):
+    """
+    {file:size in bytes} of every file of a dataset with schema['n_rows'] rows
+    """
+    n_rows = schema['n_rows']
+    sizes = {}
+    for name,kind in (schema['columns'] or {}).items():
+        files = _column_files(out_dir,name,kind)
+        if kind == 'str':
+            sizes[files[0]] = 8*n_rows
+            sizes[files[1]] = int(_memmap(files[0],'<i8',(n_rows,))[-1]) if n_rows else 0
+        else:
+            sizes[files[0]] = np.dtype(kind).itemsize*n_rows
+    data = schema['data']
+    if data is not None and data['width'] is not None:
+        sizes[os.path.join(out_dir,DATA_FILE)] = np.dtype(data['dtype']).itemsize*data['width']*n_rows
+    return sizes
+
+
+def _truncate_files(out_dir,schema):
+    """
+    Drop anything written past the last complete chunk, e.g. by an interrupted export
+    """
+    for fp,size in _expected_sizes(out_dir,schema).items():
+        if os.path.isfile(fp) and os.path.getsize(fp) > size:
+            with open(fp,'r+b') as f:
+                f.truncate(size)
+
+
+def _read_schema(out_dir):
+    with open(os.path.join(out_dir,SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    if schema.get('version') != FORMAT_VERSION:
+        raise ValueError('Unsupported columnar format version {0}'.format(schema.get('version')))
+    return schema
+
+
+def _write_schema(out_dir,schema):
+    fp = os.path.join(out_dir,SCHEMA_FILE)
+    tmp = fp+'.tmp'
+    with open(tmp,'w') as f:
+        json.dump(schema,f,indent=1,sort_keys=True)
+    if os.path.exists(fp) and not hasattr(os,'replace'):
+        os.remove(fp)
+    getattr(os,'replace',os.rename)(tmp,fp)
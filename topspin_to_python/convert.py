@@ -0,0 +1,432 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# convert.py: Batch conversion of experiments to NumPy or columnar files
+#
+# Installed as the topspin-convert command:
+#
+#   topspin-convert /data/nmr/sample_* -o converted --ft --phase apk \
+#       --integrate 900,1100 --jobs 8
+
+
+from __future__ import print_function
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'convert','find_experiments','format_stats','main'
+]
+
+## IMPORTS ####################################################################
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from experiment_reader import read_experiment, find_expnos
+from processing import Pipeline
+from cache import source_stamp
+from columnar import ColumnarWriter, ColumnarReader, SCHEMA_FILE, DATA_FILE, _is_scalar
+import instrumentation
+
+#record of what a columnar output was converted from
+MANIFEST_FILE = 'convert.json'
+#command line window options and the window each applies to
+_WINDOW_OPTIONS = {'lb':'exponential','gb':'gaussian','ssb':'sine'}
+
+
+## METHODS ####################################################################
+def find_experiments(paths):
+    """
+    Experiment folders of dataset roots, experiment folders or glob patterns
+    of either. A dataset root contributes its numbered expno folders.
+
+    :param paths: Dataset roots, experiment folders or glob patterns
+    :type paths: list
+    :return: Experiment folders in order, without duplicates
+    :rtype: list
+    """
+    found = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for path in matches:
+            if os.path.isfile(os.path.join(path,'acqu')):
+                found.append(path)
+            elif os.path.isdir(path):
+                found.extend(os.path.join(path,str(expno)) for expno in find_expnos(path))
+            else:
+                raise IOError('No experiment or dataset at {0}'.format(path))
+    seen = set()
+    return [p for p in found if not (os.path.abspath(p) in seen or seen.add(os.path.abspath(p)))]
+
+
+@instrumentation.timed('convert')
+def convert(paths,out_dir,format='npy',jobs=1,ft=False,window=None,window_pars=None,size=None,
+            phase=None,regions=None,ppm=False,dtype=np.complex128,force=False,log=None):
+    """
+    Convert many experiments, reading and processing them in parallel worker
+    processes. Each experiment is decoded, optionally Fourier transformed,
+    phased and integrated, and written either to its own .npz file or as rows
+    of a single columnar dataset, see :class:`columnar.ColumnarWriter`.
+
+    Outputs that are up to date with their experiment's source files and the
+    conversion options are skipped. A .npz file records the stamp it was
+    converted from; a columnar dataset keeps a manifest of its experiments,
+    and is appended to with new experiments but rebuilt if any of its
+    experiments changed or the options differ.
+
+    :param paths: Experiment folders
+    :type paths: list
+    :param out_dir: Output directory, holding <dataset>/<expno>.npz files or
+                the columnar dataset. Experiments of datasets with the same
+                name in different folders must be converted to separate
+                directories, a ValueError is raised otherwise.
+    :type out_dir: str
+    :param format: 'npy' or 'columnar'
+    :type format: str
+    :param jobs: Number of worker processes, None for the number of CPUs
+    :type jobs: int
+    :param ft: Whether to store spectra instead of fids
+    :type ft: bool
+    :param window: Apodization window, see :any:`processing.Pipeline.apodize`
+    :type window: str
+    :param window_pars: Window parameters
+    :type window_pars: dict
+    :param size: Number of points to zero-fill fids to
+    :type size: int
+    :param phase: Zero order phase in radians, or 'apk' to phase automatically
+    :type phase: float,str
+    :param regions: (left,right) regions in Hz (or ppm) to integrate each spectrum over
+    :type regions: list
+    :param ppm: Whether regions are in ppm
+    :type ppm: bool
+    :param dtype: Complex dtype of the stored data
+    :type dtype: :class:`numpy.dtype`
+    :param force: Whether to convert up to date outputs again
+    :type force: bool
+    :param log: Function called with a message for each failed experiment
+    :type log: callable
+    :return: statistics: 'converted', 'skipped' and 'failed' experiment counts,
+            'rows', source 'bytes', 'seconds' and the 'errors' of failed experiments
+    :rtype: dict
+    """
+    if format not in ('npy','columnar'):
+        raise ValueError('Unknown format {0}'.format(format))
+    if phase is not None or regions:
+        ft = True
+    options = {'format':format,'ft':bool(ft),'window':window,'window_pars':window_pars or {},
+               'size':size,'phase':phase,'regions':[list(map(float,r)) for r in regions or []],
+               'ppm':bool(ppm),'dtype':np.dtype(dtype).str}
+    if ft and window is not None:
+        # checks the window before any work is done
+        Pipeline().apodize(window,**options['window_pars'])
+    start = timeit.default_timer()
+    stats = {'converted':0,'skipped':0,'failed':0,'rows':0,'bytes':0,'errors':{}}
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    tasks = []
+    if format == 'npy':
+        names = {}
+        for exp_fp in paths:
+            name = _output_name(exp_fp)
+            other = names.setdefault(name,os.path.abspath(exp_fp))
+            if other != os.path.abspath(exp_fp):
+                raise ValueError('{0} and {1} would both be written to {2}.npz'.format(
+                    other,exp_fp,name))
+        for exp_fp in paths:
+            stamp = _stamp(exp_fp,options)
+            out_fp = os.path.join(out_dir,_output_name(exp_fp)+'.npz')
+            if not force and _stored_stamp(out_fp) == stamp:
+                stats['skipped'] += 1
+                continue
+            tasks.append((exp_fp,out_fp,stamp,options))
+    else:
+        manifest = _read_manifest(out_dir)
+        if force or not _manifest_current(out_dir,manifest,options):
+            _clear_columnar(out_dir)
+            manifest = {'options':options,'stamps':{},'n_rows':0}
+        for exp_fp in paths:
+            stamp = _stamp(exp_fp,options)
+            if manifest['stamps'].get(os.path.abspath(exp_fp)) == stamp:
+                stats['skipped'] += 1
+            else:
+                tasks.append((exp_fp,None,stamp,options))
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(min(int(jobs),len(tasks)),1)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    writer = None
+    try:
+        if pool is not None:
+            results = instrumentation.imap_collected(pool,_convert_task,tasks)
+        else:
+            results = map(_convert_task,tasks)
+        if format == 'columnar':
+            writer = ColumnarWriter(out_dir,'spectrum' if ft else 'fid',dtype=dtype)
+        for (exp_fp,_,stamp,_),(result,error) in zip(tasks,results):
+            if error is None and writer is not None:
+                try:
+                    writer.append(result['experiment'],os.path.abspath(exp_fp))
+                except ValueError as e:
+                    # e.g. a fid of a different length than the dataset's rows
+                    error = '{0}: {1}'.format(type(e).__name__,e)
+            if error is not None:
+                stats['failed'] += 1
+                stats['errors'][exp_fp] = error
+                if log is not None:
+                    log('{0}: {1}'.format(exp_fp,error))
+                continue
+            if writer is not None:
+                manifest['stamps'][os.path.abspath(exp_fp)] = stamp
+            stats['converted'] += 1
+            stats['rows'] += result['rows']
+            stats['bytes'] += result['bytes']
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if writer is not None:
+            writer.close()
+            manifest['n_rows'] = writer.n_rows
+            _write_json(os.path.join(out_dir,MANIFEST_FILE),manifest)
+    stats['seconds'] = timeit.default_timer()-start
+    return stats
+
+
+def main(argv=None):
+    """
+    Entry point of the topspin-convert command.
+
+    :param argv: Command line arguments, by default sys.argv[1:]
+    :type argv: list
+    :return: Exit status, 1 if any experiment failed
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog='topspin-convert',description=(
+        'Convert TopSpin experiments to NumPy .npz files or a columnar dataset, '
+        'skipping outputs that are up to date.'))
+    parser.add_argument('paths',nargs='+',help='Dataset roots, experiment folders or glob patterns')
+    parser.add_argument('-o','--out',required=True,help='Output directory')
+    parser.add_argument('--format',choices=['npy','columnar'],default='npy',
+                        help='One .npz per experiment, or one columnar dataset (default npy)')
+    parser.add_argument('-j','--jobs',type=int,default=None,
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--ft',action='store_true',help='Store spectra instead of fids')
+    parser.add_argument('--window',choices=['exponential','gaussian','sine'],
+                        help='Apodization window applied before the FT')
+    parser.add_argument('--lb',type=float,help='Line broadening in Hz of the exponential window')
+    parser.add_argument('--gb',type=float,help='Gaussian broadening in Hz of the gaussian window')
+    parser.add_argument('--ssb',type=float,
+                        help='Sine bell shift of the sine window, 2 for a cosine (default 0)')
+    parser.add_argument('--size',type=int,help='Number of points to zero-fill to')
+    parser.add_argument('--phase',help="Zero order phase in degrees, or 'apk' to phase automatically")
+    parser.add_argument('--integrate',action='append',default=[],metavar='LEFT,RIGHT',
+                        help='Region to integrate each spectrum over, in Hz (repeatable)')
+    parser.add_argument('--ppm',action='store_true',help='Integration regions are in ppm')
+    parser.add_argument('--single',action='store_true',help='Store complex64 instead of complex128')
+    parser.add_argument('--force',action='store_true',help='Convert up to date outputs again')
+    parser.add_argument('--stats',help='Also write the timing spans and counters as JSON to this file')
+    args = parser.parse_args(argv)
+
+    phase = args.phase
+    if phase is not None and phase != 'apk':
+        try:
+            phase = np.deg2rad(float(phase))
+        except ValueError:
+            parser.error("--phase must be a number of degrees or 'apk'")
+    regions = []
+    for region in args.integrate:
+        try:
+            left,right = [float(v) for v in region.split(',')]
+        except ValueError:
+            parser.error('--integrate regions are LEFT,RIGHT, not {0}'.format(region))
+        regions.append((left,right))
+    window_pars = {}
+    for option,window in _WINDOW_OPTIONS.items():
+        value = getattr(args,option)
+        if value is None:
+            continue
+        if args.window != window:
+            parser.error('--{0} only applies to --window {1}'.format(option,window))
+        window_pars[option] = value
+
+    try:
+        paths = find_experiments(args.paths)
+    except (IOError,OSError) as e:
+        parser.error(str(e))
+    if args.stats:
+        instrumentation.enable()
+    try:
+        stats = convert(paths,args.out,args.format,args.jobs,args.ft,args.window,window_pars,
+                        args.size,phase,regions,args.ppm,
+                        np.complex64 if args.single else np.complex128,args.force,
+                        log=lambda message: print(message,file=sys.stderr))
+    except ValueError as e:
+        parser.error(str(e))
+    print(format_stats(stats))
+    if args.stats:
+        instrumentation.to_json(args.stats)
+    return 1 if stats['failed'] else 0
+
+
+def format_stats(stats):
+    """
+    One line summary of :any:`convert` statistics with its throughput.
+
+    :param stats: Statistics returned by :any:`convert`
+    :type stats: dict
+    :rtype: str
+    """
+    seconds = max(stats['seconds'],1E-9)
+    return ('{converted} converted, {skipped} up to date, {failed} failed: {rows} rows, '
+            '{mb:.1f} MB in {seconds:.2f} s ({exp_rate:.1f} experiments/s, '
+            '{mb_rate:.1f} MB/s)').format(
+                mb=stats['bytes']/1E6,exp_rate=stats['converted']/seconds,
+                mb_rate=stats['bytes']/1E6/seconds,**stats)
+
+
+def _convert_task(args):
+    """
+    Read and process one experiment in a worker, writing its .npz file if out_fp
+    is given. Returns (result,None), or (None,error message) if it failed.
+    """
+    exp_fp,out_fp,stamp,options = args
+    try:
+        experiment = read_experiment(exp_fp,mmap=True,dtype=np.dtype(options['dtype']))
+        fid = experiment.get('fid')
+        if fid is None:
+            raise IOError('No fid or ser')
+        result = {'rows':int(np.prod(fid.fid.shape[:-1])),
+                  'bytes':sum(size for name,(_,size) in source_stamp(exp_fp).items()
+                              if name not in ('acqu','acqus'))}
+        if options['ft']:
+            pipeline = Pipeline(size=options['size'])
+            if options['window'] is not None:
+                pipeline = pipeline.apodize(options['window'],**options['window_pars'])
+            if options['phase'] not in (None,'apk'):
+                pipeline = pipeline.phased(options['phase'])
+            spectrum = fid.process(pipeline,keep_fid=False)
+            if options['phase'] == 'apk':
+                spectrum = spectrum.apk()
+            experiment['ft'] = spectrum
+            if options['regions']:
+                experiment['integrals'] = spectrum.integrate_regions(options['regions'],
+                                                                      ppm=options['ppm'])
+        if out_fp is None:
+            result['experiment'] = experiment
+        else:
+            _write_npz(out_fp,experiment,stamp)
+        return result,None
+    except Exception as e:
+        return None,'{0}: {1}'.format(type(e).__name__,e)
+
+
+def _write_npz(out_fp,experiment,stamp):
+    """
+    Write an experiment's fid or spectrum, axis and integrals to a .npz file,
+    replacing it only once complete
+    """
+    fid = experiment['fid']
+    acqu = dict((k,v.item() if isinstance(v,np.generic) else v)
+                for k,v in experiment.get('acqu',{}).items() if _is_scalar(v))
+    arrays = {'stamp':np.array(stamp),'acqu':np.array(json.dumps(acqu,sort_keys=True,default=str)),
+              'sfo':fid.sfo}
+    spectrum = experiment.get('ft')
+    if spectrum is None:
+        arrays.update(fid=fid.fid,dwell=fid.dwell,t0=fid.t0)
+    else:
+        arrays.update(spectrum=spectrum.ft,f0=spectrum.f0,df=spectrum.df,phase=spectrum.phase)
+    if 'integrals' in experiment:
+        arrays['integrals'] = experiment['integrals']
+    out_dir = os.path.dirname(out_fp)
+    if out_dir and not os.path.isdir(out_dir):
+        try:
+            os.makedirs(out_dir)
+        except OSError:
+            # another worker made it
+            if not os.path.isdir(out_dir):
+                raise
+    tmp = out_fp+'.tmp'
+    with open(tmp,'wb') as f:
+        np.savez(f,**arrays)
+    _replace(tmp,out_fp)
+
+
+def _output_name(exp_fp):
+    """
+    <dataset>/<expno> name of an experiment's output
+    """
+    exp_fp = os.path.abspath(exp_fp)
+    return os.path.join(os.path.basename(os.path.dirname(exp_fp)),os.path.basename(exp_fp))
+
+
+def _stamp(exp_fp,options):
+    return json.dumps({'source':source_stamp(exp_fp),'options':options},sort_keys=True)
+
+
+def _stored_stamp(out_fp):
+    if not os.path.isfile(out_fp):
+        return None
+    try:
+        with np.load(out_fp) as stored:
+            return str(stored['stamp'])
+    except (IOError,OSError,ValueError,KeyError):
+        return None
+
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir,MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (IOError,OSError,ValueError):
+        return None
+
+
+def _manifest_current(out_dir,manifest,options):
+    """
+    Whether a columnar output was converted with these options from experiments
+    that have not changed since, so that it can be appended to
+    """
+    if manifest is None or manifest.get('options') != json.loads(json.dumps(options)):
+        return False
+    if not os.path.isfile(os.path.join(out_dir,SCHEMA_FILE)):
+        return manifest['n_rows'] == 0
+    if len(ColumnarReader(out_dir)) != manifest['n_rows']:
+        # rows were written after the manifest, by a conversion that did not finish
+        return False
+    for exp_fp,stamp in manifest['stamps'].items():
+        if json.loads(stamp)['source'] != json.loads(json.dumps(source_stamp(exp_fp))):
+            return False
+    return True
+
+
+def _clear_columnar(out_dir):
+    """
+    Remove the files of a columnar dataset and its manifest, leaving anything else
+    """
+    for name in os.listdir(out_dir):
+        if name in (SCHEMA_FILE,DATA_FILE,MANIFEST_FILE) or name.endswith(('.col','.str')):
+            os.remove(os.path.join(out_dir,name))
+
+
+def _write_json(fp,value):
+    tmp = fp+'.tmp'
+    with open(tmp,'w') as f:
+        json.dump(value,f,indent=1,sort_keys=True)
+    _replace(tmp,fp)
+
+
+def _replace(src,dst):
+    if os.path.exists(dst) and not hasattr(os,'replace'):
+        os.remove(dst)
+    getattr(os,'replace',os.rename)(src,dst)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
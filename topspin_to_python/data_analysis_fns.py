@@ -6,8 +6,348 @@
 
 #use __all__ to restrict what globals are visible to external modules.
 __all__ = [
-	
+	'lorentzian','fit_lorentzians','phase_objective','autophase'
 ]
 
 ## IMPORTS ####################################################################
 import numpy as np
+import instrumentation
+
+
+def lorentzian(x,A,phase,w,x0):
+	"""
+	Complex lorentzian line, the transform of a decaying exponential by 
+	:any:`fid.FID.ft`, with absorption in the real part before phasing. 
+	Parameters broadcast against x. The line shape is 1/(1+iu) with
+	u = 2(x-x0)/w, whose dispersion has the sign of the FFT of the fid; the
+	former scipy fit_lorentzian model 1/(1-iu) had the opposite sign, which
+	its fit of the power did not depend on.
+
+	:param x: Frequencies to evaluate at
+	:type x: :class:`numpy.ndarray`
+	:param A: Amplitude (area of the absorption line)
+	:type A: float
+	:param phase: Zero-order phase of the line
+	:type phase: float
+	:param w: Full width at half maximum
+	:type w: float
+	:param x0: Line center
+	:type x0: float
+
+	:returns: Complex line shape
+	:rtype: :class:`numpy.ndarray`
+	"""
+	return A*np.exp(1j*phase)*2/(np.pi*w)/(1+2j*(x-x0)/w)
+
+
+@instrumentation.timed('fit_lorentzians')
+def fit_lorentzians(freqs,spectra,n_peaks=1,p0=None,width_guess=None,max_iter=200,tol=1e-10):
+	"""
+	Fit a batch of complex spectra to sums of :any:`lorentzian` lines at once, 
+	with vectorized Levenberg-Marquardt steps and analytic Jacobians. 
+	The real and imaginary parts are both fit, so the phase of each line is 
+	well determined.
+
+	:param freqs: Frequencies of the spectral points, shape (M,)
+	:type freqs: :class:`numpy.ndarray`
+	:param spectra: Complex spectra, shape (N,M) or (M,)
+	:type spectra: :class:`numpy.ndarray`
+	:param n_peaks: Number of lines to fit per spectrum
+	:type n_peaks: int
+	:param p0: Initial (Amplitude,phase,width,location) per line, broadcastable
+			to (N,n_peaks,4). By default guessed from the largest local maxima
+			of each spectrum's magnitude.
+	:type p0: :class:`numpy.ndarray`
+	:param width_guess: Initial width when p0 is not given. By default the
+			width of each line is estimated from the half height crossings
+			of its absorption around the maximum.
+	:type width_guess: float
+	:param max_iter: Maximum number of iterations
+	:type max_iter: int
+	:param tol: Relative decrease of the residual cost at which a fit has converged
+	:type tol: float
+
+	:returns: popt(Amplitude,phase,width,location) with shape (N,n_peaks,4), 
+			covariances with shape (N,4*n_peaks,4*n_peaks)
+	:rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`
+	"""
+	x = np.asarray(freqs,dtype=float)
+	spectra = np.atleast_2d(spectra)
+	n_spectra,n_points = spectra.shape
+	if p0 is None:
+		p = _guess_lorentzians(x,spectra,n_peaks,width_guess)
+	else:
+		p = np.broadcast_to(np.asarray(p0,dtype=float),(n_spectra,n_peaks,4))
+	p = p.reshape(n_spectra,-1).copy()
+	n_pars = p.shape[1]
+
+	cost = _lorentzian_cost(x,spectra,p)
+	lam = np.full(n_spectra,1e-3)
+	active = np.arange(n_spectra)
+	for _ in range(max_iter):
+		if active.size == 0:
+			break
+		instrumentation.add('fit_iterations')
+		jtj,jtr = _lorentzian_normal_eqs(x,spectra[active],p[active])
+		# Marquardt scaling keeps amplitudes and frequencies comparably conditioned
+		d = np.sqrt(np.diagonal(jtj,axis1=1,axis2=2))
+		d[d == 0] = 1.
+		scaled = jtj/(d[:,:,np.newaxis]*d[:,np.newaxis,:])
+		scaled += lam[active,np.newaxis,np.newaxis]*np.eye(n_pars)
+		step = -np.linalg.solve(scaled,(jtr/d)[...,np.newaxis])[...,0]/d
+		new_p = p[active]+step
+		new_cost = _lorentzian_cost(x,spectra[active],new_p)
+
+		# steps to non-positive widths are rejected, raising the damping
+		positive = np.all(new_p.reshape(len(active),-1,4)[:,:,2] > 0,axis=1)
+		better = positive & (new_cost < cost[active])
+		converged = better & (cost[active]-new_cost <= tol*cost[active])
+		improved = active[better]
+		p[improved] = new_p[better]
+		cost[improved] = new_cost[better]
+		lam[active] = np.where(better,lam[active]/10.,lam[active]*10.)
+		converged |= lam[active] > 1e16
+		active = active[~converged]
+
+	jtj,_ = _lorentzian_normal_eqs(x,spectra,p)
+	dof = max(2*n_points-n_pars,1)
+	pcov = np.linalg.pinv(jtj)*(cost/dof)[:,np.newaxis,np.newaxis]
+
+	# negative amplitudes are the same line rotated by pi
+	popt = p.reshape(n_spectra,n_peaks,4)
+	flip = popt[...,0] < 0
+	popt[...,0] = np.abs(popt[...,0])
+	popt[...,1] = np.mod(popt[...,1]+np.pi*flip,2*np.pi)
+	sign = np.ones_like(popt)
+	sign[...,0] = np.where(flip,-1.,1.)
+	sign = sign.reshape(n_spectra,-1)
+	pcov *= sign[:,:,np.newaxis]*sign[:,np.newaxis,:]
+	return popt,pcov
+
+
+def phase_objective(x,spectra,ph0,ph1,weights=None):
+	"""
+	Negative area of each spectrum of a batch phased by exp(1j*(ph0+ph1*x)),
+	the sum of squares of the negative points of its real part, and its gradient
+	with respect to (ph0,ph1), evaluated for all spectra at once. A spectrum
+	of positive absorption lines has its least negative area when correctly
+	phased, as any zero or first order phase error mixes in dispersion, which
+	is negative on one side of each line.
+
+	:param x: Frequencies of the spectral points as a fraction of the spectral
+			width, so that ph1 is the phase change across the spectrum, shape (M,)
+	:type x: :class:`numpy.ndarray`
+	:param spectra: Complex spectra, shape (N,M) or (M,)
+	:type spectra: :class:`numpy.ndarray`
+	:param ph0: Zero order phase of each spectrum, shape (N,) or scalar
+	:type ph0: :class:`numpy.ndarray`
+	:param ph1: First order phase of each spectrum, shape (N,) or scalar
+	:type ph1: :class:`numpy.ndarray`
+	:param weights: Weight of each spectral point, e.g. a region mask, shape (M,)
+	:type weights: :class:`numpy.ndarray`
+
+	:returns: negative areas with shape (N,), gradients with shape (N,2)
+	:rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`
+	"""
+	x = np.asarray(x,dtype=float)
+	spectra = np.atleast_2d(spectra)
+	if weights is not None:
+		spectra = spectra*weights
+	p = np.stack(np.broadcast_arrays(np.asarray(ph0,dtype=float)*np.ones(spectra.shape[:1]),
+									 np.asarray(ph1,dtype=float)),axis=-1)
+	cost,jtr,_ = _negative_area(x,spectra,p)
+	return cost,2*jtr
+
+
+@instrumentation.timed('autophase')
+def autophase(x,spectra,ph0=None,ph1=0.,weights=None,max_iter=100,tol=1e-10):
+	"""
+	Zero and first order phases minimizing the negative area of each spectrum
+	of a batch (see :any:`phase_objective`), found for all spectra at once from
+	the already transformed spectra without further FFTs, by vectorized
+	Levenberg-Marquardt steps with analytic derivatives.
+
+	The negative area has local minima a few points of fid delay apart, so ph1
+	should start near its optimum, e.g. at the phase of the digital filter
+	group delay. By default ph0 starts at the phase maximizing the real integral
+	at the initial ph1, which also tells absorption from inverted absorption.
+
+	:param x: Frequencies of the spectral points as a fraction of the spectral width, shape (M,)
+	:type x: :class:`numpy.ndarray`
+	:param spectra: Complex spectra, shape (N,M) or (M,)
+	:type spectra: :class:`numpy.ndarray`
+	:param ph0: Initial zero order phase, scalar or one per spectrum
+	:type ph0: :class:`numpy.ndarray`
+	:param ph1: Initial first order phase, scalar or one per spectrum. 2*pi
+			is the phase of a fid delayed by one point.
+	:type ph1: :class:`numpy.ndarray`
+	:param weights: Weight of each spectral point, e.g. a region mask, shape (M,)
+	:type weights: :class:`numpy.ndarray`
+	:param max_iter: Maximum number of iterations
+	:type max_iter: int
+	:param tol: Relative decrease of the negative area at which a spectrum has converged
+	:type tol: float
+
+	:returns: ph0 in [0,2*pi) and ph1 of each spectrum, shapes (N,)
+	:rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`
+	"""
+	x = np.asarray(x,dtype=float)
+	spectra = np.atleast_2d(spectra)
+	if weights is not None:
+		spectra = spectra*weights
+	# scaled so that the tolerances do not depend on the size of the spectra
+	scale = np.abs(spectra).max(axis=-1)
+	scale[scale == 0] = 1.
+	spectra = spectra/scale[:,np.newaxis]
+	n_spectra = spectra.shape[0]
+	ph1 = np.broadcast_to(np.asarray(ph1,dtype=float),(n_spectra,))
+	if ph0 is None:
+		ph0 = -np.angle(np.sum(spectra*np.exp(1j*ph1[:,np.newaxis]*x),axis=-1))
+	p = np.stack([np.broadcast_to(np.asarray(ph0,dtype=float),(n_spectra,)),ph1],axis=-1)
+
+	cost,jtr,jtj = _negative_area(x,spectra,p)
+	lam = np.full(n_spectra,1e-3)
+	active = np.flatnonzero(cost > 0)
+	for _ in range(max_iter):
+		if active.size == 0:
+			break
+		instrumentation.add('autophase_iterations')
+		d = np.sqrt(np.diagonal(jtj[active],axis1=1,axis2=2))
+		d[d == 0] = 1.
+		scaled = jtj[active]/(d[:,:,np.newaxis]*d[:,np.newaxis,:])
+		scaled += lam[active,np.newaxis,np.newaxis]*np.eye(2)
+		step = -np.linalg.solve(scaled,(jtr[active]/d)[...,np.newaxis])[...,0]/d
+		new_cost,new_jtr,new_jtj = _negative_area(x,spectra[active],p[active]+step)
+
+		better = new_cost < cost[active]
+		converged = better & (cost[active]-new_cost <= tol*cost[active])
+		improved = active[better]
+		p[improved] += step[better]
+		cost[improved],jtr[improved],jtj[improved] = new_cost[better],new_jtr[better],new_jtj[better]
+		lam[active] = np.where(better,lam[active]/10.,lam[active]*10.)
+		converged |= (lam[active] > 1e16) | (cost[active] == 0)
+		active = active[~converged]
+
+	return np.mod(p[:,0],2*np.pi),p[:,1]
+
+
+def _lorentzian_model(x,p):
+	"""
+	Lorentzian lines and the line shapes g=1/(1+iu) for flattened 
+	parameters p of shape (N,4*n_peaks). 
+	"""
+	p = p.reshape(p.shape[0],-1,4,1)
+	A,phase,w,x0 = p[:,:,0],p[:,:,1],p[:,:,2],p[:,:,3]
+	g = 1/(1+2j*(x-x0)/w)
+	base = np.exp(1j*phase)*2/(np.pi*w)*g
+	return base,g,A,w
+
+
+def _lorentzian_cost(x,spectra,p):
+	base,_,A,_ = _lorentzian_model(x,p)
+	r = np.sum(A*base,axis=1)-spectra
+	return np.sum(r.real**2+r.imag**2,axis=-1)
+
+
+def _lorentzian_normal_eqs(x,spectra,p):
+	"""
+	Normal equations J^T J and J^T r of the stacked real/imaginary residuals. 
+	With L = A*base: dL/dA = base, dL/dphase = iL, dL/dw = -L*g/w and 
+	dL/dx0 = 2iL*g/w.
+	"""
+	base,g,A,w = _lorentzian_model(x,p)
+	L = A*base
+	r = np.sum(L,axis=1)-spectra
+	jac = np.stack([base,1j*L,-L*g/w,2j*L*g/w],axis=-1)
+	jac = jac.transpose(0,2,1,3).reshape(spectra.shape[0],x.size,-1)
+	jac_h = jac.conj().transpose(0,2,1)
+	jtj = np.matmul(jac_h,jac).real
+	jtr = np.matmul(jac_h,r[...,np.newaxis])[...,0].real
+	return jtj,jtr
+
+
+def _guess_lorentzians(x,spectra,n_peaks,width_guess=None):
+	"""
+	Initial parameters from the n_peaks largest local maxima of each spectrum's 
+	magnitude, with widths estimated by :any:`_half_height_widths` unless given.
+	"""
+	mag = np.abs(spectra)
+	is_max = np.zeros(mag.shape,dtype=bool)
+	is_max[:,1:-1] = (mag[:,1:-1] >= mag[:,:-2]) & (mag[:,1:-1] > mag[:,2:])
+	ranked = np.argsort(np.where(is_max,mag,-1),axis=-1)[:,::-1][:,:n_peaks]
+	# fall back to the global maxima when there are too few local maxima
+	ranked = np.where(np.take_along_axis(is_max,ranked,-1),ranked,np.argmax(mag,axis=-1)[:,np.newaxis])
+	peaks = np.take_along_axis(spectra,ranked,-1)
+	if width_guess is None:
+		width_guess = _half_height_widths(x,spectra,ranked,peaks)
+	p = np.empty(peaks.shape+(4,))
+	p[...,0] = np.abs(peaks)*np.pi*width_guess/2
+	p[...,1] = np.angle(peaks)
+	p[...,2] = width_guess
+	p[...,3] = x[ranked]
+	return p
+
+
+def _half_height_widths(x,spectra,ranked,peaks):
+	"""
+	Full widths at half height of the lines at points ranked (N,n_peaks), from
+	the crossings of half the peak height either side of the maximum by the
+	absorption (the spectrum phased by the peak's phase), linearly 
+	interpolated between points. A line crossing on one side only is taken
+	as symmetric, and one crossing on neither side spans the spectrum.
+	"""
+	n_spectra,n_points = spectra.shape
+	points = np.arange(n_points)
+	rows = np.arange(n_spectra)
+	span = abs(x[-1]-x[0]) if n_points > 1 else 1.
+	spacing = span/max(n_points-1,1)
+	widths = np.empty(ranked.shape)
+	for k in range(ranked.shape[1]):
+		i,peak = ranked[:,k],peaks[:,k]
+		absorption = (spectra*np.exp(-1j*np.angle(peak))[:,np.newaxis]).real
+		half = np.abs(peak)[:,np.newaxis]/2
+		below = absorption < half
+		# first point below half height right of the maximum, last one left of it
+		right = below & (points > i[:,np.newaxis])
+		left = below & (points < i[:,np.newaxis])
+		has_right,has_left = right.any(axis=1),left.any(axis=1)
+		j = np.where(has_right,np.argmax(right,axis=1),n_points-1)
+		l = np.where(has_left,n_points-1-np.argmax(left[:,::-1],axis=1),0)
+		half = half[:,0]
+		x_right = _crossing(x,absorption,rows,np.maximum(j-1,0),j,half)
+		x_left = _crossing(x,absorption,rows,np.minimum(l+1,n_points-1),l,half)
+		width = np.abs(x_right-x_left)
+		width = np.where(has_left & ~has_right,2*np.abs(x[i]-x_left),width)
+		width = np.where(has_right & ~has_left,2*np.abs(x_right-x[i]),width)
+		width = np.where(has_left | has_right,width,span)
+		widths[:,k] = np.maximum(width,spacing)
+	return widths
+
+
+def _crossing(x,y,rows,inside,outside,level):
+	"""
+	Position where y falls to level between the points inside and outside of each row
+	"""
+	y_in,y_out = y[rows,inside],y[rows,outside]
+	drop = y_in-y_out
+	frac = np.where(drop > 0,(y_in-level)/np.where(drop > 0,drop,1.),0.)
+	return x[inside]+np.clip(frac,0,1)*(x[outside]-x[inside])
+
+
+def _negative_area(x,spectra,p):
+	"""
+	Negative area sum(r**2) of the negative real points r of spectra phased by 
+	(ph0,ph1) parameters p of shape (N,2), with the Gauss-Newton terms J^T r and
+	J^T J. With R = Re(S*exp(1j*(ph0+ph1*x))) and I the imaginary part,
+	dR/dph0 = -I and dR/dph1 = -x*I.
+	"""
+	rotated = spectra*np.exp(1j*(p[:,0,np.newaxis]+p[:,1,np.newaxis]*x))
+	r = np.minimum(rotated.real,0)
+	imag = np.where(r < 0,rotated.imag,0)
+	jtr = -np.stack([np.sum(r*imag,axis=-1),(r*imag).dot(x)],axis=-1)
+	i2 = imag*imag
+	jtj = np.empty((len(p),2,2))
+	jtj[:,0,0] = i2.sum(axis=-1)
+	jtj[:,0,1] = jtj[:,1,0] = i2.dot(x)
+	jtj[:,1,1] = i2.dot(x*x)
+	return np.sum(r*r,axis=-1),jtr,jtj
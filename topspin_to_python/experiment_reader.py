@@ -6,21 +6,36 @@
 
 #use __all__ to restrict what globals are visible to external modules.
 __all__ = [
-	'read_experiment'
+	'read_experiment','read_dataset','find_expnos','iter_experiments'
 ]
 
 ## IMPORTS ####################################################################
 import numpy as np
-import os.path
-from fid import read_fid
-from acqu_pars import read_acqu_pars, prune_acqu_pars, format_acqu_pars
+import os
+import collections
+import multiprocessing
+import multiprocessing.pool
+from fid import read_fid, read_ser, FIDStack
+from packing import read_packed, PACKED_SUFFIX
+from processing import group_delay
+from acqu_pars import read_acqu_pars, AcquSchema, DEFAULT_SCHEMA
 import prune_lists
+import instrumentation
+
+#parameters of the acquisition as run, which lay out and scale the raw data
+_LAYOUT_PARS = (['td','sw_h','bytorda','dtypa','recchan','grpdly','dspfvs','decim']+
+                ['sfo{0}'.format(i) for i in range(1,9)])
 
 
 ## METHODS ####################################################################
-def read_experiment(exp_fp,prune_acqu=True,format_acqu=True,prune_list=None,format_list=None):
+@instrumentation.timed('read_experiment')
+def read_experiment(exp_fp,prune_acqu=True,format_acqu=True,prune_list=None,format_list=None,
+                    mmap=False,dtype=np.complex128,cache=None,load_fid=True):
     """
     Read TopSpin Experiment data folder and extract the fid/acquistion parameters. 
+    Arrayed and 2D experiments with a ser file instead of a fid are read as a
+    :class:`fid.FIDStack`. Experiments packed by :any:`packing.pack_experiment`
+    are read from their packed fid or ser when the raw file is absent.
 
     :param exp_fp: File path to experiment folder
     :type exp_fp: str
@@ -34,40 +49,238 @@ def read_experiment(exp_fp,prune_acqu=True,format_acqu=True,prune_list=None,form
     :param format_list: List of keys to reformat in acquistion parameters. By default 
                     is :any:`prune_lists.DEFAULT_REFORMAT_PARS`
     :type format_list: str
+    :param mmap: Whether to memory-map the fid/ser file while decoding it, see :any:`fid.read_fid`
+    :type mmap: bool
+    :param dtype: Complex dtype of the decoded fid, :type:`numpy.complex64` halves memory use
+    :type dtype: :class:`numpy.dtype`
+    :param cache: Cache to look the experiment up in and store it to. Cached fids are memory-mapped.
+    :type cache: :class:`cache.ExperimentCache`
+    :param load_fid: Whether to read the fid/ser, or only the acquisition parameters
+    :type load_fid: bool
     """
-    if prune_list is None:
-        prune_list = prune_lists.DEFAULT_PRUNE_PARS
-    if format_list is None:
-        format_list = prune_lists.DEFAULT_REFORMAT_PARS
-
+    if cache is not None:
+        cache_options = {'prune_acqu':prune_acqu,'format_acqu':format_acqu,
+                         'prune_list':prune_list,'format_list':format_list,
+                         'dtype':np.dtype(dtype).str,'load_fid':load_fid}
+        experiment = cache.get(exp_fp,**cache_options)
+        if experiment is not None:
+            return experiment
 
-    experiment = {}
+    if prune_list is None and format_list is None:
+        schema = DEFAULT_SCHEMA
+    else:
+        if prune_list is None:
+            prune_list = prune_lists.DEFAULT_PRUNE_PARS
+        if format_list is None:
+            format_list = prune_lists.DEFAULT_REFORMAT_PARS
+        schema = AcquSchema(prune_list,format_list)
 
 
+    experiment = {}
 
-    acqu_pars = read_acqu_pars(exp_fp+'acqu')
-    formatted_acqu = format_acqu_pars(acqu_pars,format_list)
 
-    if prune_acqu:
-        acqu_pars = prune_acqu_pars(acqu_pars,prune_list)
-    if format_acqu:
-        acqu_pars = formatted_acqu
 
-    experiment['acqu'] = acqu_pars
+    acqu_pars = read_acqu_pars(os.path.join(exp_fp,'acqu'))
+    experiment['acqu'] = schema.apply(acqu_pars,prune=prune_acqu,format=format_acqu)
 
-    if os.path.isfile(exp_fp+'fid'):
+    fid_fp = os.path.join(exp_fp,'fid')
+    ser_fp = os.path.join(exp_fp,'ser')
+    packed_fp = None
+    for raw_fp in (fid_fp,ser_fp):
+        if not os.path.isfile(raw_fp) and os.path.isfile(raw_fp+PACKED_SUFFIX):
+            packed_fp = raw_fp+PACKED_SUFFIX
+            break
+    if load_fid and (os.path.isfile(fid_fp) or os.path.isfile(ser_fp) or packed_fp is not None):
         
-        sfo = formatted_acqu['sfo'][\
-            np.nonzero(formatted_acqu['recchan'])[0][0]]*1E6
-        td = formatted_acqu['td']
-        aq = float(td)/formatted_acqu['sw_h']/2
+        # the fid parameters are read from the raw parameters, as pruning
+        # drops some of them, and from acqus, as acqu holds the setup values
+        layout_pars = _layout_pars(exp_fp,acqu_pars)
+        sfo = layout_pars['sfo{0}'.format(np.nonzero(layout_pars['recchan'])[0][0])]*1E6
+        td = layout_pars['td']
+        aq = float(td)/layout_pars['sw_h']/2
         experiment['acqu']['aq'] = aq
-        times = np.linspace(0,aq,td/2)
-        exp_fid = read_fid(exp_fp+'fid',times=times,sfo=sfo)
+        # the digital filter parameters are pruned, but its delay is needed for phasing
+        experiment['acqu']['group_delay'] = group_delay(layout_pars.get('grpdly',-1),
+                                                        layout_pars.get('dspfvs'),
+                                                        layout_pars.get('decim'))
+        # times are uniform over [0,aq] and held implicitly by their dwell
+        dwell = aq/(td//2-1) if td//2 > 1 else aq
+        read_pars = {'dwell':dwell,'sfo':sfo,'mmap':mmap,'dtype':dtype,
+                     'bytorda':layout_pars.get('bytorda',1),
+                     'dtypa':layout_pars.get('dtypa',0)}
+        if packed_fp is not None:
+            exp_fid = read_packed(packed_fp,dwell=dwell,sfo=sfo,dtype=dtype)
+        elif os.path.isfile(fid_fp):
+            exp_fid = read_fid(fid_fp,**read_pars)
+        else:
+            exp_fid = read_ser(ser_fp,td,**read_pars)
         experiment['fid'] = exp_fid 
 
-    # perform pruning/formatting
+    if cache is not None:
+        cache.put(exp_fp,experiment,**cache_options)
+
+    return experiment
+
+
+def _layout_pars(exp_fp,acqu_pars):
+    """
+    Layout parameters from the acqus file of an experiment, or acqu_pars without one
+    """
+    acqus_fp = os.path.join(exp_fp,'acqus')
+    if not os.path.isfile(acqus_fp):
+        return acqu_pars
+    return read_acqu_pars(acqus_fp,keys=_LAYOUT_PARS)
+
+
+def find_expnos(root):
+    """
+    Find the experiment (expno) folders of a TopSpin dataset.
+
+    :param root: File path to dataset folder
+    :type root: str
+    :return: sorted expnos of the numbered sub-folders with acquisition parameters
+    :rtype: list
+    """
+    return sorted(int(name) for name in os.listdir(root) if name.isdigit() and
+                  os.path.isfile(os.path.join(root,name,'acqu')))
+
+
+def read_dataset(root,workers=None,executor='thread',stack=False,expnos=None,**read_pars):
+    """
+    Read all experiments of a TopSpin dataset in parallel. 
+
+    :param root: File path to dataset folder holding numbered expno folders
+    :type root: str
+    :param workers: Number of parallel workers, by default the number of CPUs.
+                    1 reads serially.
+    :type workers: int
+    :param executor: 'thread' or 'process' workers. Threads suit I/O bound reads, 
+                    processes parsing of many small experiments.
+    :type executor: str
+    :param stack: Whether to stack the fids of all experiments into one contiguous 
+                :class:`fid.FIDStack` in ``dataset['fid']`` instead of keeping one 
+                fid per experiment. The fids must all be 1D and have the same shape.
+    :type stack: bool
+    :param expnos: Expnos to read, by default all found by :any:`find_expnos`
+    :type expnos: list
+    :param \**read_pars: Additional :any:`read_experiment` parameters
+    :return: dataset dictionary with the read 'expnos' and their 'experiments' in 
+            expno order, 'errors' holding the exception of every expno that
+            failed to read, and 'fid' if stacked
+    :rtype: dict
+    """
+    if executor not in ('thread','process'):
+        raise ValueError('Unknown executor {0}'.format(executor))
+    if expnos is None:
+        expnos = find_expnos(root)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    tasks = [(os.path.join(root,str(expno)),read_pars) for expno in expnos]
+
+    dataset = {'expnos':[],'experiments':[],'errors':{}}
+    stacked,times,sfo = None,None,None
+    pool = None
+    if workers > 1 and len(tasks) > 1:
+        if executor == 'thread':
+            pool = multiprocessing.pool.ThreadPool(min(workers,len(tasks)))
+            results = pool.imap(_read_experiment_task,tasks)
+        else:
+            pool = multiprocessing.Pool(min(workers,len(tasks)))
+            # worker processes record into their own instrumentation, merged here
+            results = instrumentation.imap_collected(pool,_read_experiment_task,tasks)
+    else:
+        results = (_read_experiment_task(task) for task in tasks)
+    try:
+        for expno,(experiment,error) in zip(expnos,results):
+            if error is not None:
+                dataset['errors'][expno] = error
+                continue
+            if stack:
+                if 'fid' not in experiment:
+                    dataset['errors'][expno] = ValueError('No fid to stack')
+                    continue
+                exp_fid = experiment.pop('fid')
+                if exp_fid.fid.ndim != 1:
+                    dataset['errors'][expno] = ValueError('Only 1D fids can be stacked')
+                    continue
+                if stacked is None:
+                    stacked = np.empty((len(tasks),)+exp_fid.fid.shape,dtype=exp_fid.fid.dtype)
+                    times,sfo = exp_fid.times,exp_fid.sfo
+                if exp_fid.fid.shape != stacked.shape[1:]:
+                    dataset['errors'][expno] = ValueError('fid shape {0} does not match stacked shape {1}'.format(
+                        exp_fid.fid.shape,stacked.shape[1:]))
+                    continue
+                stacked[len(dataset['expnos'])] = exp_fid.fid
+            dataset['expnos'].append(expno)
+            dataset['experiments'].append(experiment)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if stacked is not None:
+        stacked = stacked[:len(dataset['expnos'])]
+        dataset['fid'] = FIDStack(stacked,times,sfo,copy=False)
+    return dataset
+
+
+def _read_experiment_task(task):
+    """
+    Read one experiment for :any:`read_dataset`, returning the experiment 
+    or the error raised reading it.
+    """
+    exp_fp,read_pars = task
+    try:
+        return read_experiment(exp_fp,**read_pars),None
+    except Exception as e:
+        return None,e
+
+
+def iter_experiments(paths,prefetch=4,on_error='raise',**read_pars):
+    """
+    Iterate over experiments in order, reading up to prefetch experiments ahead 
+    in background threads so that I/O overlaps with their processing. At most 
+    prefetch experiments are held besides the one being consumed.
+
+    :param paths: File paths to experiment folders
+    :type paths: iterable
+    :param prefetch: Number of experiments to read ahead
+    :type prefetch: int
+    :param on_error: 'raise' to raise the error of an experiment that fails to read,
+                    or 'skip' to leave it out
+    :type on_error: str
+    :param \**read_pars: Additional :any:`read_experiment` parameters, e.g. 
+                        ``load_fid=False`` for a fast scan of acquisition parameters
+    :return: generator of (path,experiment)
+    :rtype: generator
+    """
+    if on_error not in ('raise','skip'):
+        raise ValueError('Unknown on_error {0}'.format(on_error))
+    paths = iter(paths)
+    pool = multiprocessing.pool.ThreadPool(max(prefetch,1))
+    pending = collections.deque()
+    try:
+        for exp_fp in paths:
+            pending.append((exp_fp,pool.apply_async(_read_experiment_task,((exp_fp,read_pars),))))
+            if len(pending) > prefetch:
+                for result in _pop_experiment(pending,on_error):
+                    yield result
+        while pending:
+            for result in _pop_experiment(pending,on_error):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
 
-    
 
-    return experiment 
\ No newline at end of file
+def _pop_experiment(pending,on_error):
+    """
+    Wait for the oldest pending read of :any:`iter_experiments`, giving its 
+    (path,experiment) if it succeeded.
+    """
+    exp_fp,result = pending.popleft()
+    experiment,error = result.get()
+    if error is None:
+        yield exp_fp,experiment
+    elif on_error == 'raise':
+        raise error
@@ -6,52 +6,218 @@
 
 #use __all__ to restrict what globals are visible to external modules.
 __all__ = [
-	'read_fid','FID','FT'
+	'read_fid','read_ser','FID','FIDStack','FT'
 ]
 
 ## IMPORTS ####################################################################
 import numpy as np
-import matplotlib.pyplot as plt 
-import scipy.optimize as opt
-
-def read_fid(fp,times=None,sfo=0):
+import data_analysis_fns
+import peaks
+from processing import Pipeline
+import instrumentation
+# matplotlib and scipy are imported on first use by the plotting and fitting
+# methods so that reading and transforming data only needs numpy
+
+def read_fid(fp,times=None,sfo=0,mmap=False,bytorda=1,dtypa=0,dtype=np.complex128,dwell=None):
 	"""
 	Read an FID file from TopSpin and return data as :type:`numpy.complex128`
 
 	:param fp: File or string of fid
 	:type fp: file,str
+	:param mmap: Whether to memory-map the raw file rather than reading it 
+				into memory. The complex fid is then built from the map in a
+				single pass and held by the :class:`FID` without copying.
+	:type mmap: bool
+	:param bytorda: Byte order of the raw data, acquisition parameter BYTORDA
+					(0 little endian, 1 big endian)
+	:type bytorda: int
+	:param dtypa: Data type of the raw data, acquisition parameter DTYPA 
+				(0 int32, 2 float64)
+	:type dtypa: int
+	:param dtype: Complex dtype of the returned fid, :type:`numpy.complex64` 
+				halves the memory footprint
+	:type dtype: :class:`numpy.dtype`
+	:param dwell: Time between points in seconds, instead of times
+	:type dwell: float
 
 	:returns: FID as complexnumpy array
 	:rtype: :type:`numpy.complex128`  
 	"""
 
-	# Topspin FIDs are stored as real/complex interleaved big endian 
-	# formatted float32 
-	d = np.fromfile(fp,dtype='>i4').reshape(-1,2)
-	fid =  d[:,0]+1j*d[:,1]
-	return FID(fid,times,sfo)
+	# Topspin FIDs are stored as real/complex interleaved, with byte order 
+	# and data type given by BYTORDA and DTYPA 
+	raw = _read_raw(fp,_raw_dtype(bytorda,dtypa),mmap)
+	fid = _interleaved_to_complex(raw,dtype)
+	return FID(fid,times,sfo,copy=False,dwell=dwell)
+
+
+def read_ser(fp,td,times=None,sfo=0,mmap=True,bytorda=1,dtypa=0,dtype=np.complex128,
+	block_size=1024,dwell=None):
+	"""
+	Read a ser file (2D or arrayed pseudo-2D experiment) from TopSpin as a 
+	single stack of FIDs.
+
+	:param fp: File or string of ser
+	:type fp: file,str
+	:param td: Number of raw points per row, acquisition parameter TD
+	:type td: int
+	:param mmap: Whether to memory-map the raw file rather than reading it 
+				into memory
+	:type mmap: bool
+	:param bytorda: Byte order of the raw data, see :any:`read_fid`
+	:type bytorda: int
+	:param dtypa: Data type of the raw data, see :any:`read_fid`
+	:type dtypa: int
+	:param dtype: Complex dtype of the returned fids
+	:type dtype: :class:`numpy.dtype`
+	:param block_size: Size in bytes of the blocks TopSpin pads each row to,
+					None or 0 if rows are not padded
+	:type block_size: int
+	:param dwell: Time between points in seconds, instead of times
+	:type dwell: float
+
+	:returns: Stack of FIDs with shape (n_rows,td/2)
+	:rtype: :class:`FIDStack`
+	"""
+	raw_dtype = _raw_dtype(bytorda,dtypa)
+	td = int(td)
+	row_size = _row_size(td,raw_dtype,block_size)
+	raw = _read_raw(fp,raw_dtype,mmap)
+	n_rows = raw.size//row_size
+	raw = raw[:n_rows*row_size].reshape(n_rows,row_size)[:,:td]
+	fid = _interleaved_to_complex(raw,dtype)
+	return FIDStack(fid,times,sfo,copy=False,dwell=dwell)
+
+
+def _read_raw(fp,raw_dtype,mmap=False):
+	"""
+	Raw values of a fid or ser file, memory-mapped or read into memory
+	"""
+	with instrumentation.span('read_raw'):
+		if mmap:
+			raw = np.memmap(fp,dtype=raw_dtype,mode='r')
+		else:
+			raw = np.fromfile(fp,dtype=raw_dtype)
+	instrumentation.add('bytes_mapped' if mmap else 'bytes_read',raw.nbytes)
+	return raw
+
+
+def _row_size(td,raw_dtype,block_size=1024):
+	"""
+	Number of raw values per ser row, td padded to a multiple of block_size bytes
+	"""
+	if not block_size:
+		return td
+	row_bytes = td*raw_dtype.itemsize
+	row_bytes = -(-row_bytes//block_size)*block_size
+	return row_bytes//raw_dtype.itemsize
+
+
+def _raw_dtype(bytorda=1,dtypa=0):
+	"""
+	Numpy dtype of TopSpin raw data from its byte order and data type parameters.
+
+	:param bytorda: Byte order (0 little endian, 1 big endian)
+	:type bytorda: int
+	:param dtypa: Data type (0 int32, 2 float64)
+	:type dtypa: int
+
+	:returns: Raw data type 
+	:rtype: :class:`numpy.dtype`
+	"""
+	byte_orders = {0:'<',1:'>'}
+	data_types = {0:'i4',2:'f8'}
+	try:
+		return np.dtype(byte_orders[int(bytorda)]+data_types[int(dtypa)])
+	except KeyError:
+		raise ValueError('Unsupported raw data format BYTORDA={0}, DTYPA={1}'.format(bytorda,dtypa))
+
+
+@instrumentation.timed('to_complex')
+def _interleaved_to_complex(raw,dtype=np.complex128):
+	"""
+	Convert real/imaginary interleaved raw data to a complex array in a 
+	single native-endian pass, without the temporaries of ``re+1j*im``.
+	Native floating point data of matching precision is viewed rather than copied.
+
+	:param raw: Interleaved raw data, last axis holding re,im,re,im,...
+	:type raw: :class:`numpy.ndarray`
+	:param dtype: Complex dtype of the result
+	:type dtype: :class:`numpy.dtype`
+
+	:returns: Complex array with last axis half the length of ``raw``
+	:rtype: :class:`numpy.ndarray`
+	"""
+	dtype = np.dtype(dtype)
+	if raw.dtype.kind == 'f' and raw.dtype.isnative and \
+		2*raw.dtype.itemsize == dtype.itemsize and raw.flags.c_contiguous:
+		return raw.view(dtype)
+	pairs = raw.reshape(raw.shape[:-1]+(-1,2))
+	fid = np.empty(pairs.shape[:-1],dtype=dtype)
+	fid.real = pairs[...,0]
+	fid.imag = pairs[...,1]
+	instrumentation.add('alloc_bytes',fid.nbytes)
+	return fid
+
+
+def _readonly_view(a):
+	"""
+	Return a read-only view of an array, leaving the original writeable.
+	"""
+	view = np.asarray(a).view()
+	view.flags.writeable = False
+	return view
 
 
 class FID(object):
+	"""
+	Free induction decay data object. Uniformly sampled times are stored as
+	their start and dwell time only, and materialized on access.
+
+	:param fid: Numpy array of the complex fid
+	:type fid: :class:`numpy.ndarray`
+	:param times: Numpy array of acquisition times
+	:type times: :class:`numpy.ndarray`
+	:param sfo: Spectrometer frequency of the observed channel in Hz
+	:type sfo: float
+	:param copy: Whether to copy the fid and times. If False, read-only views 
+				of the inputs are held instead.
+	:type copy: bool
+	:param dwell: Time between points in seconds, instead of times
+	:type dwell: float
+	:param t0: Time of the first point in seconds, with dwell
+	:type t0: float
+	"""
+	__slots__ = ('_fid','_times','_t0','_dwell','_sfo')
 	
-	def __init__(self,fid,times=None,sfo=0):
-		self._fid = np.copy(fid)
-		if times is None:
-			times = self.arange(fid.shape)
-		self._times = np.copy(times)
-		if self.times.shape != self.fid.shape:
-			raise ValueError('FID and associated times must have same shape')
+	def __init__(self,fid,times=None,sfo=0,copy=True,dwell=None,t0=0.):
+		self._fid = np.copy(fid) if copy else _readonly_view(fid)
+		self._times = None
+		if times is not None:
+			self.times = times if not copy else np.copy(times)
+		else:
+			self._t0 = float(t0)
+			self._dwell = 1. if dwell is None else float(dwell)
 
 		self._sfo = sfo
 
 	@property
 	def times(self):
-	    return self._times
+		if self._times is not None:
+			return self._times
+		return self._t0+self._dwell*np.arange(self.fid.shape[-1])
 	@times.setter
 	def times(self,times):
-		if times.shape != self.times.shape:
-			raise ValueError('New times must have same shape')
-		self.times = times 
+		times = np.asarray(times)
+		if times.shape != self.fid.shape[-1:]:
+			raise ValueError('FID and associated times must have same shape')
+		axis = _uniform_axis(times)
+		if axis is None:
+			self._times = _readonly_view(times)
+			self._t0,self._dwell = float(times[0]),float(times[1]-times[0])
+		else:
+			self._times = None
+			self._t0,self._dwell = axis
 
 	@property
 	def fid(self):
@@ -60,7 +226,7 @@ class FID(object):
 	def fid(self,fid):
 		if fid.shape != self.fid.shape:
 			raise ValueError('New fid must have same shape')
-		self.fid = fid 
+		self._fid = fid 
 
 	@property
 	def sfo(self):
@@ -69,19 +235,59 @@ class FID(object):
 	def sfo(self,sfo):
 		self._sfo = sfo
 	
-	def ft(self,phase=0):
+	@property
+	def dwell(self):
+		"""
+		Time between points in seconds
+		"""
+		return self._dwell
+
+	@property
+	def t0(self):
+		"""
+		Time of the first point in seconds
+		"""
+		return self._t0
+
+	def _with_fid(self,fid,t0=None):
+		"""
+		New fid of the same type and time axis, holding a view of fid
 		"""
-		Fourier transform of FID, with applied phase. 
+		new = type(self)(fid,sfo=self.sfo,copy=False,dwell=self.dwell,
+			t0=self.t0 if t0 is None else t0)
+		return new
 
-		:param phase: Phase to apply to fourier transform  
-		:type phase: float
+	def ft(self,phase=0,keep_fid=True):
+		"""
+		Fourier transform of FID, with applied phase. Stacked fids are 
+		transformed along their last axis.
+
+		:param phase: Phase to apply to fourier transform, or one phase per row
+					for stacked fids
+		:type phase: float,:class:`numpy.ndarray`
+		:param keep_fid: Whether the fourier transform keeps a reference to this fid.
+					If False the fid can be freed once the transform is done.
+		:type keep_fid: bool
 		:return: The phased fourier transform of the fid 
 		:rtype: :class:`FT`
 		"""
-		ft = np.fft.fftshift(np.fft.fft(self.fid*np.exp(1j*phase)))
-		freqs = np.fft.fftfreq(self.fid.size,d=(self.times[1]-self.times[0]))
-		freqs_shifted = np.fft.fftshift(freqs)
-		return FT(ft,freqs_shifted,phase=phase,sfo=self.sfo,fid=self)
+		return self.process(Pipeline(phase=phase),keep_fid)
+
+	def process(self,pipeline,keep_fid=True):
+		"""
+		Process the FID into a spectrum, see :class:`processing.Pipeline`.
+
+		:param pipeline: Apodization, zero-filling, phase and FFT to apply
+		:type pipeline: :class:`processing.Pipeline`
+		:param keep_fid: Whether the fourier transform keeps a reference to this fid
+		:type keep_fid: bool
+		:return: The processed fourier transform of the fid 
+		:rtype: :class:`FT`
+		"""
+		ft,freqs = pipeline.transform(self.fid,self.dwell)
+		n = ft.shape[-1]
+		return FT(ft,phase=pipeline.phase,sfo=self.sfo,fid=self if keep_fid else None,
+			pipeline=pipeline,f0=freqs[0],df=1./(n*self.dwell))
 
 	def drop_points(self,n):
 		"""
@@ -89,18 +295,20 @@ class FID(object):
 		:param n: number of points to drop
 		:type n: int
 
-		:return: A new fid with the first n points dropped
+		:return: A new fid with the first n points dropped, a view of this fid
 		:rtype: :class:`FID`
 		"""
-		shifted_fid = self.fid[n:,...]
-		shifted_times = self.times[n:,...]-self.times[n-1,...]
-		return FID(shifted_fid,shifted_times)
+		if self._times is not None:
+			times = self.times
+			return type(self)(self.fid[...,n:],times[n:]-times[n-1],self.sfo,copy=False)
+		return self._with_fid(self.fid[...,n:],self.dwell if n > 0 else self.t0)
 
 	
 	def plot(self,real=True,imag=True,drop_points=0,
 		real_label="Reals",imag_label="Imaginaries",x_label='time(s)',
 		y_label='arb units',*plotting_args,
 		**plotting_kwargs):
+		import matplotlib.pyplot as plt
 		if real:
 			plt.plot(self.times[drop_points:],np.real(self.fid[drop_points:]),
 				*plotting_args,**plotting_kwargs)
@@ -117,15 +325,108 @@ class FID(object):
 		return {'fid':self.fid,'times':self.times}.__str__()[1:-1]
 
 
+class FIDStack(FID):
+	"""
+	Stack of FIDs sharing a time axis, such as the rows of a ser file. 
+	Transforms and analysis are performed on all rows at once along the 
+	last axis.
+
+	:param fid: Numpy array of the complex fids with shape (n_rows,n_points)
+	:type fid: :class:`numpy.ndarray`
+	:param times: Numpy array of acquisition times with shape (n_points,)
+	:type times: :class:`numpy.ndarray`
+	:param sfo: Spectrometer frequency of the observed channel in Hz
+	:type sfo: float
+	:param copy: Whether to copy the fids and times, see :class:`FID`
+	:type copy: bool
+	:param dwell: Time between points in seconds, instead of times
+	:type dwell: float
+	:param t0: Time of the first point in seconds, with dwell
+	:type t0: float
+	"""
+	__slots__ = ()
+
+	def __init__(self,fid,times=None,sfo=0,copy=True,dwell=None,t0=0.):
+		if np.ndim(fid) != 2:
+			raise ValueError('FIDStack data must have shape (n_rows,n_points)')
+		super(FIDStack,self).__init__(fid,times,sfo,copy,dwell,t0)
+
+	def __len__(self):
+		return self.fid.shape[0]
+
+	def __getitem__(self,index):
+		"""
+		A single row as a :class:`FID`, or a slice of rows as a :class:`FIDStack`.
+		Rows are views of the stack.
+		"""
+		fid = self.fid[index]
+		if fid.ndim == 1:
+			row = FID(fid,sfo=self.sfo,copy=False)
+		else:
+			row = FIDStack(fid,sfo=self.sfo,copy=False)
+		row._times,row._t0,row._dwell = self._times,self._t0,self._dwell
+		return row
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+
+def _uniform_axis(values):
+	"""
+	(start,step) of a uniformly spaced axis, or None if it is not uniform.
+	"""
+	if len(values) < 2:
+		return (float(values[0]) if len(values) else 0.),1.
+	step = (values[-1]-values[0])/float(len(values)-1)
+	if step == 0 or not np.allclose(np.diff(values),step,rtol=1E-6,atol=0):
+		return None
+	return float(values[0]),float(step)
+
+
+def _phase_factor(phase,dtype=np.complex128):
+	"""
+	Phase rotation factor exp(1j*phase), shaped to broadcast against the 
+	last axis of data with one phase per row.
+	"""
+	phase = np.asarray(phase,dtype=float)
+	return np.exp(1j*phase).astype(dtype)[...,np.newaxis]
+
+
+def _lorentzian_power(x,A,phase,w,x0):
+    """
+    Squared magnitude of a :any:`data_analysis_fns.lorentzian` line, fit by :any:`FT.fit_lorentzian`.
+    """
+    l = data_analysis_fns.lorentzian(x,A,phase,w,x0)
+    #add in quadrature
+    return l.real**2+l.imag**2
+
+
+def _zero_order_phase(ft):
+    """
+    Zero-order phase maximizing the real integral of each spectrum (row) of ``ft``.
+
+    The real integral of exp(1j*phase)*ft is Re(exp(1j*phase)*S) for the 
+    complex sum S, maximal at phase = -angle(S).
+
+    :param ft: Spectra region, with spectral points along the last axis
+    :type ft: :class:`numpy.ndarray`
+
+    :returns: Phase per spectrum in [0,2*pi)
+    :rtype: float,:class:`numpy.ndarray`
+    """
+    return np.mod(-np.angle(np.sum(ft,axis=-1)),2*np.pi)
 
 
 class FT(object):
     """
-    Fourier transform data object. 
+    Fourier transform data object. Uniformly spaced frequencies are stored as
+    their start and spacing only, and materialized on access.
 
     :param ft: Numpy array of fourier transform
     :type ft: :class:`numpy.ndarray`
-    :param freqs: Numpy array of frequencies centered at 0
+    :param freqs: Numpy array of frequencies centered at 0, by default the
+                point indexes (or f0 and df if given)
     :type freqs: :class:`numpy.ndarray` 
     :param phase: Relative phase to original FID data
     :type phase: float 
@@ -133,27 +434,81 @@ class FT(object):
     :type auto_phase: bool
     :param fid: Original fid of fourier transform
     :type fid: :class:`FID`
+    :param pipeline: Processing the fourier transform was made with
+    :type pipeline: :class:`processing.Pipeline`
+    :param f0: Frequency of the first point in Hz, instead of freqs
+    :type f0: float
+    :param df: Frequency spacing in Hz, instead of freqs
+    :type df: float
+    :param ph1: First order phase relative to the original FID data, see :any:`phased`
+    :type ph1: float
     """
-    def __init__(self,ft,freqs=None,phase=0,sfo=0,auto_phase=False,fid=None):
+    __slots__ = ('_ft','_freqs','_f0','_df','_phase','_ph1','_sfo','_fid','_pipeline',
+                 '_cumulative','_sorted')
+
+    def __init__(self,ft,freqs=None,phase=0,sfo=0,auto_phase=False,fid=None,pipeline=None,
+                 f0=0.,df=1.,ph1=0.):
         self._ft = ft
-        if freqs is None:
-            freqs = self.arange(ft.shape)
-        self._freqs = freqs
-        if self.freqs.shape != self.ft.shape:
-            raise ValueError('FT and associated freqs must have same shape')
+        self._freqs = None
+        self._f0,self._df = float(f0),float(df)
+        if freqs is not None:
+            self.freqs = freqs
 
         self._phase = phase 
+        self._ph1 = ph1
         self._sfo = sfo
         self._fid = fid
+        self._pipeline = pipeline
+        self._cumulative = None
+        self._sorted = None
 
     @property
     def freqs(self):
-        return self._freqs
+        if self._freqs is not None:
+            return self._freqs
+        return self._freq_range(0,self.ft.shape[-1])
     @freqs.setter
     def freqs(self,freqs):
-        if freqs.shape != self.freqs.shape:
-            raise ValueError('New freqs must have same shape')
-        self.freqs = freqs
+        freqs = np.asarray(freqs)
+        if freqs.shape != self.ft.shape[-1:]:
+            raise ValueError('FT and associated freqs must have same shape')
+        axis = _uniform_axis(freqs)
+        if axis is None:
+            self._freqs = freqs
+            self._f0,self._df = float(freqs[0]),float(freqs[1]-freqs[0])
+        else:
+            self._freqs = None
+            self._f0,self._df = axis
+        self._sorted = None
+
+    @property
+    def f0(self):
+        """
+        Frequency of the first point in Hz
+        """
+        return self._f0
+
+    @property
+    def df(self):
+        """
+        Frequency spacing in Hz, that of the first two points for non-uniform frequencies
+        """
+        return self._df
+
+    def _freq_range(self,lo,hi):
+        """
+        Frequencies of points lo to hi, computed without materializing the axis
+        """
+        if self._freqs is not None:
+            return self._freqs[lo:hi]
+        return self._f0+self._df*np.arange(lo,hi)
+
+    def _replace(self,ft,phase,ph1=None):
+        """
+        FT on the same frequencies, fid and pipeline, with this first order phase by default
+        """
+        return FT(ft,self._freqs,phase=phase,sfo=self.sfo,fid=self.fid,pipeline=self.pipeline,
+                  f0=self._f0,df=self._df,ph1=self.ph1 if ph1 is None else ph1)
 
     @property
     def ft(self):
@@ -162,7 +517,8 @@ class FT(object):
     def ft(self,ft):
         if ft.shape != self.ft.shape:
             raise ValueError('New ft must have same shape')
-        self.ft = ft
+        self._ft = ft
+        self._cumulative = None
 
     @property
     def sfo(self):
@@ -178,29 +534,88 @@ class FT(object):
     def phase(self,phase):
         self._phase = phase 
 
+    @property
+    def ph1(self):
+        """
+        First order phase in radians across the spectral width, pivoting on 0 Hz
+        """
+        return self._ph1
+
     @property
     def fid(self):
         return self._fid
+
+    @property
+    def pipeline(self):
+        return self._pipeline
     
 
     def ift(self):
         """
-        Inverse Fourier Transform, with undone phasing
+        Inverse Fourier Transform, with undone zero and first order phasing
 
         :return: The inverse fourier transform of the fourier transform (FID)
         :rtype: :class:`FID`
 
         """
-        n_fid = np.fft.ifft(np.fft.ifftshift(self.ft))*np.exp(-1j*self.phase)
-        times = np.linspace(0,float(len(n_fid))/(self.freqs[-1]-self.freqs[0]),len(n_fid))
-        return fid_lib.FID(n_fid,times=times,sfo=self.sfo)
+        ft = self.ft
+        if np.any(self.ph1):
+            ft = ft*np.exp(-1j*np.asarray(self.ph1,dtype=float)[...,np.newaxis]*
+                           self._sw_fraction(self.freqs))
+        n_fid = np.fft.ifft(np.fft.ifftshift(ft,axes=-1),axis=-1)*_phase_factor(-np.asarray(self.phase))
+        n = n_fid.shape[-1]
+        fid_type = FIDStack if n_fid.ndim > 1 else FID
+        return fid_type(n_fid,sfo=self.sfo,copy=False,dwell=1./(n*self.df))
+
+
+
+
+    def phased(self,ph0=0.,ph1=0.):
+        """
+        Spectrum rotated by a zero order phase ph0 and a first order phase ph1
+        changing linearly with frequency, exp(1j*(ph0+ph1*f/sw)), applied to the
+        transformed spectrum without any FFT. The first order phase pivots on
+        0 Hz, the carrier, and sw is the width n*df of this spectrum, so full
+        spectra should be phased before a :any:`region` is taken. :attr:`phase`
+        accumulates ph0 and :attr:`ph1` accumulates ph1, which :any:`ift` undoes.
+
+        :param ph0: Zero order phase in radians, or one per row for stacked spectra
+        :type ph0: float,:class:`numpy.ndarray`
+        :param ph1: Phase change across the spectral width in radians, or one per row
+        :type ph1: float,:class:`numpy.ndarray`
+        :return: Phased spectrum
+        :rtype: :class:`FT`
+        """
+        ph0 = np.asarray(ph0,dtype=float)[...,np.newaxis]
+        ph1 = np.asarray(ph1,dtype=float)[...,np.newaxis]
+        factor = np.exp(1j*(ph0+ph1*self._sw_fraction(self.freqs))).astype(self.ft.dtype)
+        return self._replace(self.ft*factor,np.mod(self.phase+ph0[...,0],2*np.pi),
+                             self.ph1+ph1[...,0])
 
+    def remove_group_delay(self,delay):
+        """
+        Remove the group delay of the digital filter as a first order phase,
+        instead of dropping the delayed points of the fid, which loses signal.
 
+        :param delay: Group delay in points, see :any:`processing.group_delay`
+                    or the 'group_delay' of :any:`experiment_reader.read_experiment`
+        :type delay: float
+        :return: Phased spectrum
+        :rtype: :class:`FT`
+        """
+        # a fid delayed by delay points has the linear phase -2*pi*delay*f/sw
+        return self.phased(ph1=2*np.pi*np.asarray(delay,dtype=float))
 
+    def _sw_fraction(self,freqs):
+        """
+        Frequencies as a fraction of the spectral width
+        """
+        return freqs/(self.ft.shape[-1]*self.df)
 
     def plot(self,real=True,imag=True,ppm=True,centered=True,x_label='ppm',
         y_label='arb units',real_label="Reals",imag_label="Imaginaries",
         *plotting_args,**plotting_kwargs):
+        import matplotlib.pyplot as plt
 
         if x_label=='ppm' and ppm==False:
             x_label='Hz'
@@ -222,31 +637,105 @@ class FT(object):
 
     def fid_region(self,left=None,right=None,ppm=False):
         """
-        Extract region of the FID. 
+        Extract region of the FID. The region is a view of the spectrum.
 
-        :param left: The left offset in kHz (or ppm if ppm is True)
+        :param left: The left offset in kHz (or ppm if ppm is True), None for no bound
         :type left: float
-        :param right: The right offset in kHz (or ppm if ppm is True)
+        :param right: The right offset in kHz (or ppm if ppm is True), None for no bound
         :type right: float
         :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
         :type ppm: bool
         :return: Extracted fid, with frequencies 
         :rtype: np.ndarry,np.ndarray
         """
-        if left is None:
-            left = self.freqs[0]
-        elif ppm:
-            left = left*self.sfo/1E6
-        if right is None:
-            right = self.freqs[-1]
-        elif ppm:
-            right = right*self.sfo/1E6 
-        indexes = np.where(np.logical_and(self.freqs>left,self.freqs<right))
-        return self.ft[indexes],self.freqs[indexes]
+        if not self.freqs_sorted():
+            left,right = self._offsets_hz(left,right,ppm)
+            indexes = np.where(np.logical_and(self.freqs>left,self.freqs<right))[0]
+            return self.ft[...,indexes],self.freqs[indexes]
+        lo,hi = self.region_bounds(left,right,ppm)
+        return self.ft[...,lo:hi],self._freq_range(lo,hi)
+
+    def region(self,left=None,right=None,ppm=False):
+        """
+        Region of the spectrum as a new FT holding a view of this one, see :any:`fid_region`.
+
+        :param left: The left offset in kHz (or ppm if ppm is True), None for no bound
+        :type left: float
+        :param right: The right offset in kHz (or ppm if ppm is True), None for no bound
+        :type right: float
+        :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
+        :type ppm: bool
+        :return: Spectrum of the region 
+        :rtype: :class:`FT`
+        """
+        ft,freqs = self.fid_region(left,right,ppm)
+        # the first order phase across the narrower width of the region
+        ph1 = self.ph1*len(freqs)/float(self.ft.shape[-1]) if len(freqs) else self.ph1
+        if self._freqs is not None or len(freqs) == 0:
+            return FT(ft,freqs,phase=self.phase,sfo=self.sfo,ph1=ph1)
+        return FT(ft,phase=self.phase,sfo=self.sfo,f0=freqs[0],df=self.df,ph1=ph1)
+
+    def region_bounds(self,left=None,right=None,ppm=False):
+        """
+        Index bounds of the points strictly between left and right, found by
+        binary search of the frequencies, which must be sorted. Bounds may be 
+        arrays to find many regions at once.
+
+        :param left: The left offset(s) in kHz (or ppm if ppm is True), None for no bound
+        :type left: float,:class:`numpy.ndarray`
+        :param right: The right offset(s) in kHz (or ppm if ppm is True), None for no bound
+        :type right: float,:class:`numpy.ndarray`
+        :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
+        :type ppm: bool
+        :return: start and stop indexes of each region
+        :rtype: int,int
+        """
+        left,right = self._offsets_hz(left,right,ppm)
+        if self._freqs is not None:
+            lo = np.searchsorted(self._freqs,left,side='right')
+            hi = np.searchsorted(self._freqs,right,side='left')
+        else:
+            lo = self._uniform_bound(left,strict=True)
+            hi = self._uniform_bound(right,strict=False)
+        return lo,np.maximum(hi,lo)
+
+    def _uniform_bound(self,value,strict):
+        """
+        searchsorted of value in the implicit uniform frequencies, side='right' if
+        strict else 'left', in constant time.
+        """
+        n = self.ft.shape[-1]
+        value = np.asarray(value,dtype=float)
+        inside = np.less_equal if strict else np.less
+        k = np.clip(np.floor((value-self._f0)/self._df)+1,0,n).astype(int)
+        #correct rounding so bounds agree exactly with the materialized frequencies
+        k = np.where((k > 0) & ~inside(self._f0+self._df*(k-1),value),k-1,k)
+        k = np.where((k < n) & inside(self._f0+self._df*k,value),k+1,k)
+        return k[()]
+
+    def freqs_sorted(self):
+        """
+        Whether the frequencies are in ascending order, checked on first use.
+        """
+        if self._sorted is None:
+            if self._freqs is None:
+                self._sorted = self._df > 0
+            else:
+                self._sorted = bool(np.all(np.diff(self._freqs) > 0))
+        return self._sorted
+
+    def _offsets_hz(self,left,right,ppm):
+        left = -np.inf if left is None else np.asarray(left,dtype=float)
+        right = np.inf if right is None else np.asarray(right,dtype=float)
+        if ppm:
+            left,right = left*self.sfo/1E6,right*self.sfo/1E6
+        return left,right
 
     def integrate(self,left=None,right=None,real=True,ppm=False):
         """
-        integrate the spectrum over a given region
+        integrate the spectrum over a given region. Each integral is a 
+        difference of the cumulative sums of the spectrum, which are computed 
+        once per spectrum.
 
         :param left: The left offset in kHz (or ppm if ppm is True)
         :type left: float
@@ -258,10 +747,96 @@ class FT(object):
         :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
         :type ppm: bool
         """
-        ft,_ = self.fid_region(left,right,ppm)
-        ft = ft.real if real else self.ft.imag
-        return np.sum(ft)
+        return self.integrate_regions([(left,right)],real,ppm)[...,0]
 
+    def integrate_regions(self,regions,real=True,ppm=False):
+        """
+        integrate every spectrum over many regions at once.
+
+        :param regions: (left,right) offsets of each region in kHz (or ppm if ppm is True),
+                    None for no bound
+        :type regions: list
+        :param real: Whether to integrate the real portion of the spectrum (True),
+                    or imaginary (False)
+        :type real: bool
+        :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
+        :type ppm: bool
+        :return: integrals with shape (n_regions,), or (n_spectra,n_regions) for 
+                stacked spectra
+        :rtype: :class:`numpy.ndarray`
+        """
+        regions = [(-np.inf if l is None else l,np.inf if r is None else r) for l,r in regions]
+        left,right = np.array(regions,dtype=float).reshape(-1,2).T
+        if not self.freqs_sorted():
+            left,right = self._offsets_hz(left,right,ppm)
+            ft = self.ft.real if real else self.ft.imag
+            masks = np.logical_and(self.freqs>left[:,np.newaxis],self.freqs<right[:,np.newaxis])
+            return np.dot(ft,masks.T)
+        lo,hi = self.region_bounds(left,right,ppm)
+        cumulative = self.cumulative()
+        integrals = cumulative[...,hi]-cumulative[...,lo]
+        return integrals.real if real else integrals.imag
+
+    def cumulative(self):
+        """
+        Cumulative sums of the spectrum along the frequencies, with a leading 
+        zero so that the integral over points lo to hi-1 is c[...,hi]-c[...,lo].
+        Computed on first use.
+
+        :return: cumulative sums with shape (...,n+1)
+        :rtype: :class:`numpy.ndarray`
+        """
+        if self._cumulative is None:
+            cumulative = np.zeros(self.ft.shape[:-1]+(self.ft.shape[-1]+1,),dtype=np.complex128)
+            np.cumsum(self.ft,axis=-1,out=cumulative[...,1:])
+            self._cumulative = cumulative
+        return self._cumulative
+
+    def pick_peaks(self,snr=5.,threshold=None,noise=None,real=True):
+        """
+        Every peak above a noise threshold, of all rows of stacked spectra at once,
+        see :any:`peaks.pick_peaks`.
+
+        :param snr: Minimum height above the baseline in units of the noise
+        :type snr: float
+        :param threshold: Minimum height above the baseline, instead of snr times the noise
+        :type threshold: float
+        :param noise: Noise standard deviation, estimated by default
+        :type noise: float
+        :param real: Whether to pick peaks of the real part (True) or of the magnitude (False)
+        :type real: bool
+        :return: Peaks with spectrum row, position (Hz and ppm), height and width
+        :rtype: :class:`numpy.ndarray`
+        """
+        return peaks.pick_peaks(self,snr=snr,threshold=threshold,noise=noise,real=real)
+
+    def integrate_peaks(self,found,scale=2.,real=True):
+        """
+        Integrate each picked peak over its position plus or minus scale peak widths,
+        in the spectrum row it was found in.
+
+        :param found: Peaks, see :any:`pick_peaks`
+        :type found: :class:`numpy.ndarray`
+        :param scale: Half width of the integration regions in peak widths
+        :type scale: float
+        :param real: Whether to integrate the real portion of the spectrum (True),
+                    or imaginary (False)
+        :type real: bool
+        :return: integral of each peak, shape (n_peaks,)
+        :rtype: :class:`numpy.ndarray`
+        """
+        if not self.freqs_sorted():
+            raise ValueError('Integrating peaks needs ascending frequencies')
+        lo,hi = self.region_bounds(*peaks.peak_regions(found,scale))
+        cumulative = self.cumulative()
+        if cumulative.ndim == 1:
+            integrals = cumulative[hi]-cumulative[lo]
+        else:
+            rows = found['spectrum']
+            integrals = cumulative[rows,hi]-cumulative[rows,lo]
+        return integrals.real if real else integrals.imag
+
+    @instrumentation.timed('fit_lorentzian')
     def fit_lorentzian(self,left=None,right=None,ppm=False,gen_data=False,width_guess=1000.,**opt_pars):
         """
         Fit the spectrum to a lorentzian function. 
@@ -287,34 +862,75 @@ class FT(object):
                                         by gen_data)
         :rtype:popt(Amplitude,phase,width,location),pcov,:class:`FT`(optional)
         """
-        def lorentzian(x,A,phase,w,x0):
-            absorption = A*1/(np.pi*w/2)/(1+((x-x0)/(w/2))**2)
-            dispersion = 1j*A*((x-x0)/(w/2))/(np.pi*w/2)/(1+((x-x0)/(w/2))**2)
-            return np.exp(1j*phase)*(absorption+dispersion)
-
-        
-        def fit_fun(x,A,phase,w,x0): 
-            l = lorentzian(x,A,phase,w,x0)
-            #add in quadrature
-            return l.real**2+l.imag**2
+        import scipy.optimize as opt
         ft,freqs = self.fid_region(left,right,ppm)
         A = np.absolute(ft[np.argmax(np.absolute(ft))])
         a_ft = ft.real**2+ft.imag**2
-        popt,pcov = opt.curve_fit(fit_fun,freqs,a_ft,p0=[A,0,width_guess,0])
+        popt,pcov = opt.curve_fit(_lorentzian_power,freqs,a_ft,p0=[A,0,width_guess,0])
 
         if gen_data:
-            gen_ft = FT(lorentzian(freqs,*popt),freqs,phase=popt[2],fid=self.fid)
+            gen_ft = FT(data_analysis_fns.lorentzian(freqs,*popt),freqs,phase=popt[2],fid=self.fid)
             return popt,pcov,gen_ft
 
         return popt,pcov
 
+    def fit_lorentzians(self,left=None,right=None,ppm=False,n_peaks=1,p0=None,width_guess=None,
+        gen_data=False,**fit_pars):
+        """
+        Fit the complex spectrum, or every row of stacked spectra at once, to a sum of 
+        lorentzian lines, see :any:`data_analysis_fns.fit_lorentzians`.
 
-    def apk(self,use_lorentzian=False,left=None,right=None,ppm=False,**opt_pars):
+        :param left: The left offset in kHz (or ppm if ppm is True)
+        :type left: float
+        :param right: The right offset in kHz (or ppm if ppm is True)
+        :type right: float
+        :param ppm: Determine if offsets will be given in kHz(False) or ppm(True)
+        :type ppm: bool
+        :param n_peaks: Number of lines to fit per spectrum
+        :type n_peaks: int
+        :param p0: Initial (Amplitude,phase,width,location) per line
+        :type p0: :class:`numpy.ndarray`
+        :param width_guess: Initial width when p0 is not given, by default
+                    estimated from the half height width of each line
+        :type width_guess: float
+        :param gen_data: Whether to generate a :class:`FT` from fitted lorentzian parameters 
+        :type gen_data: bool
+        :param \**fit_pars: Additional parameters of :any:`data_analysis_fns.fit_lorentzians`
+
+        :return: popt(Amplitude,phase,width,location) with shape (n_peaks,4), or (N,n_peaks,4)
+                for stacked spectra, covariances, generated spectrum by fit (optional, 
+                controlled by gen_data)
+        :rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`,:class:`FT`(optional)
+        """
+        ft,freqs = self.fid_region(left,right,ppm)
+        popt,pcov = data_analysis_fns.fit_lorentzians(freqs,ft,n_peaks=n_peaks,p0=p0,
+                                                      width_guess=width_guess,**fit_pars)
+        if ft.ndim == 1:
+            popt,pcov = popt[0],pcov[0]
+
+        if gen_data:
+            lines = data_analysis_fns.lorentzian(freqs,*np.moveaxis(popt[...,np.newaxis],-2,0))
+            gen_ft = FT(np.sum(lines,axis=-2),freqs,phase=self.phase,sfo=self.sfo)
+            return popt,pcov,gen_ft
+
+        return popt,pcov
+
+
+    @instrumentation.timed('apk')
+    def apk(self,use_lorentzian=False,left=None,right=None,ppm=False,method='analytic',**opt_pars):
         """
         Automatically phase the fourier transform to maximize the integral over a region.
-        
+        Stacked spectra are phased giving one phase per row.
+
+        As a zero-order phase is a scalar rotation of the spectrum, the real integral
+        over the region is maximized in closed form by rotating the region's complex 
+        sum onto the positive real axis. With the default ``method='analytic'`` the 
+        already computed spectrum is rotated directly, without any further FFTs, 
+        and all rows of a stack are phased at once.
     
         :param use_lorentzian: Whether to do phasing by fitting spectrum to lorentzian. 
+                    With ``method='analytic'`` all spectra are fit at once by
+                    :any:`fit_lorentzians` and rotated by the fitted line phase.
         :type use_lorentzian: bool
         :param left: The left offset in kHz (or ppm if ppm is True) not used with use_lorentzian
         :type left: float
@@ -324,24 +940,78 @@ class FT(object):
                     or imaginary (False)
         :param ppm: Determine if offsets will be given in kHz(False) or ppm(True) not used with use_lorentzian
         :type ppm: bool
+        :param method: 'analytic' for the closed form integral maximum (or fitted line 
+                    phase), 'first_order' to also optimize a first order phase
+                    by :any:`data_analysis_fns.autophase` on this spectrum, or
+                    'minimize' to numerically optimize the phase re-transforming
+                    the fid at every step.
+        :type method: str
         :param \**kwargs: Additional minimize parameters see `Scipy minimize 
-        http://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.minimize.html#scipy.optimize.minimize`
+        http://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.minimize.html#scipy.optimize.minimize`,
+        or :any:`data_analysis_fns.autophase` parameters (e.g. the initial ph1) 
+        with ``method='first_order'``
 
         :return: Phased spectrum
         :rtype: :class:`FT`
         """
+        if method not in ('analytic','first_order','minimize'):
+            raise ValueError('Unknown apk method {0}'.format(method))
+        if method == 'first_order':
+            left,right = self._offsets_hz(left,right,ppm)
+            freqs = self.freqs
+            # the points strictly between left and right, as in region_bounds
+            weights = ((freqs > left) & (freqs < right)).astype(float)
+            ph0,ph1 = data_analysis_fns.autophase(self._sw_fraction(freqs),self.ft,
+                                                  weights=weights,**opt_pars)
+            if self.ft.ndim == 1:
+                ph0,ph1 = ph0[0],ph1[0]
+            return self.phased(ph0,ph1)
+        if method == 'analytic':
+            if use_lorentzian:
+                popt,_ = self.fit_lorentzians(left,right,ppm,**opt_pars)
+                phase = np.mod(-popt[...,0,1],2*np.pi)
+            else:
+                ft,_ = self.fid_region(left,right,ppm)
+                phase = _zero_order_phase(ft)
+            ft = self.ft*_phase_factor(phase,self.ft.dtype)
+            return self._replace(ft,np.mod(self.phase+phase,2*np.pi))
+
         if self.fid is not None:
             fid = self.fid
         else:
             fid = self.ift()
 
+        pipeline = self.pipeline if self.pipeline is not None else Pipeline()
+        if isinstance(fid,FIDStack):
+            ph1 = np.broadcast_to(self.ph1,(len(fid),))
+            phase = np.array([self._apk_phase(row,pipeline,use_lorentzian,left,right,ppm,row_ph1,
+                                              **opt_pars)
+                              for row,row_ph1 in zip(fid,ph1)])
+        else:
+            phase = self._apk_phase(fid,pipeline,use_lorentzian,left,right,ppm,self.ph1,**opt_pars)
+        ft = fid.process(pipeline.phased(phase))
+        # the first order phase is kept, only the zero order phase is optimized
+        return ft.phased(ph1=self.ph1) if np.any(self.ph1) else ft
+
+    @staticmethod
+    def _apk_phase(fid,pipeline,use_lorentzian=False,left=None,right=None,ppm=False,ph1=0.,
+                   **opt_pars):
+        """
+        Optimal zero-order phase of a single fid with first order phase ph1, see :any:`apk`.
+        """
+        import scipy.optimize as opt
+        process = lambda phase: fid.process(pipeline.phased(phase))
+        if np.any(ph1):
+            process = lambda phase: fid.process(pipeline.phased(phase)).phased(ph1=ph1)
         if use_lorentzian:
-            min_func = lambda phase: -fid.ft(phase[0]).fit_lorentzian(left=left,right=right,ppm=ppm,gen_data=False,width_guess=1000.,**opt_pars)[0][0]
+            min_func = lambda phase: -process(phase[0]).fit_lorentzian(left=left,right=right,ppm=ppm,gen_data=False,width_guess=1000.,**opt_pars)[0][0]
         else:
-            min_func = lambda phase: -fid.ft(phase[0]).integrate(left,right).real
+            min_func = lambda phase: -process(phase[0]).integrate(left,right).real
         
         res = opt.minimize(min_func,[np.pi],**opt_pars) 
-        return fid.ft(res.x[0])
+        instrumentation.add('apk_iterations',getattr(res,'nit',0))
+        instrumentation.add('apk_evaluations',getattr(res,'nfev',0))
+        return res.x[0]
 
 
     def __repr__(self):
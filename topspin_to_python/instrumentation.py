@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# instrumentation.py: Opt-in timing spans and counters of the hot paths
+#
+# Instrumentation is disabled by default, when spans and counters return
+# immediately. Once enabled, the JCAMP parser, raw reads, complex conversion,
+# FFT pipeline, phasing and fitting record named timing spans, bytes read,
+# array allocation sizes and optimizer iteration counts:
+#
+#   import topspin_to_python.instrumentation as instrumentation
+#   instrumentation.enable()
+#   read_dataset(root,executor='process')
+#   print(instrumentation.to_json())
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'enable','disable','is_enabled','reset','span','timed','add','summary','merge','to_json',
+    'imap_collected'
+]
+
+## IMPORTS ####################################################################
+import functools
+import json
+import threading
+import timeit
+
+_enabled = False
+_lock = threading.Lock()
+#{name:[count,total seconds,min seconds,max seconds]}
+_spans = {}
+#{name:total}
+_counters = {}
+
+
+## CLASSES ####################################################################
+class _Span(object):
+    """
+    Context manager timing a named span
+    """
+    __slots__ = ('name','start')
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self,*exc_info):
+        _record_span(self.name,1,timeit.default_timer()-self.start)
+
+
+class _NullSpan(object):
+    """
+    Context manager doing nothing, used while instrumentation is disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+## METHODS ####################################################################
+def enable():
+    """
+    Start recording spans and counters
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Stop recording, keeping what has been recorded
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Forget all recorded spans and counters
+    """
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def span(name):
+    """
+    Context manager timing a named span, e.g. ``with span('fft'):``.
+
+    :param name: Span name
+    :type name: str
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a named span.
+
+    :param name: Span name
+    :type name: str
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args,**kwargs):
+            if not _enabled:
+                return fn(*args,**kwargs)
+            with _Span(name):
+                return fn(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+def add(name,value=1):
+    """
+    Add to a named counter, e.g. bytes read or optimizer iterations.
+
+    :param name: Counter name
+    :type name: str
+    :param value: Amount to add
+    :type value: int,float
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name,0)+value
+
+
+def summary():
+    """
+    Recorded spans and counters.
+
+    :return: {'spans':{name:{'count','total','mean','min','max'}},'counters':{name:total}},
+            times in seconds
+    :rtype: dict
+    """
+    with _lock:
+        spans = dict((name,{'count':count,'total':total,'mean':total/count,'min':low,'max':high})
+                     for name,(count,total,low,high) in _spans.items())
+        return {'spans':spans,'counters':dict(_counters)}
+
+
+def merge(other):
+    """
+    Add a summary recorded elsewhere, e.g. by a worker process, to this one.
+
+    :param other: Summary, see :any:`summary`
+    :type other: dict
+    """
+    for name,s in other.get('spans',{}).items():
+        _record_span(name,s['count'],s['total'],s['min'],s['max'])
+    with _lock:
+        for name,value in other.get('counters',{}).items():
+            _counters[name] = _counters.get(name,0)+value
+
+
+def to_json(fp=None,**dump_pars):
+    """
+    Summary as JSON.
+
+    :param fp: File to write to, by default the JSON text is returned
+    :type fp: str
+    :return: JSON text if fp is not given
+    :rtype: str
+    """
+    dump_pars.setdefault('indent',1)
+    dump_pars.setdefault('sort_keys',True)
+    if fp is None:
+        return json.dumps(summary(),**dump_pars)
+    with open(fp,'w') as f:
+        json.dump(summary(),f,**dump_pars)
+
+
+def imap_collected(pool,fn,items):
+    """
+    ``pool.imap(fn,items)`` over a process pool, merging what each worker call
+    records into this process's summary. Without instrumentation enabled it is
+    a plain ``imap``. Thread pools share this process's summary already and
+    must not be used, as each call resets the recording of its worker.
+
+    :param pool: Process pool
+    :type pool: :class:`multiprocessing.pool.Pool`
+    :param fn: Picklable function of one argument
+    :type fn: callable
+    :param items: Arguments
+    :type items: iterable
+    :return: generator of results in order
+    :rtype: generator
+    """
+    if not _enabled:
+        for result in pool.imap(fn,items):
+            yield result
+        return
+    for result,worker_summary in pool.imap(_call_collected,((fn,item) for item in items)):
+        merge(worker_summary)
+        yield result
+
+
+def _call_collected(args):
+    """
+    Call fn(item) in a worker process, returning its result and what it recorded
+    """
+    fn,item = args
+    reset()
+    enable()
+    result = fn(item)
+    return result,summary()
+
+
+def _record_span(name,count,total,low=None,high=None):
+    low = total if low is None else low
+    high = total if high is None else high
+    with _lock:
+        s = _spans.get(name)
+        if s is None:
+            _spans[name] = [count,total,low,high]
+        else:
+            s[0] += count
+            s[1] += total
+            s[2] = min(s[2],low)
+            s[3] = max(s[3],high)
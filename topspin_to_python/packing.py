@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# packing.py: Lossless compressed archival of raw fid/ser files
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'pack_raw','unpack_raw','read_packed','pack_experiment','unpack_experiment'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import json
+import struct
+import zlib
+from fid import FID, FIDStack, _raw_dtype, _row_size, _interleaved_to_complex
+from acqu_pars import read_acqu_pars
+import instrumentation
+
+#packed files are named after the raw file they replace
+PACKED_SUFFIX = '.packed'
+MAGIC = b'TSPK'
+FORMAT_VERSION = 1
+_FOOTER = struct.Struct('<Q4s')
+
+_FILTERS = ('shuffle','bitshuffle')
+
+
+## METHODS ####################################################################
+def pack_raw(raw_fp,packed_fp,td,bytorda=1,dtypa=0,block_size=1024,codec='zlib',level=6,
+             filter='shuffle',delta=False):
+    """
+    Losslessly compress a raw fid or ser file. Each row is compressed separately,
+    so single rows of a ser can be decoded without decompressing the whole file.
+    Integer data is zigzag encoded (optionally after a delta between successive
+    points) and its bytes (or bits) shuffled so that the mostly zero high bytes of
+    small noise values compress well. The block padding of ser rows is not stored,
+    and is restored as zeros by :any:`unpack_raw`.
+
+    :param raw_fp: Raw fid or ser file
+    :type raw_fp: str
+    :param packed_fp: Packed file to write
+    :type packed_fp: str
+    :param td: Number of raw points per row, acquisition parameter TD
+    :type td: int
+    :param bytorda: Byte order of the raw data, see :any:`fid.read_fid`
+    :type bytorda: int
+    :param dtypa: Data type of the raw data, see :any:`fid.read_fid`
+    :type dtypa: int
+    :param block_size: Row padding of the raw file in bytes, None or 0 for a 1D fid
+    :type block_size: int
+    :param codec: 'zlib' or 'lzma' (smaller, slower)
+    :type codec: str
+    :param level: Compression level of the codec
+    :type level: int
+    :param filter: 'shuffle' to group the bytes of each value, 'bitshuffle' to group their bits
+    :type filter: str
+    :param delta: Whether to store differences between successive points of integer data
+    :type delta: bool
+    :return: Size of the packed file in bytes
+    :rtype: int
+    """
+    if filter not in _FILTERS:
+        raise ValueError('Unknown filter {0}'.format(filter))
+    compress,_ = _codec(codec)
+    raw_dtype = _raw_dtype(bytorda,dtypa)
+    td = int(td)
+    row_size = _row_size(td,raw_dtype,block_size)
+    raw = np.memmap(raw_fp,dtype=raw_dtype,mode='r')
+    n_rows = raw.size//row_size
+    rows = raw[:n_rows*row_size].reshape(n_rows,row_size)[:,:td]
+    delta = bool(delta) and raw_dtype.kind == 'i'
+
+    offsets = []
+    with open(packed_fp,'wb') as f:
+        f.write(MAGIC)
+        for row in rows:
+            offsets.append(f.tell())
+            f.write(compress(_encode(row,filter,delta),level))
+        index = {'version':FORMAT_VERSION,'td':td,'n_rows':n_rows,'bytorda':int(bytorda),
+                 'dtypa':int(dtypa),'block_size':block_size or 0,'codec':codec,'filter':filter,
+                 'delta':delta,'offsets':offsets+[f.tell()],
+                 'trailing':int(raw.size-n_rows*row_size)}
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode('utf-8'))
+        f.write(_FOOTER.pack(index_offset,MAGIC))
+        return f.tell()
+
+
+def unpack_raw(packed_fp,raw_fp):
+    """
+    Restore the raw fid or ser file of a packed file.
+
+    :param packed_fp: Packed file
+    :type packed_fp: str
+    :param raw_fp: Raw file to write
+    :type raw_fp: str
+    """
+    index = _read_index(packed_fp)
+    raw_dtype = _raw_dtype(index['bytorda'],index['dtypa'])
+    row_size = _row_size(index['td'],raw_dtype,index['block_size'])
+    with open(packed_fp,'rb') as f, open(raw_fp,'wb') as out:
+        padded = np.zeros(row_size,dtype=raw_dtype)
+        for i in range(index['n_rows']):
+            padded[:index['td']] = _read_row(f,index,i)
+            out.write(padded.tobytes())
+        out.write(b'\0'*(index['trailing']*raw_dtype.itemsize))
+
+
+def read_packed(fp,rows=None,times=None,sfo=0,dtype=np.complex128,dwell=None):
+    """
+    Read a packed fid or ser file, see :any:`pack_raw`.
+
+    :param fp: Packed file
+    :type fp: str
+    :param rows: Rows to decode, e.g. ``[0,5]`` or ``slice(10,20)``. By default
+                all rows; a packed 1D fid is returned as a :class:`fid.FID`.
+    :type rows: list,slice
+    :param dtype: Complex dtype of the returned fids
+    :type dtype: :class:`numpy.dtype`
+    :param dwell: Time between points in seconds, instead of times
+    :type dwell: float
+    :returns: Fid, or stack of fids with shape (n_rows,td/2)
+    :rtype: :class:`fid.FID`,:class:`fid.FIDStack`
+    """
+    index = _read_index(fp)
+    if rows is None:
+        selected = range(index['n_rows'])
+    else:
+        selected = range(index['n_rows'])[rows] if isinstance(rows,slice) else list(rows)
+    raw = np.empty((len(selected),index['td']),dtype=np.dtype(_raw_dtype(0,index['dtypa'])))
+    with open(fp,'rb') as f:
+        for i,row in enumerate(selected):
+            raw[i] = _read_row(f,index,row)
+    fid = _interleaved_to_complex(raw,dtype)
+    if rows is None and index['block_size'] == 0:
+        return FID(fid[0],times,sfo,copy=False,dwell=dwell)
+    return FIDStack(fid,times,sfo,copy=False,dwell=dwell)
+
+
+def pack_experiment(exp_fp,remove=False,**pack_pars):
+    """
+    Pack the fid or ser file of an experiment folder next to it, as fid.packed
+    or ser.packed, which :any:`experiment_reader.read_experiment` reads when
+    the raw file is absent.
+
+    :param exp_fp: File path to experiment folder
+    :type exp_fp: str
+    :param remove: Whether to remove the raw file once it is packed and verified
+    :type remove: bool
+    :param \**pack_pars: Additional :any:`pack_raw` parameters (codec, level, filter, delta)
+    :return: Packed file
+    :rtype: str
+    """
+    # the layout of the acquisition as run, acqu only holds its setup
+    acqu_fp = os.path.join(exp_fp,'acqus')
+    if not os.path.isfile(acqu_fp):
+        acqu_fp = os.path.join(exp_fp,'acqu')
+    pars = read_acqu_pars(acqu_fp,keys=['td','bytorda','dtypa'])
+    bytorda,dtypa = pars.get('bytorda',1),pars.get('dtypa',0)
+    name = 'fid' if os.path.isfile(os.path.join(exp_fp,'fid')) else 'ser'
+    raw_fp = os.path.join(exp_fp,name)
+    packed_fp = raw_fp+PACKED_SUFFIX
+    if name == 'fid':
+        # a 1D fid is packed whole, as read_fid reads it
+        td,block_size = os.path.getsize(raw_fp)//_raw_dtype(bytorda,dtypa).itemsize,0
+    else:
+        td,block_size = pars['td'],1024
+    pack_raw(raw_fp,packed_fp,td,bytorda,dtypa,block_size,**pack_pars)
+    if remove:
+        tmp_fp = raw_fp+'.unpacked'
+        unpack_raw(packed_fp,tmp_fp)
+        try:
+            if not _same_contents(raw_fp,tmp_fp):
+                raise ValueError('Packed {0} does not restore the raw data'.format(raw_fp))
+        finally:
+            os.remove(tmp_fp)
+        os.remove(raw_fp)
+    return packed_fp
+
+
+def unpack_experiment(exp_fp,remove=False):
+    """
+    Restore the raw fid or ser file of an experiment packed by :any:`pack_experiment`.
+
+    :param exp_fp: File path to experiment folder
+    :type exp_fp: str
+    :param remove: Whether to remove the packed file
+    :type remove: bool
+    :return: Raw file
+    :rtype: str
+    """
+    for name in ('fid','ser'):
+        packed_fp = os.path.join(exp_fp,name+PACKED_SUFFIX)
+        if os.path.isfile(packed_fp):
+            raw_fp = os.path.join(exp_fp,name)
+            unpack_raw(packed_fp,raw_fp)
+            if remove:
+                os.remove(packed_fp)
+            return raw_fp
+    raise IOError('No packed fid or ser in {0}'.format(exp_fp))
+
+
+def _codec(name):
+    """
+    (compress,decompress) functions of a standard library codec
+    """
+    if name == 'zlib':
+        return zlib.compress,zlib.decompress
+    if name == 'lzma':
+        import lzma
+        return (lambda data,level: lzma.compress(data,preset=level)),lzma.decompress
+    raise ValueError('Unknown codec {0}'.format(name))
+
+
+def _encode(row,filter,delta):
+    """
+    Filtered little-endian bytes of one raw row
+    """
+    values = row.astype(row.dtype.newbyteorder('<'))
+    itemsize = values.dtype.itemsize
+    if values.dtype.kind == 'i':
+        if delta:
+            # differences of successive real (and imaginary) points, wrapping on overflow
+            values = np.concatenate([values[:2],values[2:]-values[:-2]])
+        # zigzag, so small negative values have zero high bytes
+        bits = 8*itemsize-1
+        unsigned = ((values << 1) ^ (values >> bits)).view('<u{0}'.format(itemsize))
+    else:
+        unsigned = values.view('<u{0}'.format(itemsize))
+    data = unsigned.view(np.uint8).reshape(-1,itemsize)
+    if filter == 'bitshuffle':
+        return np.packbits(np.unpackbits(data,axis=1).T,axis=1).tobytes()
+    return data.T.tobytes()
+
+
+def _decode(data,n,dtypa,filter,delta):
+    """
+    Native raw values of one row from its filtered bytes
+    """
+    raw_dtype = _raw_dtype(0,dtypa)
+    itemsize = raw_dtype.itemsize
+    data = np.frombuffer(data,dtype=np.uint8)
+    if filter == 'bitshuffle':
+        # each bit plane holds one bit of the n values, padded to whole bytes
+        bits = np.unpackbits(data.reshape(8*itemsize,-1),axis=1)[:,:n]
+        shuffled = np.packbits(bits.T,axis=1)
+    else:
+        shuffled = data.reshape(itemsize,n).T
+    unsigned = np.ascontiguousarray(shuffled).view('<u{0}'.format(itemsize)).reshape(n)
+    if raw_dtype.kind != 'i':
+        return unsigned.view(raw_dtype)
+    values = (unsigned >> 1).view(raw_dtype) ^ -(unsigned & 1).view(raw_dtype)
+    if delta:
+        values = values.reshape(-1,2)
+        values = np.cumsum(values,axis=0,dtype=raw_dtype).reshape(n)
+    return values
+
+
+def _read_row(f,index,i):
+    _,decompress = _codec(index['codec'])
+    start,stop = index['offsets'][i],index['offsets'][i+1]
+    f.seek(start)
+    instrumentation.add('bytes_read',stop-start)
+    return _decode(decompress(f.read(stop-start)),index['td'],index['dtypa'],
+                   index['filter'],index['delta'])
+
+
+def _read_index(fp):
+    with open(fp,'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a packed fid'.format(fp))
+        f.seek(-_FOOTER.size,os.SEEK_END)
+        index_offset,magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        end = f.tell()-_FOOTER.size
+        if magic != MAGIC:
+            raise ValueError('{0} is a truncated packed fid'.format(fp))
+        f.seek(index_offset)
+        index = json.loads(f.read(end-index_offset).decode('utf-8'))
+    if index.get('version') != FORMAT_VERSION:
+        raise ValueError('Unsupported packed fid version {0}'.format(index.get('version')))
+    return index
+
+
+def _same_contents(fp1,fp2,chunk_size=2**20):
+    if os.path.getsize(fp1) != os.path.getsize(fp2):
+        return False
+    with open(fp1,'rb') as f1, open(fp2,'rb') as f2:
+        while True:
+            a,b = f1.read(chunk_size),f2.read(chunk_size)
+            if a != b:
+                return False
+            if not a:
+                return True
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# pdata.py: Memory-mapped reader of TopSpin processed spectra (pdata 1r/1i, 2rr)
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'read_pdata','pdata_axis'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+from fid import FT, _raw_dtype, _read_raw
+from acqu_pars import read_acqu_pars
+import instrumentation
+
+#processing parameters needed to decode and place the points of a dimension
+_PROCS_PARS = ['si','xdim','bytordp','dtypp','nc_proc','offset','sw_p','sf']
+
+
+## METHODS ####################################################################
+@instrumentation.timed('read_pdata')
+def read_pdata(exp_fp,procno=1,imag=True,dtype=np.complex128,mmap=True):
+    """
+    Read a spectrum processed by TopSpin, skipping the decoding and FFT of the
+    raw fid. The 1r and 1i files of a 1D spectrum (or the 2rr file of a 2D
+    spectrum) are memory-mapped with the byte order (BYTORDP) and data type
+    (DTYPP) of its procs file, and scaled by 2**NC_proc in a single pass. The
+    frequency axis is held implicitly, from OFFSET, SW_p and SF.
+
+    Points are returned in ascending frequency, the reverse of TopSpin's
+    storage order, as for spectra transformed by :any:`fid.FID.ft`, and
+    frequencies are in Hz from the 0 ppm reference SF, so that ppm regions
+    select the same points as in TopSpin. The rows of a 2D spectrum are the F1
+    points, also ascending, whose ppm are given by :any:`pdata_axis` of the
+    proc2s file.
+
+    >>> spectrum = read_pdata('data/nmr/sample/1')
+    >>> spectrum.integrate(170,180,ppm=True)
+
+    :param exp_fp: File path to experiment folder
+    :type exp_fp: str
+    :param procno: Processing number, the pdata sub-folder
+    :type procno: int
+    :param imag: Whether to read the imaginary part of a 1D spectrum from 1i,
+                when it exists. Otherwise the spectrum is real.
+    :type imag: bool
+    :param dtype: Complex dtype of the returned spectrum, whose real counterpart
+                is used for real spectra. Float64 data with NC_proc 0 is then
+                returned as a view of the memory map.
+    :type dtype: :class:`numpy.dtype`
+    :param mmap: Whether to memory-map the files rather than reading them into memory
+    :type mmap: bool
+    :returns: Processed spectrum, shape (SI,) or (F1 SI,F2 SI)
+    :rtype: :class:`fid.FT`
+    """
+    proc_fp = os.path.join(exp_fp,'pdata',str(procno))
+    procs = read_acqu_pars(os.path.join(proc_fp,'procs'),keys=_PROCS_PARS)
+    raw_dtype = _raw_dtype(procs.get('bytordp',0),procs.get('dtypp',0))
+    scale = 2.**procs.get('nc_proc',0)
+    si = int(procs['si'])
+
+    rr_fp = os.path.join(proc_fp,'2rr')
+    if os.path.isfile(rr_fp):
+        proc2s = read_acqu_pars(os.path.join(proc_fp,'proc2s'),keys=_PROCS_PARS)
+        shape = (int(proc2s['si']),si)
+        real = _untile(_read_raw(rr_fp,raw_dtype,mmap)[:shape[0]*si],shape,
+                       (int(proc2s.get('xdim') or shape[0]),int(procs.get('xdim') or si)))
+        i_fp = None
+    else:
+        shape = (si,)
+        real = _read_raw(os.path.join(proc_fp,'1r'),raw_dtype,mmap)[:si]
+        i_fp = os.path.join(proc_fp,'1i')
+        if not imag or not os.path.isfile(i_fp):
+            i_fp = None
+
+    if i_fp is None:
+        out_dtype = np.empty(0,dtype=dtype).real.dtype
+        if real.dtype == out_dtype and scale == 1:
+            # a view of the map unless tiles must be reordered
+            spectrum = real.reshape(shape)
+        else:
+            spectrum = np.empty(shape,dtype=out_dtype)
+            np.multiply(real,scale,out=spectrum.reshape(real.shape))
+            instrumentation.add('alloc_bytes',spectrum.nbytes)
+    else:
+        spectrum = np.empty(shape,dtype=dtype)
+        np.multiply(real,scale,out=spectrum.real)
+        np.multiply(_read_raw(i_fp,raw_dtype,mmap)[:si],scale,out=spectrum.imag)
+        instrumentation.add('alloc_bytes',spectrum.nbytes)
+
+    # TopSpin stores points from the highest frequency down
+    spectrum = spectrum[(slice(None,None,-1),)*spectrum.ndim]
+    f0,df = _ascending_axis(procs)
+    return FT(spectrum,sfo=procs['sf']*1E6,f0=f0,df=df)
+
+
+def pdata_axis(procs):
+    """
+    Chemical shifts of the points of one dimension of a processed spectrum,
+    ascending as returned by :any:`read_pdata`.
+
+    :param procs: procs (F2) or proc2s (F1) parameters, as read by
+                :any:`acqu_pars.read_acqu_pars`, or the file to read them from
+    :type procs: dict,str
+    :returns: Chemical shifts in ppm
+    :rtype: :class:`numpy.ndarray`
+    """
+    if not isinstance(procs,dict):
+        procs = read_acqu_pars(procs,keys=_PROCS_PARS)
+    f0,df = _ascending_axis(procs)
+    return (f0+df*np.arange(int(procs['si'])))/procs['sf']
+
+
+def _ascending_axis(procs):
+    """
+    (first frequency,spacing) in Hz from the 0 ppm reference of the ascending points.
+    OFFSET is the ppm of the first stored point, and SW_p spans the SI points.
+    """
+    si = int(procs['si'])
+    df = float(procs['sw_p'])/si
+    return procs['offset']*procs['sf']-df*(si-1),df
+
+
+def _untile(raw,shape,tile):
+    """
+    View of a processed 2D spectrum, which TopSpin stores as tiles of XDIM points
+    per dimension, with axes (F1 tile,F1 point,F2 tile,F2 point) that flatten
+    in row order to shape.
+    """
+    (n1,n2),(x1,x2) = shape,(min(tile[0],shape[0]),min(tile[1],shape[1]))
+    return raw.reshape(n1//x1,n2//x2,x1,x2).transpose(0,2,1,3)
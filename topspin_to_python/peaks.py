@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# peaks.py: Vectorized peak picking over batches of spectra
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'PEAK_DTYPE','pick_peaks','estimate_noise','peak_regions','peak_guesses'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+
+#picked peaks: spectrum row, position in Hz and ppm, signed height and full width at half height in Hz
+PEAK_DTYPE = np.dtype([('spectrum',np.int64),('position',np.float64),('ppm',np.float64),
+                       ('height',np.float64),('width',np.float64)])
+
+
+## METHODS ####################################################################
+def pick_peaks(spectra,freqs=None,sfo=0,snr=5.,threshold=None,noise=None,window=8,real=True):
+    """
+    Find every peak above a noise threshold in one spectrum or a stack of spectra
+    at once. Peaks are maxima of the real part (or magnitude) over window points
+    either side, whose height above the median baseline and prominence over the
+    lowest points of the window both exceed snr times the noise. Positions and heights
+    are refined by a parabola through the maximum and its neighbours, and widths
+    are the full width at half height above the baseline, interpolated between
+    the points either side where the data first falls below it. Heights of magnitude peaks have the sign of the real part, so
+    that inverted peaks have negative heights.
+
+    :param spectra: Spectrum, shape (n,) or (n_spectra,n), or a :class:`fid.FT`
+                whose frequencies and sfo are then used
+    :type spectra: :class:`numpy.ndarray`,:class:`fid.FT`
+    :param freqs: Frequencies in Hz, ascending, by default the point indexes
+    :type freqs: :class:`numpy.ndarray`
+    :param sfo: Spectrometer frequency in Hz, to give positions in ppm
+    :type sfo: float
+    :param snr: Minimum height above the baseline in units of the noise
+    :type snr: float
+    :param threshold: Minimum height above the baseline, instead of snr times the noise.
+                One value, or one per spectrum.
+    :type threshold: float,:class:`numpy.ndarray`
+    :param noise: Noise standard deviation, one value or one per spectrum, by
+                default estimated by :any:`estimate_noise`
+    :type noise: float,:class:`numpy.ndarray`
+    :param window: Number of points either side a peak must be the maximum of
+                and stand out from, so that noise on the tails of large peaks
+                is not picked
+    :type window: int
+    :param real: Whether to pick peaks of the real part (True) or of the magnitude (False)
+    :type real: bool
+    :return: Peaks ordered by spectrum and position, see :any:`PEAK_DTYPE`
+    :rtype: :class:`numpy.ndarray`
+    """
+    if hasattr(spectra,'ft'):
+        freqs,sfo,spectra = spectra.freqs,spectra.sfo,spectra.ft
+    values = np.atleast_2d(spectra)
+    y = values.real if real else np.absolute(values)
+    n_spectra,n = y.shape
+    if freqs is None:
+        freqs = np.arange(n,dtype=float)
+
+    baseline = np.median(y,axis=-1)
+    if threshold is None:
+        if noise is None:
+            noise = estimate_noise(y)
+        threshold = snr*np.asarray(noise,dtype=float)
+    threshold = np.broadcast_to(threshold,(n_spectra,))
+    limit = (baseline+threshold)[:,np.newaxis]
+
+    centre = y[:,1:-1]
+    is_peak = (centre > y[:,:-2]) & (centre >= y[:,2:]) & (centre > limit)
+    rows,index = np.nonzero(is_peak)
+    index += 1
+
+    # only candidates are checked against their neighbourhoods, clipped at the edges
+    window = max(int(window),1)
+    neighbours = y[rows[:,np.newaxis],np.clip(index[:,np.newaxis]+np.arange(-window,window+1),0,n-1)]
+    highest = np.all(neighbours[:,window,np.newaxis] >= neighbours,axis=1)
+    floor = np.maximum(neighbours[:,:window].min(axis=1),neighbours[:,window+1:].min(axis=1))
+    keep = highest & (neighbours[:,window]-floor > threshold[rows])
+    rows,index = rows[keep],index[keep]
+
+    a,b,c = y[rows,index-1],y[rows,index],y[rows,index+1]
+    curvature = a-2*b+c
+    offset = 0.5*(a-c)/curvature
+    height = b-0.25*(a-c)*offset
+    above = height-baseline[rows]
+    step = np.asarray(freqs[index+1]-freqs[index-1],dtype=float)/2
+
+    peaks = np.empty(len(rows),dtype=PEAK_DTYPE)
+    peaks['spectrum'] = rows
+    peaks['position'] = freqs[index]+offset*step
+    peaks['ppm'] = peaks['position']*1E6/sfo if sfo else np.nan
+    peaks['height'] = height
+    if not real and np.iscomplexobj(values):
+        peaks['height'] = np.where(values.real[rows,index] < 0,-height,height)
+    level = baseline[rows]+above/2
+    peaks['width'] = np.abs(_half_height_crossing(y,freqs,rows,index,level,1)-
+                            _half_height_crossing(y,freqs,rows,index,level,-1))
+    return peaks
+
+
+def _half_height_crossing(y,freqs,rows,index,level,direction):
+    """
+    Frequency where each peak first falls below level, walking from its maximum
+    in direction (1 or -1), linearly interpolated between the points either
+    side, or the edge of the spectrum if it never does.
+    """
+    edge = y.shape[1]-1 if direction > 0 else 0
+    outside = index.copy()
+    # all peaks step outwards together, so the loop runs over the widest half width
+    active = outside != edge
+    while active.any():
+        outside[active] += direction
+        active[active] = (outside[active] != edge) & (y[rows[active],outside[active]] > level[active])
+    inside = outside-direction
+    y_in,y_out = y[rows,inside],y[rows,outside]
+    drop = y_in-y_out
+    frac = np.where(drop > 0,np.clip((y_in-level)/np.where(drop > 0,drop,1.),0,1),1.)
+    return freqs[inside]+frac*(freqs[outside]-freqs[inside])
+
+
+def estimate_noise(spectra,real=True):
+    """
+    Robust noise standard deviation of each spectrum, from the median absolute
+    difference of successive points, which is insensitive to peaks and
+    slowly varying baselines.
+
+    :param spectra: Spectrum, shape (n,) or (n_spectra,n)
+    :type spectra: :class:`numpy.ndarray`
+    :param real: Whether to use the real part (True) or magnitude (False)
+    :type real: bool
+    :return: Noise of each spectrum, shape (n_spectra,)
+    :rtype: :class:`numpy.ndarray`
+    """
+    y = np.atleast_2d(spectra)
+    if np.iscomplexobj(y):
+        y = y.real if real else np.absolute(y)
+    diff = np.diff(y,axis=-1)
+    # the difference of two independent gaussian points has sqrt(2) times their deviation
+    return 1.4826*np.median(np.abs(diff-np.median(diff,axis=-1)[:,np.newaxis]),axis=-1)/np.sqrt(2)
+
+
+def peak_regions(peaks,scale=2.):
+    """
+    Integration or fitting bounds around each peak, position plus or minus
+    scale times the peak width, for :any:`fid.FT.integrate_peaks`,
+    :any:`fid.FT.integrate_regions` or :any:`fid.FT.fit_lorentzians`.
+
+    :param peaks: Peaks, see :any:`pick_peaks`
+    :type peaks: :class:`numpy.ndarray`
+    :param scale: Half width of the regions in peak widths
+    :type scale: float
+    :return: left,right bounds of each peak in Hz
+    :rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`
+    """
+    half = scale*peaks['width']
+    return peaks['position']-half,peaks['position']+half
+
+
+def peak_guesses(peaks):
+    """
+    Initial lorentzian parameters of each peak, the p0 of
+    :any:`data_analysis_fns.fit_lorentzians`. Amplitudes have the sign of the
+    peak heights, negative for inverted peaks, with zero phase.
+
+    :param peaks: Peaks, see :any:`pick_peaks`
+    :type peaks: :class:`numpy.ndarray`
+    :return: (Amplitude,phase,width,location) of each peak, shape (n_peaks,4)
+    :rtype: :class:`numpy.ndarray`
+    """
+    p0 = np.zeros((len(peaks),4))
+    # a lorentzian's height is 2A/(pi*w)
+    p0[:,0] = peaks['height']*np.pi*peaks['width']/2
+    p0[:,2] = peaks['width']
+    p0[:,3] = peaks['position']
+    return p0
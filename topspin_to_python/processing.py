@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# processing.py: Fused fid processing pipeline (apodize, zero-fill, phase, FFT)
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'Pipeline','group_delay'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import instrumentation
+
+#cached window vectors and frequency axes are dropped past this many entries
+_MAX_CACHE = 64
+_vector_cache = {}
+_freq_cache = {}
+
+#group delay in points of the digital filters of firmware versions (DSPFVS) 10 to 13
+#by decimation factor (DECIM). Later firmware records the delay as GRPDLY.
+_DSP_GROUP_DELAYS = {
+    10:{2:44.75,3:33.5,4:66.625,6:59.083333333333333,8:68.5625,12:60.375,16:69.53125,
+        24:61.020833333333333,32:70.015625,48:61.34375,64:70.2578125,96:61.505208333333333,
+        128:70.37890625,192:61.5859375,256:70.439453125,384:61.626302083333333,
+        512:70.4697265625,768:61.646484375,1024:70.48486328125,1536:61.656575520833333,
+        2048:70.492431640625},
+    11:{2:46.,3:36.5,4:48.,6:50.166666666666667,8:53.25,12:69.5,16:72.25,
+        24:70.166666666666667,32:72.75,48:70.5,64:73.,96:70.666666666666667,128:72.5,
+        192:71.333333333333333,256:72.25,384:71.666666666666667,512:72.125,
+        768:71.833333333333333,1024:72.0625,1536:71.916666666666667,2048:72.03125},
+    12:{2:46.,3:36.5,4:48.,6:50.166666666666667,8:53.25,12:69.5,16:71.625,
+        24:70.166666666666667,32:72.125,48:70.5,64:72.375,96:70.666666666666667,128:72.5,
+        192:71.333333333333333,256:72.25,384:71.666666666666667,512:72.125,
+        768:71.833333333333333,1024:72.0625,1536:71.916666666666667,2048:72.03125},
+    13:{2:2.75,3:2.8333333333333333,4:2.875,6:2.9166666666666667,8:2.9375,
+        12:2.9583333333333333,16:2.96875,24:2.9791666666666667,32:2.984375,
+        48:2.9895833333333333,64:2.9921875,96:2.9947916666666667}
+}
+
+
+## CLASSES ####################################################################
+class Pipeline(object):
+    """
+    Processing of fids into spectra: apodization, zero-filling, zero-order phase
+    and Fourier transform. Pipelines are immutable; :any:`apodize`, :any:`zero_fill`
+    and :any:`phased` return new pipelines, so one pipeline can be built once and
+    applied unchanged to a single fid or a stack of fids.
+
+    The steps are fused: the window, phase and the alternating sign that stands
+    in for ``fftshift`` are combined into one vector per (size,dwell), cached,
+    and multiplied into a single zero-filled buffer that the FFT then transforms.
+
+    :param window: Window name ('exponential','gaussian','sine') or a function of
+                the acquisition times, None for no apodization
+    :type window: str,callable
+    :param window_pars: Window parameters, see :any:`apodize`
+    :type window_pars: dict
+    :param size: Number of points to zero-fill (or truncate) the fid to, None to keep its size
+    :type size: int
+    :param phase: Zero-order phase, or one phase per row for stacked fids
+    :type phase: float,:class:`numpy.ndarray`
+    :param workers: Number of FFT threads. If given, the FFT uses scipy.fft
+                when it is available.
+    :type workers: int
+    """
+
+    def __init__(self,window=None,window_pars=None,size=None,phase=0,workers=None):
+        self._window = window
+        self._window_pars = tuple(sorted((window_pars or {}).items()))
+        self._size = size
+        self._phase = phase
+        self._workers = workers
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def window_pars(self):
+        return dict(self._window_pars)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def _replace(self,**pars):
+        kwargs = {'window':self.window,'window_pars':self.window_pars,'size':self.size,
+                  'phase':self.phase,'workers':self.workers}
+        kwargs.update(pars)
+        return Pipeline(**kwargs)
+
+    def apodize(self,window,**window_pars):
+        """
+        Pipeline with an apodization window.
+
+        :param window: 'exponential' (parameter lb, line broadening in Hz),
+                    'gaussian' (gb, gaussian broadening in Hz), 'sine' (ssb,
+                    sine bell shift as in TopSpin) or a function of the
+                    acquisition times returning the window
+        :type window: str,callable
+        :return: New pipeline
+        :rtype: :class:`Pipeline`
+        """
+        if not callable(window) and window not in _WINDOWS:
+            raise ValueError('Unknown window {0}'.format(window))
+        return self._replace(window=window,window_pars=window_pars)
+
+    def zero_fill(self,size):
+        """
+        Pipeline zero-filling fids to size points.
+
+        :param size: Number of points, None to keep the fid size
+        :type size: int
+        :return: New pipeline
+        :rtype: :class:`Pipeline`
+        """
+        return self._replace(size=size)
+
+    def phased(self,phase):
+        """
+        Pipeline applying a zero-order phase.
+
+        :param phase: Zero-order phase, or one phase per row for stacked fids
+        :type phase: float,:class:`numpy.ndarray`
+        :return: New pipeline
+        :rtype: :class:`Pipeline`
+        """
+        return self._replace(phase=phase)
+
+    def threaded(self,workers):
+        """
+        Pipeline using workers threads for the FFT.
+
+        :param workers: Number of threads, None for numpy's single threaded FFT
+        :type workers: int
+        :return: New pipeline
+        :rtype: :class:`Pipeline`
+        """
+        return self._replace(workers=workers)
+
+    @instrumentation.timed('fft')
+    def transform(self,fid,dwell):
+        """
+        Process fid data along its last axis.
+
+        :param fid: Complex fid(s), shape (...,n)
+        :type fid: :class:`numpy.ndarray`
+        :param dwell: Time between points in seconds
+        :type dwell: float
+        :return: Spectra shape (...,size), centered frequencies in Hz
+        :rtype: :class:`numpy.ndarray`,:class:`numpy.ndarray`
+        """
+        n_out = fid.shape[-1] if self.size is None else int(self.size)
+        n = min(fid.shape[-1],n_out)
+        dtype = np.result_type(fid.dtype,np.complex64)
+
+        vector = self._vector(n,n_out,dwell,dtype)
+        phase = np.asarray(self.phase,dtype=float)
+        if phase.ndim == 0 and phase != 0:
+            vector = vector*np.exp(1j*phase).astype(dtype)
+
+        buf = np.zeros(fid.shape[:-1]+(n_out,),dtype=dtype)
+        instrumentation.add('alloc_bytes',buf.nbytes)
+        np.multiply(fid[...,:n],vector,out=buf[...,:n])
+        if phase.ndim > 0:
+            buf[...,:n] *= np.exp(1j*phase).astype(dtype)[...,np.newaxis]
+
+        spectrum = self._fft(buf)
+        if n_out%2:
+            spectrum = np.fft.fftshift(spectrum,axes=-1)
+        return spectrum,freq_axis(n_out,dwell)
+
+    def _vector(self,n,n_out,dwell,dtype):
+        """
+        Cached window times the (-1)^k modulation that centers the spectrum
+        of an even sized transform.
+        """
+        key = (self.window,self._window_pars,n,n_out,float(dwell),np.dtype(dtype).str)
+        vector = _vector_cache.get(key)
+        if vector is None:
+            if self.window is None:
+                vector = np.ones(n,dtype=dtype)
+            else:
+                t = np.arange(n)*float(dwell)
+                window = self.window if callable(self.window) else _WINDOWS[self.window]
+                vector = np.asarray(window(t,**self.window_pars)).astype(dtype)
+            if n_out%2 == 0:
+                vector[1::2] *= -1
+            vector.flags.writeable = False
+            _cache_put(_vector_cache,key,vector)
+        return vector
+
+    def _fft(self,buf):
+        if self.workers is not None:
+            try:
+                import scipy.fft
+            except ImportError:
+                pass
+            else:
+                return scipy.fft.fft(buf,axis=-1,overwrite_x=True,workers=self.workers)
+        return np.fft.fft(buf,axis=-1)
+
+    def __repr__(self):
+        return 'Pipeline(window={0!r},window_pars={1!r},size={2!r},phase={3!r},workers={4!r})'.format(
+            self.window,self.window_pars,self.size,self.phase,self.workers)
+
+
+## METHODS ####################################################################
+def freq_axis(n,dwell):
+    """
+    Cached, read-only centered frequency axis of an n point transform.
+
+    :param n: Number of points
+    :type n: int
+    :param dwell: Time between points in seconds
+    :type dwell: float
+    :return: Frequencies in Hz
+    :rtype: :class:`numpy.ndarray`
+    """
+    key = (n,float(dwell))
+    freqs = _freq_cache.get(key)
+    if freqs is None:
+        freqs = np.fft.fftshift(np.fft.fftfreq(n,d=dwell))
+        freqs.flags.writeable = False
+        _cache_put(_freq_cache,key,freqs)
+    return freqs
+
+
+def group_delay(grpdly=-1,dspfvs=None,decim=None):
+    """
+    Group delay in points of the Bruker digital filter, the number of points
+    the signal is delayed by at the start of a digitally filtered fid. It is
+    removed by :any:`fid.FT.remove_group_delay` as a first order phase.
+
+    :param grpdly: Acquisition parameter GRPDLY, used when positive
+    :type grpdly: float
+    :param dspfvs: Acquisition parameter DSPFVS, the digital filter firmware version
+    :type dspfvs: int
+    :param decim: Acquisition parameter DECIM, the decimation factor
+    :type decim: float
+    :return: Group delay in points, 0 for analog filtered fids
+    :rtype: float
+    """
+    if grpdly is not None and grpdly > 0:
+        return float(grpdly)
+    if dspfvs is None or decim is None:
+        return 0.
+    delays = _DSP_GROUP_DELAYS.get(int(dspfvs),{})
+    return float(delays.get(int(decim),0.))
+
+
+def _cache_put(cache,key,value):
+    if len(cache) >= _MAX_CACHE:
+        cache.clear()
+    cache[key] = value
+
+
+def _exponential(t,lb=0.):
+    return np.exp(-np.pi*lb*t)
+
+
+def _gaussian(t,gb=0.):
+    return np.exp(-(np.pi*gb*t)**2/(4*np.log(2)))
+
+
+def _sine(t,ssb=0.):
+    # TopSpin SSB: 0 or 1 pure sine, 2 cosine, larger values shift towards a sine
+    shift = np.pi/ssb if ssb > 1 else 0.
+    if len(t) < 2:
+        return np.ones(len(t))
+    return np.sin(shift+(np.pi-shift)*t/t[-1])
+
+
+_WINDOWS = {'exponential':_exponential,'gaussian':_gaussian,'sine':_sine}
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# reductions.py: Out-of-core sums, means and variances over many fids and ser rows
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'reduce_fids','coadd_fids'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from fid import FID, _raw_dtype, _row_size, _interleaved_to_complex
+from acqu_pars import read_acqu_pars
+from packing import read_packed, PACKED_SUFFIX, _read_index
+import instrumentation
+
+#acquisition parameters needed to lay out and scale the raw rows
+_SOURCE_PARS = (['td','sw_h','bytorda','dtypa','recchan']+
+                ['sfo{0}'.format(i) for i in range(1,9)])
+
+
+## METHODS ####################################################################
+@instrumentation.timed('reduce_fids')
+def reduce_fids(exp_fps,weights=None,align=False,reference=None,rows=None,block_rows=16,
+                workers=1,executor='thread',dtype=np.complex128,block_size=1024):
+    """
+    Sum, mean and variance of the fids of many experiments and the rows of
+    their ser files, in a single pass without loading them. Raw data is
+    streamed block_rows rows at a time into a preallocated buffer and folded
+    into running weighted means and sums of squared deviations, so peak memory
+    is a few rows per worker whatever the number of fids. Workers reduce
+    contiguous parts of the rows and their partial results are merged exactly.
+
+    >>> result = reduce_fids(['exp/1','exp/2','exp/3'],align=True)
+    >>> result['sum'].ft().integrate()
+
+    :param exp_fps: File paths to experiment folders, holding a fid, ser or
+                packed file. All rows must have the same number of points.
+    :type exp_fps: list
+    :param weights: Weight of each experiment, applied to all its rows, or a
+                list with one array of row weights per experiment. By default 1.
+    :type weights: list
+    :param align: Whether to phase each row to the reference before adding it,
+                removing zero order phase drifts between scans or experiments
+    :type align: bool
+    :param reference: Complex fid rows are aligned to, by default the first row
+    :type reference: :class:`numpy.ndarray`,:class:`fid.FID`
+    :param rows: Rows of each ser to reduce, e.g. ``slice(0,None,2)`` or ``[0,3,4]``,
+                by default all
+    :type rows: slice,list
+    :param block_rows: Number of rows read and reduced at a time
+    :type block_rows: int
+    :param workers: Number of parallel workers, None for the number of CPUs
+    :type workers: int
+    :param executor: 'thread' or 'process' workers
+    :type executor: str
+    :param dtype: Complex dtype rows are decoded to and reduced in
+    :type dtype: :class:`numpy.dtype`
+    :param block_size: Row padding of ser files in bytes
+    :type block_size: int
+    :return: dictionary with the number of rows 'count', the total 'weight',
+            the weighted 'sum' and 'mean' fids, the 'variance' of the rows about
+            their mean per point and, if aligned, the 'phases' in radians
+            applied to each row in order
+    :rtype: dict
+    """
+    if executor not in ('thread','process'):
+        raise ValueError('Unknown executor {0}'.format(executor))
+    sources = [_source(exp_fp,block_size) for exp_fp in exp_fps]
+    if not sources:
+        raise ValueError('No experiments to reduce')
+    n_points = sources[0]['td']//2
+    for source in sources:
+        if source['td']//2 != n_points:
+            raise ValueError('{0} has {1} points, not {2}'.format(
+                source['fp'],source['td']//2,n_points))
+
+    tasks = []
+    for i,source in enumerate(sources):
+        selected = np.arange(source['n_rows'])
+        if rows is not None and source['is_ser']:
+            selected = selected[rows]
+        row_weights = _row_weights(weights,i,len(selected))
+        block_rows = max(int(block_rows),1)
+        for start in range(0,len(selected),block_rows):
+            tasks.append((source,selected[start:start+block_rows],
+                          row_weights[start:start+block_rows]))
+    if not tasks:
+        raise ValueError('No rows to reduce')
+
+    if align and reference is None:
+        source,selected,_ = tasks[0]
+        reference = _read_rows(source,selected[:1],dtype)[0]
+    if reference is not None:
+        reference = np.asarray(getattr(reference,'fid',reference),dtype=dtype)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(min(int(workers),len(tasks)),1)
+    # contiguous parts keep each worker's reads sequential and the phases in order
+    bounds = np.linspace(0,len(tasks),workers+1).astype(int)
+    parts = [(tasks[lo:hi],reference if align else None,n_points,dtype)
+             for lo,hi in zip(bounds[:-1],bounds[1:])]
+    if workers == 1:
+        partials = [_reduce_part(parts[0])]
+    elif executor == 'thread':
+        pool = ThreadPool(workers)
+        try:
+            partials = pool.map(_reduce_part,parts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            partials = list(instrumentation.imap_collected(pool,_reduce_part,parts))
+        finally:
+            pool.close()
+            pool.join()
+
+    count,weight,mean,m2,phases = partials[0]
+    for partial in partials[1:]:
+        count,weight,mean,m2 = _merge((count,weight,mean,m2),partial[:4])
+        phases = phases+partial[4]
+    if weight == 0:
+        raise ValueError('Weights of the reduced rows sum to zero')
+
+    first = sources[0]
+    result = {'count':count,'weight':weight,
+              'sum':FID(mean*weight,sfo=first['sfo'],copy=False,dwell=first['dwell']),
+              'mean':FID(mean,sfo=first['sfo'],copy=False,dwell=first['dwell']),
+              'variance':m2/weight}
+    if align:
+        result['phases'] = np.array(phases)
+    return result
+
+
+def coadd_fids(exp_fps,weights=None,align=False,reference=None,normalize=False,**reduce_pars):
+    """
+    Add the fids of many experiments and the rows of their ser files into one
+    fid, streaming them as :any:`reduce_fids` does.
+
+    :param exp_fps: File paths to experiment folders
+    :type exp_fps: list
+    :param weights: Weight of each experiment or arrays of row weights, see :any:`reduce_fids`
+    :type weights: list
+    :param align: Whether to phase each row to the reference before adding it
+    :type align: bool
+    :param reference: Complex fid rows are aligned to, by default the first row
+    :type reference: :class:`numpy.ndarray`,:class:`fid.FID`
+    :param normalize: Whether to divide by the total weight, giving the weighted mean
+    :type normalize: bool
+    :param \**reduce_pars: Additional :any:`reduce_fids` parameters
+    :return: Co-added fid
+    :rtype: :class:`fid.FID`
+    """
+    result = reduce_fids(exp_fps,weights=weights,align=align,reference=reference,**reduce_pars)
+    return result['mean'] if normalize else result['sum']
+
+
+def _source(exp_fp,block_size=1024):
+    """
+    Raw file and row layout of an experiment
+    """
+    acqu_fp = os.path.join(exp_fp,'acqus')
+    if not os.path.isfile(acqu_fp):
+        acqu_fp = os.path.join(exp_fp,'acqu')
+    pars = read_acqu_pars(acqu_fp,keys=_SOURCE_PARS)
+    td = int(pars['td'])
+    raw_dtype = _raw_dtype(pars.get('bytorda',1),pars.get('dtypa',0))
+    aq = float(td)/pars['sw_h']/2
+    source = {'fp':None,'packed':False,'is_ser':True,'td':td,'raw_dtype':raw_dtype,
+              'sfo':pars['sfo{0}'.format(np.nonzero(pars['recchan'])[0][0])]*1E6,
+              'dwell':aq/(td//2-1) if td//2 > 1 else aq}
+    for name in ('fid','ser'):
+        fp = os.path.join(exp_fp,name)
+        if os.path.isfile(fp):
+            source['fp'] = fp
+            source['is_ser'] = name == 'ser'
+            if name == 'fid':
+                # a 1D fid is read whole, as read_fid reads it
+                source['td'] = os.path.getsize(fp)//raw_dtype.itemsize
+                source['row_size'] = source['td']
+            else:
+                source['row_size'] = _row_size(td,raw_dtype,block_size)
+            source['n_rows'] = os.path.getsize(fp)//(source['row_size']*raw_dtype.itemsize)
+            return source
+        if os.path.isfile(fp+PACKED_SUFFIX):
+            source.update(fp=fp+PACKED_SUFFIX,packed=True,is_ser=name == 'ser')
+            index = _read_index(source['fp'])
+            source['td'],source['n_rows'] = index['td'],index['n_rows']
+            return source
+    raise IOError('No fid or ser in {0}'.format(exp_fp))
+
+
+def _row_weights(weights,i,n):
+    if weights is None:
+        return np.ones(n)
+    w = np.asarray(weights[i],dtype=float)
+    if w.ndim == 0:
+        return np.full(n,float(w))
+    if len(w) != n:
+        raise ValueError('{0} row weights for {1} rows'.format(len(w),n))
+    return w
+
+
+def _read_rows(source,selected,dtype,out=None):
+    """
+    Complex rows of a source, decoded into out if given. selected is an array
+    of row numbers, read as a view of the raw file when evenly spaced.
+    """
+    selected = _as_slice(selected)
+    if source['packed']:
+        rows = read_packed(source['fp'],rows=selected,dtype=dtype).fid
+        if out is None:
+            return rows
+        out = out[:len(rows)]
+        out[...] = rows
+        return out
+    raw = np.memmap(source['fp'],dtype=source['raw_dtype'],mode='r')
+    n_rows,row_size,td = source['n_rows'],source['row_size'],source['td']
+    raw = raw[:n_rows*row_size].reshape(n_rows,row_size)
+    block = raw[selected,:td]
+    instrumentation.add('bytes_read',block.nbytes)
+    if out is None:
+        return _interleaved_to_complex(block,dtype)
+    out = out[:len(block)]
+    out.real = block[:,0::2]
+    out.imag = block[:,1::2]
+    return out
+
+
+def _as_slice(selected):
+    """
+    Slice of evenly increasing row numbers, or the row numbers as a list
+    """
+    selected = np.asarray(selected,dtype=int)
+    if len(selected) == 0:
+        return slice(0,0)
+    step = selected[1]-selected[0] if len(selected) > 1 else 1
+    if step > 0 and np.all(np.diff(selected) == step):
+        return slice(int(selected[0]),int(selected[-1])+1,int(step))
+    return selected.tolist()
+
+
+def _reduce_part(args):
+    """
+    (count,weight,mean,sum of squared deviations,phases) of a list of row blocks
+    """
+    tasks,reference,n_points,dtype = args
+    buffer = np.empty((max(len(selected) for _,selected,_ in tasks),n_points),dtype=dtype)
+    count,weight = 0,0.
+    mean = np.zeros(n_points,dtype=dtype)
+    m2 = np.zeros(n_points)
+    phases = []
+    for source,selected,w in tasks:
+        block = _read_rows(source,selected,dtype,buffer)
+        if reference is not None:
+            # the phase maximizing the real overlap of each row with the reference
+            phase = -np.angle(block.dot(np.conj(reference)))
+            block *= np.exp(1j*phase).astype(dtype)[:,np.newaxis]
+            phases.extend(phase)
+        block_weight = w.sum()
+        if block_weight == 0:
+            count += len(block)
+            continue
+        block_mean = w.dot(block)/block_weight
+        deviation = block-block_mean
+        block_m2 = w.dot(deviation.real**2+deviation.imag**2)
+        count,weight,mean,m2 = _merge((count,weight,mean,m2),
+                                      (len(block),block_weight,block_mean,block_m2))
+    return count,weight,mean,m2,phases
+
+
+def _merge(a,b):
+    """
+    Combined (count,weight,mean,sum of squared deviations) of two partial reductions
+    """
+    count_a,weight_a,mean_a,m2_a = a
+    count_b,weight_b,mean_b,m2_b = b
+    weight = weight_a+weight_b
+    if weight_a == 0 or weight_b == 0:
+        mean,m2 = (mean_b,m2_b) if weight_a == 0 else (mean_a,m2_a)
+        return count_a+count_b,weight,mean,m2
+    delta = mean_b-mean_a
+    mean = mean_a+delta*(weight_b/weight)
+    m2 = m2_a+m2_b+(delta.real**2+delta.imag**2)*(weight_a*weight_b/weight)
+    return count_a+count_b,weight,mean,m2
@@ -0,0 +1,14 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# conftest.py: Make the package modules importable by the tests
+#
+# The package modules import each other by their plain names, so the tests
+# import them the same way from the package folder.
+
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_DIR not in sys.path:
+    sys.path.insert(0,PACKAGE_DIR)
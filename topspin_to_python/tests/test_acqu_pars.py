@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_acqu_pars.py: Tests of the acquisition parameter parser and schema
+
+import io
+import os
+
+import numpy as np
+
+from acqu_pars import read_acqu_pars, format_acqu_pars, AcquSchema
+
+ACQUS = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment','acqus')
+
+
+def test_read_sample_parameters():
+    acqu = read_acqu_pars(ACQUS)
+    assert acqu['td'] == 65536 and isinstance(acqu['td'],int)
+    assert acqu['sfo1'] == 174.1060199
+    assert acqu['nuc1'] == '31P'
+    assert acqu['cpdprg'] == ''
+    # the $$ comment after the value is dropped
+    assert acqu['npoints'] == 9
+    # (0..63) array continued over two lines
+    assert acqu['d'].shape == (64,)
+    assert np.array_equal(acqu['d'][:7],[0,500,0.5,0,0,0.01,1])
+    assert not any(k.startswith('$') or k != k.lower() for k in acqu)
+
+
+def test_read_only_requested_keys():
+    acqu = read_acqu_pars(ACQUS,keys=['TD','$SFO1','sw_h'])
+    assert acqu == {'td':65536,'sfo1':174.1060199,'sw_h':1000000}
+
+
+def test_read_string_array_from_file_object():
+    text = u'##$SPNAM= (0..2)\n<a> <>\n<b c>\n$$ comment\n##$P= (0..1)\n1 2.5\n##END=\n'
+    acqu = read_acqu_pars(io.StringIO(text))
+    assert acqu['spnam'] == ['a','','b c']
+    assert acqu['p'].dtype == float and np.array_equal(acqu['p'],[1.,2.5])
+
+
+def test_schema_groups_sample_families():
+    acqu = AcquSchema().apply(read_acqu_pars(ACQUS))
+    # sfo1..sfo8 indexed by their number, with nothing at index 0
+    assert acqu['sfo'].shape == (9,)
+    assert np.isnan(acqu['sfo'][0])
+    assert np.array_equal(acqu['sfo'][1:3],[174.1060199,115.3123354])
+    assert list(acqu['nuc'][:4]) == ['','31P','31P','off']
+    assert 'sfo1' not in acqu and 'bytorda' not in acqu and 'td' in acqu
+
+
+def test_schema_header_and_mixed_families():
+    acqu = {'o':5.,'o2':1.,'fq1':'a','fq3':2,'ns':8,'aunm':'au_zg'}
+    formatted = AcquSchema(prune_pars=['aunm'],reform_pars=['o','fq']).apply(acqu)
+    assert np.array_equal(formatted['o'],[5.,np.nan,1.],equal_nan=True)
+    assert formatted['fq'] == {1:'a',3:2}
+    assert formatted['ns'] == 8 and 'aunm' not in formatted
+    # formatting alone keeps every parameter
+    assert 'aunm' in format_acqu_pars(acqu)
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_cache.py: Tests of the on-disk cache of parsed experiments
+
+import os
+import time
+
+import numpy as np
+
+from fid import FID
+from cache import ExperimentCache
+
+
+def _experiment():
+    return {'acqu':{'ns':8},'fid':FID(np.arange(64)+1j,sfo=400E6,dwell=2E-4,t0=1E-3)}
+
+
+def test_hit_restores_time_axis(tmpdir):
+    cache = ExperimentCache(str(tmpdir.join('cache')))
+    exp_fp = str(tmpdir.mkdir('1'))
+    cache.put(exp_fp,_experiment())
+    hit = cache.get(exp_fp)
+    assert (hit['fid'].t0,hit['fid'].dwell,hit['fid'].sfo) == (1E-3,2E-4,400E6)
+    assert np.array_equal(hit['fid'].fid,_experiment()['fid'].fid)
+    for entry in os.listdir(cache.cache_dir):
+        assert sorted(os.listdir(os.path.join(cache.cache_dir,entry))) == ['fid.npy','meta.pkl']
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = ExperimentCache(str(tmpdir.join('cache')))
+    first,second = str(tmpdir.mkdir('1')),str(tmpdir.mkdir('2'))
+    cache.put(first,_experiment())
+    cache.put(second,_experiment())
+    # first was stored before second, but is used after it
+    for exp_fp,age in ((first,20),(second,10)):
+        meta_fp = os.path.join(cache._entry_dir(exp_fp,{}),'meta.pkl')
+        os.utime(meta_fp,(time.time()-age,time.time()-age))
+    assert cache.get(first) is not None
+
+    cache.evict(cache.size()//2)
+    assert cache.get(first) is not None
+    assert cache.get(second) is None
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_catalog.py: Tests of the SQLite catalog of experiments
+
+import os
+import shutil
+
+from catalog import ExperimentCatalog
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+def test_update_leaves_roots_differing_in_case(tmpdir):
+    roots = [str(tmpdir.join(name)) for name in ('Run1','run1','Run1_b')]
+    for root in roots:
+        shutil.copytree(EXAMPLE,os.path.join(root,'1'))
+    catalog = ExperimentCatalog(str(tmpdir.join('experiments.db')))
+    for root in roots:
+        assert catalog.update(root) == (1,0)
+
+    shutil.rmtree(os.path.join(roots[0],'1'))
+    assert catalog.update(roots[0]) == (0,1)
+    assert catalog.query() == sorted(os.path.join(root,'1') for root in roots[1:])
+
+
+def test_update_records_acquired_parameters(tmpdir):
+    shutil.copytree(EXAMPLE,str(tmpdir.join('data','1')))
+    catalog = ExperimentCatalog(str(tmpdir.join('experiments.db')))
+    catalog.update(str(tmpdir.join('data')))
+    # acqu holds the setup values DATE 0, BYTORDA 0 and DSPFVS 0
+    assert catalog.query(date=1462242120,bytorda=1,dspfvs=10) == [str(tmpdir.join('data','1'))]
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_columnar.py: Tests of the columnar export of experiments
+
+import numpy as np
+import pytest
+
+from fid import FID
+from columnar import ColumnarWriter, ColumnarReader
+
+
+def _experiment(n_points,ns=1):
+    fid = FID(np.arange(n_points)+1j,sfo=400E6,dwell=1E-4)
+    return {'fid':fid,'acqu':{'ns':ns,'pulprog':'zg'}}
+
+
+def test_rejected_chunk_leaves_dataset_intact(tmpdir):
+    out_dir = str(tmpdir.join('dataset'))
+    writer = ColumnarWriter(out_dir,chunk_size=1)
+    writer.append(_experiment(8),'exp/1')
+    with pytest.raises(ValueError):
+        writer.append(_experiment(16),'exp/2')
+    writer.append(_experiment(8,ns=4),'exp/3')
+    writer.close()
+
+    reader = ColumnarReader(out_dir)
+    assert len(reader) == 2
+    assert list(reader['path']) == ['exp/1','exp/3']
+    assert list(reader['ns']) == [1,4]
+    assert reader.data.shape == (2,8)
+
+
+def test_rejected_experiment_keeps_buffered_rows(tmpdir):
+    out_dir = str(tmpdir.join('dataset'))
+    writer = ColumnarWriter(out_dir,chunk_size=2)
+    writer.append(_experiment(8),'exp/1')
+    writer.append(_experiment(8),'exp/2')
+    writer.append(_experiment(8),'exp/3')
+    bad = _experiment(8)
+    del bad['acqu']['ns']
+    with pytest.raises(ValueError):
+        writer.append(bad,'exp/4')
+    writer.append(_experiment(8),'exp/5')
+    writer.close()
+
+    reader = ColumnarReader(out_dir)
+    assert list(reader['path']) == ['exp/1','exp/2','exp/3','exp/5']
+    assert reader.data.shape == (4,8)
+
+
+def test_rejected_width_in_first_chunk(tmpdir):
+    out_dir = str(tmpdir.join('dataset'))
+    writer = ColumnarWriter(out_dir,chunk_size=4)
+    writer.append(_experiment(8),'exp/1')
+    with pytest.raises(ValueError):
+        writer.append(_experiment(16),'exp/2')
+    writer.append(_experiment(8),'exp/3')
+    writer.close()
+
+    reader = ColumnarReader(out_dir)
+    assert list(reader['path']) == ['exp/1','exp/3']
+    assert reader.data.shape == (2,8)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_convert.py: Tests of the topspin-convert batch conversion
+
+import os
+import shutil
+import time
+
+import numpy as np
+
+from convert import convert
+from columnar import ColumnarReader
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+def _experiments(root,expnos):
+    paths = []
+    for expno in expnos:
+        exp_fp = os.path.join(root,'sample',str(expno))
+        if not os.path.isdir(exp_fp):
+            shutil.copytree(EXAMPLE,exp_fp)
+        paths.append(exp_fp)
+    return paths
+
+
+def _touch(exp_fp):
+    later = time.time()+10
+    os.utime(os.path.join(exp_fp,'fid'),(later,later))
+
+
+def _counts(stats):
+    return stats['converted'],stats['skipped'],stats['failed']
+
+
+def test_npy_skips_up_to_date_outputs(tmpdir):
+    paths = _experiments(str(tmpdir.join('data')),(1,2))
+    out_dir = str(tmpdir.join('out'))
+    assert _counts(convert(paths,out_dir,jobs=2)) == (2,0,0)
+    with np.load(os.path.join(out_dir,'sample','1.npz')) as stored:
+        assert np.array_equal(stored['fid'][:3],[-426-11263j,-512-3661j,-817-2120j])
+
+    assert _counts(convert(paths,out_dir)) == (0,2,0)
+    _touch(paths[1])
+    assert _counts(convert(paths,out_dir)) == (1,1,0)
+    # different options, or forced
+    assert _counts(convert(paths,out_dir,dtype=np.complex64)) == (2,0,0)
+    assert _counts(convert(paths,out_dir,dtype=np.complex64,force=True)) == (2,0,0)
+
+
+def test_columnar_appends_new_and_rebuilds_changed(tmpdir):
+    root = str(tmpdir.join('data'))
+    out_dir = str(tmpdir.join('out'))
+    paths = _experiments(root,(1,2))
+    assert _counts(convert(paths,out_dir,format='columnar')) == (2,0,0)
+    assert _counts(convert(paths,out_dir,format='columnar')) == (0,2,0)
+
+    paths = _experiments(root,(1,2,3))
+    assert _counts(convert(paths,out_dir,format='columnar')) == (1,2,0)
+    reader = ColumnarReader(out_dir)
+    assert list(reader['path']) == [os.path.abspath(p) for p in paths]
+
+    _touch(paths[0])
+    assert _counts(convert(paths,out_dir,format='columnar')) == (3,0,0)
+    assert len(ColumnarReader(out_dir)) == 3
+    assert _counts(convert(paths,out_dir,format='columnar',ft=True)) == (3,0,0)
+    assert _counts(convert(paths,out_dir,format='columnar',ft=True)) == (0,3,0)
+
+
+def test_columnar_reports_experiment_that_does_not_fit(tmpdir):
+    paths = _experiments(str(tmpdir.join('data')),(1,2,3))
+    fid_fp = os.path.join(paths[1],'fid')
+    with open(fid_fp,'rb') as f:
+        raw = f.read()
+    with open(fid_fp,'wb') as f:
+        f.write(raw[:len(raw)//2])
+    out_dir = str(tmpdir.join('out'))
+    stats = convert(paths,out_dir,format='columnar')
+    assert _counts(stats) == (2,0,1)
+    assert list(stats['errors']) == [paths[1]]
+    assert list(ColumnarReader(out_dir)['path']) == [os.path.abspath(paths[0]),os.path.abspath(paths[2])]
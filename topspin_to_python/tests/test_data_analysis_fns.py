@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_data_analysis_fns.py: Tests of the batched lorentzian fitting
+
+import numpy as np
+
+from fid import FID
+from data_analysis_fns import fit_lorentzians, lorentzian, _guess_lorentzians
+
+
+def _line(n,dwell,f0,phase,width=15.9,noise=0.,seed=0):
+    t = np.arange(n)*dwell
+    fid = np.exp(2j*np.pi*f0*t-np.pi*width*t)*np.exp(1j*phase)
+    rng = np.random.RandomState(seed)
+    fid = fid+noise*(rng.normal(size=n)+1j*rng.normal(size=n))
+    return FID(fid,sfo=400E6,dwell=dwell).ft()
+
+
+def test_fft_of_decaying_exponential_is_lorentzian():
+    ft = _line(4096,1E-4,300.,0.)
+    # half the first fid point is a flat baseline, the line has area 1/(2*dwell)
+    model = lorentzian(ft.freqs,5E3,0.,15.9,300.)
+    assert np.abs(ft.ft-model).max() < 0.02*np.abs(model).max()
+
+
+def test_width_guess_from_half_height():
+    ft = _line(4096,1E-4,300.,1.)
+    p = _guess_lorentzians(ft.freqs,np.atleast_2d(ft.ft),1,None)
+    assert np.isclose(p[0,0,2],15.9,rtol=0.1)
+
+
+def test_narrow_line_far_from_carrier():
+    # diverged from the former 1000 Hz width guess
+    ft = _line(2048,1.5E-4,2500.,-2.,noise=1E-3)
+    popt,_ = ft.fit_lorentzians()
+    assert np.isclose(popt[0,2],15.9,rtol=0.05)
+    assert np.isclose(popt[0,3],2500.,atol=0.5)
+    assert np.isclose(ft.apk(use_lorentzian=True).phase,2.,atol=0.02)
+
+
+def test_widths_stay_positive():
+    ft = _line(2048,1.5E-4,2500.,-2.,noise=1E-3,seed=1)
+    # a fixed 1000 Hz width guess, which stepped to a negative width
+    p0 = _guess_lorentzians(ft.freqs,np.atleast_2d(ft.ft),1,1000.)
+    popt,_ = fit_lorentzians(ft.freqs,ft.ft,p0=p0)
+    assert popt[0,0,2] > 0
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_experiment_reader.py: Tests of reading TopSpin experiment folders
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from experiment_reader import read_experiment, read_dataset, iter_experiments
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+def test_sample_decoded_with_acqus_layout():
+    # acqu holds BYTORDA 0 from the setup, acqus the big-endian BYTORDA 1 acquired
+    experiment = read_experiment(EXAMPLE)
+    fid = experiment['fid']
+    assert fid.fid.shape == (32768,)
+    assert np.array_equal(fid.fid[:3],[-426-11263j,-512-3661j,-817-2120j])
+    assert np.isclose(fid.sfo,174106019.9)
+
+
+def test_sample_decoded_as_complex64():
+    fid = read_experiment(EXAMPLE,dtype=np.complex64,mmap=True)['fid']
+    assert fid.fid.dtype == np.complex64
+    assert np.array_equal(fid.fid[:3],[-426-11263j,-512-3661j,-817-2120j])
+
+
+def test_group_delay_from_acqus(tmpdir):
+    exp_fp = str(tmpdir.join('1'))
+    shutil.copytree(EXAMPLE,exp_fp)
+    acqus_fp = os.path.join(exp_fp,'acqus')
+    with open(acqus_fp) as f:
+        text = f.read()
+    with open(acqus_fp,'w') as f:
+        f.write(text.replace('##$DECIM= 1\n','##$DECIM= 16\n'))
+    # acqu has DSPFVS 0, which has no filter delay
+    experiment = read_experiment(exp_fp)
+    assert experiment['acqu']['group_delay'] == 69.53125
+
+
+def _dataset(root):
+    """
+    Copies of the sample as expnos 1 to 4, with an unreadable TD in 2 and
+    half the fid of 3
+    """
+    for expno in range(1,5):
+        shutil.copytree(EXAMPLE,os.path.join(root,str(expno)))
+    acqus_fp = os.path.join(root,'2','acqus')
+    with open(acqus_fp) as f:
+        text = f.read()
+    with open(acqus_fp,'w') as f:
+        f.write(text.replace('##$TD= 65536\n','##$TD= abc\n'))
+    fid_fp = os.path.join(root,'3','fid')
+    with open(fid_fp,'rb') as f:
+        raw = f.read()
+    with open(fid_fp,'wb') as f:
+        f.write(raw[:len(raw)//2])
+    return root
+
+
+@pytest.mark.parametrize('workers,executor',[(1,'thread'),(3,'thread'),(3,'process')])
+def test_read_dataset_collects_errors(tmpdir,workers,executor):
+    dataset = read_dataset(_dataset(str(tmpdir)),workers=workers,executor=executor)
+    assert dataset['expnos'] == [1,3,4]
+    assert list(dataset['errors']) == [2]
+    assert isinstance(dataset['errors'][2],ValueError)
+    assert [e['fid'].fid.shape for e in dataset['experiments']] == [(32768,),(16384,),(32768,)]
+    assert 'fid' not in dataset
+
+
+@pytest.mark.parametrize('workers',[1,3])
+def test_read_dataset_stacks_matching_fids(tmpdir,workers):
+    dataset = read_dataset(_dataset(str(tmpdir)),workers=workers,stack=True)
+    assert dataset['expnos'] == [1,4]
+    assert sorted(dataset['errors']) == [2,3]
+    assert 'does not match' in str(dataset['errors'][3])
+    stacked = dataset['fid']
+    assert stacked.fid.shape == (2,32768)
+    assert np.array_equal(stacked.fid[1,:3],[-426-11263j,-512-3661j,-817-2120j])
+    assert np.isclose(stacked.sfo,174106019.9)
+    assert all('fid' not in e for e in dataset['experiments'])
+
+
+@pytest.mark.parametrize('prefetch',[0,1,4])
+def test_iter_experiments_in_order_skipping_errors(tmpdir,prefetch):
+    root = _dataset(str(tmpdir))
+    paths = [os.path.join(root,str(expno)) for expno in (4,3,2,1)]
+    read = list(iter_experiments(paths,prefetch=prefetch,on_error='skip'))
+    assert [exp_fp for exp_fp,_ in read] == [paths[0],paths[1],paths[3]]
+    assert [e['fid'].fid.shape for _,e in read] == [(32768,),(16384,),(32768,)]
+
+
+def test_iter_experiments_raises_in_order(tmpdir):
+    root = _dataset(str(tmpdir))
+    experiments = iter_experiments([os.path.join(root,str(expno)) for expno in (1,2,3)])
+    assert next(experiments)[0] == os.path.join(root,'1')
+    with pytest.raises(ValueError):
+        next(experiments)
+
+
+def test_iter_experiments_reads_at_most_prefetch_ahead():
+    consumed = []
+    def paths():
+        for i in range(10):
+            consumed.append(i)
+            yield EXAMPLE
+    experiments = iter_experiments(paths(),prefetch=2,load_fid=False)
+    next(experiments)
+    # the one yielded and two read ahead
+    assert len(consumed) == 3
+    assert len(list(experiments)) == 9
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_fid.py: Tests of the phasing of fourier transforms
+
+import numpy as np
+
+from fid import FID
+
+
+def _fid(n=1024,dwell=1E-4):
+    t = np.arange(n)*dwell
+    signal = np.exp(2j*np.pi*1200*t-t/0.02)+0.5*np.exp(-2j*np.pi*2500*t-t/0.01)
+    return FID(signal*np.exp(0.7j),sfo=400E6,dwell=dwell)
+
+
+def test_phased_tracks_first_order_phase():
+    ft = _fid().ft().phased(0.3,1.1).phased(0.2,-0.4)
+    assert np.isclose(ft.phase,0.5)
+    assert np.isclose(ft.ph1,0.7)
+
+
+def test_ift_undoes_first_order_phase():
+    fid = _fid()
+    back = fid.ft(keep_fid=False).phased(0.4,2.).ift()
+    assert np.allclose(back.fid,fid.fid)
+
+
+def test_minimize_keeps_first_order_phase():
+    ft = _fid().ft(keep_fid=False).phased(ph1=1.5)
+    phased = ft.apk(method='minimize')
+    assert np.isclose(phased.ph1,1.5)
+    assert np.allclose(phased.ft,ft.phased(phased.phase-ft.phase).ft)
+
+
+def test_first_order_region_excludes_bounds():
+    ft = _fid().ft()
+    freqs = ft.freqs
+    # bounds on points, which region leaves out
+    left,right = freqs[100],freqs[900]
+    lo,hi = ft.region_bounds(left,right)
+    assert (lo,hi) == (101,900)
+    expected = ft.region(left,right)
+    assert len(expected.ft) == hi-lo
+    a = ft.apk(left=left,right=right,method='first_order')
+    b = ft.apk(left=freqs[100]+ft.df/2,right=freqs[899]+ft.df/2,method='first_order')
+    assert np.allclose(a.ft,b.ft)
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_instrumentation.py: Tests of the opt-in timing spans and counters
+
+import os
+import shutil
+
+import pytest
+
+import instrumentation
+from experiment_reader import read_experiment, read_dataset
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+@pytest.fixture(autouse=True)
+def clean_instrumentation():
+    instrumentation.disable()
+    instrumentation.reset()
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_disabled_records_nothing():
+    read_experiment(EXAMPLE)
+    with instrumentation.span('outer'):
+        instrumentation.add('calls')
+    assert instrumentation.summary() == {'spans':{},'counters':{}}
+
+
+def test_enabled_records_reads():
+    instrumentation.enable()
+    read_experiment(EXAMPLE)
+    summary = instrumentation.summary()
+    assert summary['spans']['read_experiment']['count'] == 1
+    assert summary['spans']['parse_acqu']['count'] >= 2
+    # the int32 fid of the sample
+    assert summary['counters']['bytes_read'] == 262144
+
+
+def test_merge_adds_counts_and_keeps_extremes():
+    instrumentation.enable()
+    instrumentation.merge({'spans':{'fft':{'count':2,'total':3.,'min':1.,'max':2.}},'counters':{'n':1}})
+    instrumentation.merge({'spans':{'fft':{'count':1,'total':0.5,'min':0.5,'max':0.5}},'counters':{'n':2}})
+    summary = instrumentation.summary()
+    assert summary['spans']['fft'] == {'count':3,'total':3.5,'mean':3.5/3,'min':0.5,'max':2.}
+    assert summary['counters'] == {'n':3}
+
+
+def test_process_pool_records_merged(tmpdir):
+    root = str(tmpdir)
+    for expno in (1,2,3):
+        shutil.copytree(EXAMPLE,os.path.join(root,str(expno)))
+    instrumentation.enable()
+    read_dataset(root,workers=1)
+    serial = instrumentation.summary()
+    instrumentation.reset()
+
+    read_dataset(root,workers=2,executor='process')
+    merged = instrumentation.summary()
+    assert merged['spans']['read_experiment']['count'] == 3
+    assert merged['counters'] == serial['counters']
+    assert dict((name,s['count']) for name,s in merged['spans'].items()) == \
+        dict((name,s['count']) for name,s in serial['spans'].items())
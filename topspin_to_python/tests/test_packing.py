@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_packing.py: Tests of the lossless packed fid/ser archives
+
+import itertools
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from fid import _raw_dtype, _row_size
+from packing import pack_raw, unpack_raw, read_packed, pack_experiment, _read_index
+from experiment_reader import read_experiment
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+try:
+    import lzma
+    CODECS = ['zlib','lzma']
+except ImportError:
+    CODECS = ['zlib']
+
+
+def _write_ser(fp,td,n_rows,bytorda,dtypa,block_size):
+    """
+    Raw rows of noise and a decaying signal, zero padded to block_size bytes
+    """
+    raw_dtype = _raw_dtype(bytorda,dtypa)
+    rows = np.zeros((n_rows,_row_size(td,raw_dtype,block_size)),dtype=raw_dtype)
+    rng = np.random.RandomState(0)
+    values = 1E5*np.exp(-np.arange(td)/30.)*np.cos(np.arange(td))+rng.normal(0,50,(n_rows,td))
+    if raw_dtype.kind == 'i':
+        values = np.round(values)
+    rows[:,:td] = values
+    rows.tofile(fp)
+    return rows
+
+
+@pytest.mark.parametrize('filter,codec,delta,dtypa',
+                         list(itertools.product(['shuffle','bitshuffle'],CODECS,[False,True],[0,2])))
+def test_round_trip(tmpdir,filter,codec,delta,dtypa):
+    # a TD that is not a multiple of 8, in rows padded to 1024 bytes
+    td,n_rows = 100,3
+    raw_fp,packed_fp,restored_fp = [str(tmpdir.join(name)) for name in ('ser','ser.packed','restored')]
+    rows = _write_ser(raw_fp,td,n_rows,1,dtypa,1024)
+    pack_raw(raw_fp,packed_fp,td,bytorda=1,dtypa=dtypa,codec=codec,filter=filter,delta=delta)
+
+    unpack_raw(packed_fp,restored_fp)
+    with open(raw_fp,'rb') as f1, open(restored_fp,'rb') as f2:
+        assert f1.read() == f2.read()
+
+    stack = read_packed(packed_fp,rows=[2,0])
+    assert np.array_equal(stack.fid.real,rows[[2,0],:td:2])
+    assert np.array_equal(stack.fid.imag,rows[[2,0],1:td:2])
+
+
+@pytest.mark.parametrize('td',[100,1500])
+def test_bitshuffle_1d_fid(tmpdir,td):
+    raw_fp,packed_fp = str(tmpdir.join('fid')),str(tmpdir.join('fid.packed'))
+    rows = _write_ser(raw_fp,td,1,0,0,0)
+    pack_raw(raw_fp,packed_fp,td,bytorda=0,block_size=0,filter='bitshuffle')
+    fid = read_packed(packed_fp)
+    assert np.array_equal(fid.fid.real,rows[0,0::2])
+    assert np.array_equal(fid.fid.imag,rows[0,1::2])
+
+
+def test_pack_experiment_uses_acqus_byte_order(tmpdir):
+    exp_fp = str(tmpdir.join('1'))
+    shutil.copytree(EXAMPLE,exp_fp)
+    expected = read_experiment(exp_fp)['fid'].fid
+    packed_fp = pack_experiment(exp_fp,remove=True)
+    # acqu holds the setup BYTORDA 0, acqus the big-endian BYTORDA 1 acquired
+    assert _read_index(packed_fp)['bytorda'] == 1
+    assert not os.path.isfile(os.path.join(exp_fp,'fid'))
+    assert np.array_equal(read_experiment(exp_fp)['fid'].fid,expected)
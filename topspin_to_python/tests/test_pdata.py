@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_pdata.py: Tests of reading TopSpin processed spectra
+
+import os
+
+import numpy as np
+
+from pdata import read_pdata, pdata_axis
+
+
+def _write_procs(fp,**pars):
+    with open(fp,'w') as f:
+        f.write('##TITLE= Parameter file\n')
+        for name,value in sorted(pars.items()):
+            f.write('##${0}= {1}\n'.format(name.upper(),value))
+        f.write('##END=\n')
+
+
+def _proc_dir(tmpdir):
+    proc_fp = str(tmpdir.join('1','pdata','1'))
+    os.makedirs(proc_fp)
+    return proc_fp
+
+
+def test_1d_byte_order_scaling_and_axis(tmpdir):
+    proc_fp = _proc_dir(tmpdir)
+    # big-endian int32 points, stored from the highest frequency down
+    _write_procs(os.path.join(proc_fp,'procs'),si=8,bytordp=1,dtypp=0,nc_proc=2,
+                 offset=10.,sw_p=4000.,sf=400.)
+    stored = np.arange(8)*1000-3000
+    stored.astype('>i4').tofile(os.path.join(proc_fp,'1r'))
+    (-stored).astype('>i4').tofile(os.path.join(proc_fp,'1i'))
+
+    spectrum = read_pdata(str(tmpdir.join('1')))
+    assert np.array_equal(spectrum.ft.real,4*stored[::-1])
+    assert np.array_equal(spectrum.ft.imag,-4*stored[::-1])
+    assert spectrum.sfo == 400E6
+    # OFFSET is the ppm of the first stored point, SW_p spans the 8 points
+    assert np.allclose(spectrum.freqs,500.+500.*np.arange(8))
+    ppm = pdata_axis(os.path.join(proc_fp,'procs'))
+    assert np.isclose(ppm[-1],10.) and np.allclose(np.diff(ppm),1.25)
+
+
+def test_1d_real_float_without_scaling(tmpdir):
+    proc_fp = _proc_dir(tmpdir)
+    _write_procs(os.path.join(proc_fp,'procs'),si=4,bytordp=0,dtypp=2,nc_proc=0,
+                 offset=1.,sw_p=400.,sf=100.)
+    stored = np.array([1.5,-2.,3.25,4.])
+    stored.astype('<f8').tofile(os.path.join(proc_fp,'1r'))
+    stored.astype('<f8').tofile(os.path.join(proc_fp,'1i'))
+
+    spectrum = read_pdata(str(tmpdir.join('1')),imag=False)
+    assert spectrum.ft.dtype == np.float64
+    assert np.array_equal(spectrum.ft,stored[::-1])
+
+
+def test_2d_untiled(tmpdir):
+    proc_fp = _proc_dir(tmpdir)
+    _write_procs(os.path.join(proc_fp,'procs'),si=8,xdim=4,bytordp=0,dtypp=0,nc_proc=-1,
+                 offset=10.,sw_p=4000.,sf=400.)
+    _write_procs(os.path.join(proc_fp,'proc2s'),si=4,xdim=2,bytordp=0,dtypp=0,nc_proc=-1,
+                 offset=150.,sw_p=1000.,sf=100.)
+    # points of the F1 x F2 spectrum, stored as 2 x 2 tiles of 2 x 4 points
+    stored = 100*np.arange(4)[:,np.newaxis]+np.arange(8)
+    tiles = stored.reshape(2,2,2,4).transpose(0,2,1,3)
+    tiles.astype('<i4').tofile(os.path.join(proc_fp,'2rr'))
+
+    spectrum = read_pdata(str(tmpdir.join('1')))
+    assert spectrum.ft.shape == (4,8)
+    assert np.array_equal(spectrum.ft,0.5*stored[::-1,::-1])
+    assert np.isclose(pdata_axis(os.path.join(proc_fp,'proc2s'))[-1],150.)
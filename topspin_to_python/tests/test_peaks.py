@@ -0,0 +1,33 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_peaks.py: Tests of the vectorized peak picking
+
+import numpy as np
+
+from data_analysis_fns import lorentzian
+from peaks import pick_peaks, peak_guesses
+
+
+def test_inverted_peak_guess_is_negative():
+    freqs = np.linspace(-1000,1000,4001)
+    spectrum = lorentzian(freqs,100.,0.,10.,-300.)-lorentzian(freqs,50.,0.,10.,400.)
+    found = pick_peaks(spectrum,freqs,threshold=0.5,real=False)
+    assert np.allclose(found['position'],[-300.,400.],atol=1.)
+    assert found['height'][0] > 0 > found['height'][1]
+
+    p0 = peak_guesses(found)
+    assert np.isclose(p0[0,0]/p0[1,0],-2.,rtol=0.05)
+    assert np.all(p0[:,1] == 0)
+
+
+def test_width_from_half_height_crossings():
+    # a 20 Hz line sampled every 0.25 Hz at an snr of 200, whose 3 point curvature is mostly noise
+    freqs = np.arange(-500,500,0.25)
+    spectrum = lorentzian(freqs,100.,0.,20.,30.).real
+    height = spectrum.max()
+    spectrum = spectrum+np.random.RandomState(0).normal(0,height/200.,len(freqs))
+    found = pick_peaks(spectrum,freqs,window=40)
+    assert len(found) == 1
+    assert np.isclose(found['width'][0],20.,rtol=0.05)
+    assert np.isclose(found['position'][0],30.,atol=0.25)
@@ -0,0 +1,30 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_processing.py: Tests of the fid processing pipeline
+
+import numpy as np
+
+from processing import Pipeline, _sine
+
+
+def test_sine_bell_ssb_0_and_1_are_pure_sine():
+    t = np.linspace(0,1,101)
+    pure = np.sin(np.pi*t)
+    for ssb in (0,1):
+        window = _sine(t,ssb=ssb)
+        assert np.any(window != 0)
+        assert np.allclose(window,pure)
+
+
+def test_sine_bell_ssb_2_is_cosine():
+    t = np.linspace(0,1,101)
+    assert np.allclose(_sine(t,ssb=2),np.cos(np.pi/2*t))
+
+
+def test_sine_bell_ssb_1_spectrum_is_not_zero():
+    dwell = 1E-4
+    t = np.arange(256)*dwell
+    fid = np.exp(2j*np.pi*500*t-t/0.01)
+    spectrum,_ = Pipeline().apodize('sine',ssb=1).transform(fid,dwell)
+    assert np.abs(spectrum).max() > 0
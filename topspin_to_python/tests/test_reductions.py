@@ -0,0 +1,33 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_reductions.py: Tests of the out-of-core reductions over ser rows
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from reductions import reduce_fids, _read_rows, _source
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+@pytest.fixture
+def ser_exp(tmpdir):
+    exp_fp = str(tmpdir.join('1'))
+    os.makedirs(exp_fp)
+    shutil.copy(os.path.join(EXAMPLE,'acqus'),exp_fp)
+    raw = np.fromfile(os.path.join(EXAMPLE,'fid'),dtype='>i4')
+    np.concatenate([raw*(i+1) for i in range(5)]).astype('>i4').tofile(os.path.join(exp_fp,'ser'))
+    return exp_fp
+
+
+@pytest.mark.parametrize('rows',[[0,3,2],[4],slice(0,None,2),slice(None,None,-1)])
+def test_reduce_selected_rows(ser_exp,rows):
+    all_rows = _read_rows(_source(ser_exp),np.arange(5),np.complex128)
+    for executor in ('thread','process'):
+        result = reduce_fids([ser_exp],rows=rows,block_rows=2,workers=2,executor=executor)
+        assert result['count'] == len(all_rows[rows])
+        assert np.allclose(result['mean'].fid,all_rows[rows].mean(0))
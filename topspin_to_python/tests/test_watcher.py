@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_watcher.py: Tests of the incremental reader of experiments being acquired
+
+import os
+import shutil
+import time
+
+import numpy as np
+
+from watcher import AcquisitionWatcher
+
+EXAMPLE = os.path.join(os.path.dirname(__file__),'test_exps','1d_example_experiment')
+
+
+def _write_scans(exp_fp,raw,n_scans,age):
+    """
+    Rewrite the fid in place with the sum of n_scans scans, modified age seconds ago
+    """
+    fid_fp = os.path.join(exp_fp,'fid')
+    with open(fid_fp,'r+b' if os.path.isfile(fid_fp) else 'wb') as f:
+        f.write((raw*n_scans).astype('>i4').tobytes())
+    mtime = time.time()-age
+    for name in ('fid','acqus'):
+        os.utime(os.path.join(exp_fp,name),(mtime,mtime))
+
+
+def test_fid_rewritten_between_polls(tmpdir):
+    exp_fp = str(tmpdir.join('1'))
+    os.makedirs(exp_fp)
+    shutil.copy(os.path.join(EXAMPLE,'acqus'),exp_fp)
+    raw = np.fromfile(os.path.join(EXAMPLE,'fid'),dtype='>i4')
+    watcher = AcquisitionWatcher(exp_fp,settle=10.)
+
+    _write_scans(exp_fp,raw,1,age=0)
+    first = watcher.poll()
+    assert (first['start'],first['stop']) == (0,1)
+    assert not watcher.done
+    assert watcher.poll() is None
+
+    _write_scans(exp_fp,raw,2,age=0)
+    second = watcher.poll()
+    assert (second['start'],second['stop']) == (0,1)
+    assert watcher.n_rows == 1
+    assert np.allclose(second['total'].ft,2*first['total'].ft)
+    assert not watcher.done
+
+    _write_scans(exp_fp,raw,4,age=20)
+    final = watcher.poll()
+    assert watcher.done
+    assert watcher.poll() is None
+    assert np.allclose(final['total'].ft,4*first['total'].ft)
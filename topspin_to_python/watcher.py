@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# watcher.py: Incremental reader of experiments that are still being acquired
+
+
+#use __all__ to restrict what globals are visible to external modules.
+__all__ = [
+    'AcquisitionWatcher'
+]
+
+## IMPORTS ####################################################################
+import numpy as np
+import os
+import time
+from fid import FIDStack, FT, _raw_dtype, _row_size, _interleaved_to_complex
+from acqu_pars import read_acqu_pars
+from processing import Pipeline
+
+#acquisition parameters the watcher needs to decode rows
+_WATCH_PARS = ['td','sw_h','bytorda','dtypa','recchan']+['sfo{0}'.format(i) for i in range(1,9)]
+
+
+## CLASSES ####################################################################
+class AcquisitionWatcher(object):
+    """
+    Incremental reader of an experiment folder that the spectrometer is still
+    writing. The watcher remembers the byte offset it has read up to, and each
+    :any:`poll` reads only the complete ``ser`` rows (or scans) appended since,
+    transforms them with one pipeline and adds them to the running sum
+    spectrum and region integrals. TopSpin accumulates the scans of a 1D
+    ``fid`` in place, so a fid is read again whenever it or the acquisition
+    status files change, replacing the earlier read, and is complete once none
+    of them has been modified for settle seconds.
+
+    Updates are dictionaries with keys:
+
+    - 'start','stop': Row numbers of the new rows
+    - 'ft': :class:`fid.FT` of the new rows, shape (n_new,n)
+    - 'integrals': Integrals of the new rows, shape (n_new,n_regions), or None
+      without regions
+    - 'total': :class:`fid.FT` of the sum of all rows read so far
+
+    :param exp_fp: File path to experiment folder
+    :type exp_fp: str
+    :param pipeline: Processing applied to each new row, by default a plain FFT.
+                The phase must be a single value.
+    :type pipeline: :class:`processing.Pipeline`
+    :param regions: (left,right) bounds of regions to integrate, see :any:`fid.FT.integrate_regions`
+    :type regions: list
+    :param ppm: Whether the region bounds are given in ppm
+    :type ppm: bool
+    :param dtype: Complex dtype of the decoded rows
+    :type dtype: :class:`numpy.dtype`
+    :param block_size: Size in bytes of the blocks TopSpin pads ser rows to, see :any:`fid.read_ser`
+    :type block_size: int
+    :param settle: Seconds a 1D fid and its acquisition status files must be
+                left unmodified to be complete
+    :type settle: float
+    """
+
+    def __init__(self,exp_fp,pipeline=None,regions=None,ppm=False,dtype=np.complex128,
+                 block_size=1024,settle=5.):
+        self._exp_fp = exp_fp
+        self.pipeline = pipeline if pipeline is not None else Pipeline()
+        self.regions = list(regions) if regions is not None else []
+        self.ppm = ppm
+        self.dtype = dtype
+        self.block_size = block_size
+        self.settle = settle
+        self._source = None
+        self.reset()
+
+    @property
+    def exp_fp(self):
+        return self._exp_fp
+
+    @property
+    def offset(self):
+        """
+        Byte offset in the raw file read up to
+        """
+        return self._offset
+
+    @property
+    def n_rows(self):
+        """
+        Number of rows read so far
+        """
+        return self._n_rows
+
+    @property
+    def expected_rows(self):
+        """
+        Number of rows of the complete acquisition, None if unknown
+        """
+        return None if self._source is None else self._source['expected']
+
+    @property
+    def done(self):
+        """
+        Whether all expected rows have been read, and a 1D fid has settled
+        """
+        if self._source is not None and not self._source['is_ser']:
+            return self._settled
+        expected = self.expected_rows
+        return expected is not None and self._n_rows >= expected
+
+    def reset(self):
+        """
+        Forget all rows read, so the next poll reads the raw file from the start.
+        """
+        self._offset = 0
+        self._n_rows = 0
+        self._stamp = None
+        self._settled = False
+        self._sum = None
+        self._axis = None
+        self._integrals = []
+
+    def poll(self):
+        """
+        Read the rows appended since the last poll, or the whole 1D fid again
+        if it was rewritten.
+
+        :return: update, see :class:`AcquisitionWatcher`, or None if there are no new complete rows
+        :rtype: dict
+        """
+        source = self._find_source()
+        if source is None:
+            return None
+        try:
+            size = os.path.getsize(source['fp'])
+        except OSError:
+            return None
+        if not source['is_ser']:
+            if not self._fid_changed(source,size):
+                return None
+            # scans are accumulated in place, so the whole fid is read again
+            stamp,settled = self._stamp,self._settled
+            self.reset()
+            self._stamp,self._settled = stamp,settled
+        elif size < self._offset:
+            # the raw file was restarted, e.g. by a new acquisition
+            self.reset()
+
+        row_bytes = source['row_bytes']
+        n_new = (size-self._offset)//row_bytes
+        if source['expected'] is not None:
+            n_new = min(n_new,source['expected']-self._n_rows)
+        if n_new <= 0:
+            return None
+        with open(source['fp'],'rb') as f:
+            f.seek(self._offset)
+            buf = f.read(n_new*row_bytes)
+        n_new = len(buf)//row_bytes
+        if n_new == 0:
+            # read again at the next poll
+            self._stamp = None
+            return None
+
+        raw = np.frombuffer(buf,dtype=source['raw_dtype'],count=n_new*source['row_size'])
+        raw = raw.reshape(n_new,source['row_size'])[:,:source['td']]
+        fids = FIDStack(_interleaved_to_complex(raw,self.dtype),sfo=source['sfo'],
+                        copy=False,dwell=source['dwell'])
+        ft = fids.process(self.pipeline,keep_fid=False)
+
+        integrals = None
+        if self.regions:
+            integrals = ft.integrate_regions(self.regions,ppm=self.ppm)
+            self._integrals.append(integrals)
+        row_sum = np.sum(ft.ft,axis=0)
+        if self._sum is None:
+            self._sum = row_sum
+            self._axis = (ft.f0,ft.df)
+        else:
+            # a new array, so totals of earlier updates are left unchanged
+            self._sum = self._sum+row_sum
+
+        start = self._n_rows
+        self._offset += n_new*row_bytes
+        self._n_rows += n_new
+        return {'start':start,'stop':self._n_rows,'ft':ft,'integrals':integrals,
+                'total':self.total()}
+
+    def watch(self,interval=1.,timeout=None,callback=None):
+        """
+        Generator of updates as rows are acquired, see :any:`poll`. Stops once
+        all expected rows have been read, or when no new rows arrive for timeout
+        seconds.
+
+        :param interval: Seconds to wait between polls
+        :type interval: float
+        :param timeout: Seconds without new rows to stop after, None to wait
+                    until the acquisition is complete
+        :type timeout: float
+        :param callback: Function called with each update before it is yielded
+        :type callback: callable
+        """
+        last = time.time()
+        while not self.done:
+            update = self.poll()
+            if update is None:
+                if timeout is not None and time.time()-last > timeout:
+                    return
+                time.sleep(interval)
+                continue
+            last = time.time()
+            if callback is not None:
+                callback(update)
+            yield update
+
+    def run(self,callback=None,interval=1.,timeout=None):
+        """
+        Read rows until the acquisition is complete, see :any:`watch`.
+
+        :param callback: Function called with each update
+        :type callback: callable
+        :return: Sum spectrum of all rows, None if no rows were read
+        :rtype: :class:`fid.FT`
+        """
+        for _ in self.watch(interval,timeout,callback):
+            pass
+        return self.total()
+
+    def total(self):
+        """
+        Sum spectrum of all rows read so far, None before the first row.
+
+        :rtype: :class:`fid.FT`
+        """
+        if self._sum is None:
+            return None
+        f0,df = self._axis
+        return FT(self._sum,phase=_scalar_phase(self.pipeline.phase),sfo=self._source['sfo'],
+                  f0=f0,df=df)
+
+    def mean(self):
+        """
+        Mean spectrum of all rows read so far, None before the first row.
+
+        :rtype: :class:`fid.FT`
+        """
+        total = self.total()
+        if total is None:
+            return None
+        total.ft = total.ft/self._n_rows
+        return total
+
+    def integrals(self):
+        """
+        Region integrals of every row read so far. The integrals of the sum
+        spectrum are their sum over rows.
+
+        :return: Integrals, shape (n_rows,n_regions)
+        :rtype: :class:`numpy.ndarray`
+        """
+        if not self._integrals:
+            return np.zeros((0,len(self.regions)))
+        if len(self._integrals) > 1:
+            self._integrals = [np.concatenate(self._integrals)]
+        return self._integrals[0]
+
+    def _fid_changed(self,source,size):
+        """
+        Whether a complete 1D fid was modified since it was last read. Marks
+        it settled once its files have been left unmodified for settle seconds.
+        """
+        if size < source['row_bytes']:
+            return False
+        try:
+            stamp = tuple((os.path.getsize(fp),os.path.getmtime(fp))
+                          for fp in source['status_fps'] if os.path.isfile(fp))
+        except OSError:
+            return False
+        self._settled = time.time()-max(mtime for _,mtime in stamp) >= self.settle
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return True
+
+    def _find_source(self):
+        """
+        Raw file and row layout, found once the acquisition parameters and
+        raw file exist.
+        """
+        if self._source is not None:
+            return self._source
+        acqus_fp = os.path.join(self.exp_fp,'acqus')
+        if not os.path.isfile(acqus_fp):
+            acqus_fp = os.path.join(self.exp_fp,'acqu')
+        ser_fp = os.path.join(self.exp_fp,'ser')
+        fid_fp = os.path.join(self.exp_fp,'fid')
+        acqu2s_fp = os.path.join(self.exp_fp,'acqu2s')
+        is_ser = os.path.isfile(ser_fp) or os.path.isfile(acqu2s_fp)
+        if not os.path.isfile(acqus_fp) or not os.path.isfile(ser_fp if is_ser else fid_fp):
+            return None
+
+        pars = read_acqu_pars(acqus_fp,keys=_WATCH_PARS)
+        td = int(pars['td'])
+        raw_dtype = _raw_dtype(pars.get('bytorda',1),pars.get('dtypa',0))
+        row_size = _row_size(td,raw_dtype,self.block_size) if is_ser else td
+        expected = 1
+        if is_ser:
+            expected = None
+            if os.path.isfile(acqu2s_fp):
+                expected = int(read_acqu_pars(acqu2s_fp,keys=['td'])['td']) or None
+        aq = float(td)/pars['sw_h']/2
+        status_fps = [fid_fp]+[os.path.join(self.exp_fp,name) for name in ('acqus','acqu')]
+        self._source = {
+            'fp':ser_fp if is_ser else fid_fp,'is_ser':is_ser,'status_fps':status_fps,
+            'td':td,'raw_dtype':raw_dtype,
+            'row_size':row_size,'row_bytes':row_size*raw_dtype.itemsize,'expected':expected,
+            'sfo':pars['sfo{0}'.format(np.nonzero(pars['recchan'])[0][0])]*1E6,
+            'dwell':aq/(td//2-1) if td//2 > 1 else aq}
+        return self._source
+
+
+## METHODS ####################################################################
+def _scalar_phase(phase):
+    return phase if np.ndim(phase) == 0 else 0